@@ -2,6 +2,9 @@
 
 import json
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import jwt
 import psycopg2
 from psycopg2.extras import RealDictCursor
@@ -11,6 +14,27 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
 DEEPSEEK_API_KEY = os.environ.get('DEEPSEEK_API_KEY')
+PROMPT_VERSION = 'v2'
+
+# Иерархическое сжатие длинных материалов
+DIRECT_MAX_CHARS = 6000
+GROUP_MAX_CHARS = 16000
+SECTION_MAX_TOKENS = 700
+# ~13 групп по GROUP_MAX_CHARS: три волны первого уровня по LLM_CONCURRENCY запросов, одна второго
+# и итоговый запрос — до ~150 с при таймауте запроса 30 с; длиннее — генерируйте по диапазонам чанков
+MAX_SOURCE_CHARS = 200_000
+LLM_CONCURRENCY = int(os.environ.get('CHEAT_SHEET_LLM_CONCURRENCY', '6'))
+CHUNK_FETCH_BATCH = 20
+
+# Пакетная генерация по предмету
+BATCH_MAX_MATERIALS = 30
+BATCH_MAX_SOURCE_CHARS = 200_000
+
+# Общий предел одновременных запросов к LLM на весь вызов функции
+LLM_SEMAPHORE = threading.BoundedSemaphore(LLM_CONCURRENCY)
+# Больше потоков пакета, чем мест в LLM_SEMAPHORE, только ждали бы в очереди
+BATCH_MAX_CONCURRENCY = min(8, LLM_CONCURRENCY)
+BATCH_DEFAULT_CONCURRENCY = min(3, BATCH_MAX_CONCURRENCY)
 
 
 def verify_token(token: str) -> dict:
@@ -53,8 +77,43 @@ def check_premium_access(conn, user_id: int) -> dict:
     return {'has_access': False, 'reason': 'no_premium'}
 
 
-def get_material_content(conn, material_id: int, user_id: int) -> dict:
-    """Получает содержимое материала"""
+def iter_material_chunks(conn, material_id: int, start_index: int = 0, end_index: int = None, max_chars: int = None):
+    """Читает чанки материала серверным курсором и прекращает выборку, как только набран бюджет символов"""
+    cursor = conn.cursor(name=f'cheat_sheet_chunks_{material_id}')
+    cursor.itersize = CHUNK_FETCH_BATCH
+    try:
+        if end_index is not None:
+            cursor.execute(f'''
+                SELECT chunk_index, chunk_text FROM {SCHEMA_NAME}.document_chunks
+                WHERE material_id = %s AND chunk_index >= %s AND chunk_index < %s
+                ORDER BY chunk_index
+            ''', (material_id, start_index, end_index))
+        else:
+            cursor.execute(f'''
+                SELECT chunk_index, chunk_text FROM {SCHEMA_NAME}.document_chunks
+                WHERE material_id = %s AND chunk_index >= %s
+                ORDER BY chunk_index
+            ''', (material_id, start_index))
+        
+        used = 0
+        while True:
+            rows = cursor.fetchmany(CHUNK_FETCH_BATCH)
+            if not rows:
+                return
+            for chunk_index, chunk_text in rows:
+                if max_chars is not None:
+                    chunk_text = chunk_text[:max_chars - used]
+                used += len(chunk_text)
+                yield chunk_index, chunk_text
+                if max_chars is not None and used >= max_chars:
+                    return
+    finally:
+        cursor.close()
+
+
+def get_material_content(conn, material_id: int, user_id: int, max_chars: int = MAX_SOURCE_CHARS,
+                         start_chunk: int = 0, end_chunk: int = None) -> dict:
+    """Получает содержимое материала в пределах бюджета символов и (опционально) диапазона чанков"""
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     cursor.execute(f'''
         SELECT title, subject, recognized_text, total_chunks
@@ -63,38 +122,269 @@ def get_material_content(conn, material_id: int, user_id: int) -> dict:
     ''', (material_id, user_id))
     
     material = cursor.fetchone()
+    cursor.close()
     if not material:
         return None
     
-    # Если материал разбит на чанки, собираем их
+    material = dict(material)
+    
+    # Большие документы читаем по чанкам потоково, маленькие хранятся целиком в recognized_text
     if material.get('total_chunks') and material['total_chunks'] > 1:
+        material['chunks'] = [
+            text for _, text in iter_material_chunks(conn, material_id, start_chunk, end_chunk, max_chars)
+        ]
+        material['recognized_text'] = None
+    else:
+        material['chunks'] = [(material.get('recognized_text') or '')[:max_chars]]
+    
+    return material
+
+
+def get_material_fingerprint(conn, material_id: int, user_id: int) -> dict:
+    """Возвращает название, предмет, хэш и длину содержимого материала, не выгружая сам текст"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'''
+        SELECT m.title, m.subject,
+               md5(COALESCE(m.recognized_text, '') || COALESCE((
+                   SELECT string_agg(md5(dc.chunk_text), '' ORDER BY dc.chunk_index)
+                   FROM {SCHEMA_NAME}.document_chunks dc
+                   WHERE dc.material_id = m.id
+               ), '')) AS content_hash,
+               CASE WHEN m.total_chunks > 1 THEN COALESCE((
+                   SELECT SUM(length(dc.chunk_text))
+                   FROM {SCHEMA_NAME}.document_chunks dc
+                   WHERE dc.material_id = m.id
+               ), 0) ELSE COALESCE(length(m.recognized_text), 0) END AS source_chars
+        FROM {SCHEMA_NAME}.materials m
+        WHERE m.id = %s AND m.user_id = %s
+    ''', (material_id, user_id))
+    
+    material = cursor.fetchone()
+    cursor.close()
+    return dict(material) if material else None
+
+
+def scoped_content_hash(content_hash: str, chunk_start: int = 0, chunk_end: int = None,
+                        max_chars: int = MAX_SOURCE_CHARS) -> str:
+    """Ключ шпаргалки: по диапазону чанков или с урезанным бюджетом она хранится отдельно от полной"""
+    if not chunk_start and chunk_end is None and max_chars == MAX_SOURCE_CHARS:
+        return content_hash
+    return hashlib.md5(f"{content_hash}:{chunk_start}-{chunk_end}:{max_chars}".encode()).hexdigest()
+
+
+def find_saved_cheat_sheet(conn, user_id: int, material_id: int, content_hash: str) -> dict:
+    """Ищет сохранённую шпаргалку для текущей версии материала и промпта"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'''
+        SELECT id, material_id, title, subject, cheat_sheet, created_at, updated_at
+        FROM {SCHEMA_NAME}.cheat_sheets
+        WHERE user_id = %s AND material_id = %s AND content_hash = %s AND prompt_version = %s
+    ''', (user_id, material_id, content_hash, PROMPT_VERSION))
+    
+    sheet = cursor.fetchone()
+    cursor.close()
+    return dict(sheet) if sheet else None
+
+
+def save_cheat_sheet(conn, user_id: int, material_id: int, content_hash: str, material: dict, cheat_sheet: str) -> dict:
+    """Сохраняет шпаргалку; при повторной генерации перезаписывает текст"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'''
+        INSERT INTO {SCHEMA_NAME}.cheat_sheets
+            (user_id, material_id, content_hash, prompt_version, title, subject, cheat_sheet)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (material_id, content_hash, prompt_version) DO UPDATE
+        SET cheat_sheet = EXCLUDED.cheat_sheet, updated_at = CURRENT_TIMESTAMP
+        RETURNING id, created_at, updated_at
+    ''', (user_id, material_id, content_hash, PROMPT_VERSION,
+          material.get('title'), material.get('subject'), cheat_sheet))
+    
+    saved = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return dict(saved)
+
+
+def list_cheat_sheets(conn, user_id: int) -> list:
+    """Список сохранённых шпаргалок пользователя (без текста)"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'''
+        SELECT DISTINCT ON (material_id) id, material_id, title, subject, created_at, updated_at
+        FROM {SCHEMA_NAME}.cheat_sheets
+        WHERE user_id = %s
+        ORDER BY material_id, updated_at DESC
+    ''', (user_id,))
+    
+    sheets = [dict(s) for s in cursor.fetchall()]
+    cursor.close()
+    return sorted(sheets, key=lambda s: s['updated_at'], reverse=True)
+
+
+def get_cheat_sheet(conn, user_id: int, sheet_id: int = None, material_id: int = None) -> dict:
+    """Возвращает шпаргалку по id или последнюю шпаргалку материала"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    if sheet_id:
+        cursor.execute(f'''
+            SELECT id, material_id, title, subject, cheat_sheet, created_at, updated_at
+            FROM {SCHEMA_NAME}.cheat_sheets
+            WHERE id = %s AND user_id = %s
+        ''', (sheet_id, user_id))
+    else:
         cursor.execute(f'''
-            SELECT chunk_text FROM {SCHEMA_NAME}.document_chunks
-            WHERE material_id = %s
-            ORDER BY chunk_index
-        ''', (material_id,))
-        chunks = cursor.fetchall()
-        full_text = '\n\n'.join([chunk['chunk_text'] for chunk in chunks])
-        material['recognized_text'] = full_text
+            SELECT id, material_id, title, subject, cheat_sheet, created_at, updated_at
+            FROM {SCHEMA_NAME}.cheat_sheets
+            WHERE material_id = %s AND user_id = %s
+            ORDER BY updated_at DESC
+            LIMIT 1
+        ''', (material_id, user_id))
     
+    sheet = cursor.fetchone()
     cursor.close()
-    return dict(material)
+    return dict(sheet) if sheet else None
 
 
-def generate_cheat_sheet(material_data: dict) -> str:
-    """Генерирует шпаргалку через DeepSeek"""
+def call_deepseek(prompt: str, max_tokens: int) -> str:
+    """Один запрос к DeepSeek; при ошибке бросает исключение с понятным текстом"""
     if not DEEPSEEK_API_KEY:
-        return "Ошибка: не настроен ключ DeepSeek"
+        raise Exception("Ошибка: не настроен ключ DeepSeek")
     
     client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com", timeout=30.0)
     
-    text = material_data.get('recognized_text', '')[:6000]  # Берем первые 6000 символов
+    try:
+        with LLM_SEMAPHORE:
+            response = client.chat.completions.create(
+                model="deepseek-chat",
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=0.3
+            )
+        return response.choices[0].message.content
+    except Exception as e:
+        print(f"[CHEAT-SHEET] Ошибка DeepSeek: {e}")
+        error_str = str(e)
+        
+        # Человекопонятное сообщение об ошибке
+        if 'Insufficient Balance' in error_str or '402' in error_str:
+            raise Exception("⚠️ Шпаргалка временно недоступна: закончился баланс DeepSeek API. Попробуйте позже или обратитесь к администратору.")
+        elif 'timeout' in error_str.lower():
+            raise Exception("⏱️ Превышено время ожидания. Попробуйте с более коротким материалом.")
+        else:
+            raise Exception(f"❌ Ошибка генерации шпаргалки: {error_str[:200]}")
+
+
+def group_texts(texts: list, max_chars: int) -> list:
+    """Склеивает подряд идущие тексты в группы не длиннее max_chars, слишком длинные режет"""
+    groups = []
+    current = ''
+    for text in texts:
+        text = (text or '').strip()
+        while len(text) > max_chars:
+            if current:
+                groups.append(current)
+                current = ''
+            groups.append(text[:max_chars])
+            text = text[max_chars:]
+        if not text:
+            continue
+        if current and len(current) + len(text) + 2 > max_chars:
+            groups.append(current)
+            current = ''
+        current = f"{current}\n\n{text}" if current else text
+    if current:
+        groups.append(current)
+    return groups
+
+
+def condense_section(title: str, subject: str, section: str, index: int, total: int) -> str:
+    """Сжимает одну группу фрагментов до конспекта для последующего объединения"""
+    prompt = f"""Ты помощник студента. Это часть {index + 1} из {total} материала "{title}" {f'({subject})' if subject else ''}.
+
+Текст части:
+{section}
+
+Выпиши из этой части только то, что пригодится в шпаргалке:
+• ключевые термины с краткими определениями
+• формулы и правила
+• важные факты, даты, выводы
+
+Требования:
+- Максимум 200 слов
+- Без вступлений и повторов
+- Не додумывай того, чего нет в тексте"""
+    
+    return call_deepseek(prompt, SECTION_MAX_TOKENS)
+
+
+def condense_hierarchically(texts: list, title: str, subject: str) -> tuple:
+    """Сжимает длинный материал по уровням: группы параллельно конспектируются, пока текст не уложится в DIRECT_MAX_CHARS.
+    
+    Часть, на которой LLM упал, пропускается, а не обрывает всю шпаргалку. Возвращает (текст, покрытие):
+    покрытие — доля исходного текста, дошедшая до конспекта, и число пропущенных частей.
+    """
+    level = 0
+    total_chars = sum(len(t) for t in texts)
+    coverage = {'sections': 0, 'failed_sections': 0, 'ratio': 1.0}
+    
+    while total_chars > DIRECT_MAX_CHARS:
+        groups = group_texts(texts, GROUP_MAX_CHARS)
+        level += 1
+        print(f"[CHEAT-SHEET] Уровень {level}: {len(groups)} групп, {total_chars} символов")
+        
+        def condense(item):
+            try:
+                return condense_section(title, subject, item[1], item[0], len(groups)), None
+            except Exception as e:
+                print(f"[CHEAT-SHEET] Уровень {level}, часть {item[0] + 1}/{len(groups)} пропущена: {e}")
+                return None, e
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(LLM_CONCURRENCY, len(groups)))) as pool:
+            condensed = list(pool.map(condense, enumerate(groups)))
+        
+        texts = [text for text, _ in condensed if text is not None]
+        failed = [group for group, (text, _) in zip(groups, condensed) if text is None]
+        if not texts:
+            # Ни одна часть не сжалась — это уже ошибка генерации, а не неполная шпаргалка
+            raise condensed[0][1]
+        
+        coverage['sections'] += len(groups)
+        coverage['failed_sections'] += len(failed)
+        # Потеря на верхнем уровне оценивается долей символов упавших групп этого уровня
+        coverage['ratio'] *= 1 - sum(len(g) for g in failed) / sum(len(g) for g in groups)
+        
+        condensed_chars = sum(len(t) for t in texts)
+        # Если сжатие перестало уменьшать текст, дальше не идём
+        if condensed_chars >= total_chars or len(groups) == 1:
+            total_chars = condensed_chars
+            break
+        total_chars = condensed_chars
+    
+    coverage['ratio'] = round(coverage['ratio'], 3)
+    return '\n\n'.join(texts)[:DIRECT_MAX_CHARS * 2], coverage
+
+
+def generate_cheat_sheet(material_data: dict) -> tuple:
+    """Генерирует шпаргалку через DeepSeek; длинные материалы предварительно сжимаются иерархически.
+    
+    Возвращает (шпаргалка, покрытие); в покрытии — объём прочитанного текста и пропущенные части сжатия.
+    """
     title = material_data.get('title', 'Материал')
     subject = material_data.get('subject', '')
+    # Объём уже ограничен при чтении чанков (get_material_content)
+    texts = material_data.get('chunks') or [material_data.get('recognized_text') or '']
+    source_chars = sum(len(t) for t in texts)
+    coverage = {'sections': 0, 'failed_sections': 0, 'ratio': 1.0}
+    
+    if source_chars > DIRECT_MAX_CHARS:
+        print(f"[CHEAT-SHEET] Длинный материал ({source_chars} символов), иерархическое сжатие")
+        text, coverage = condense_hierarchically(texts, title, subject)
+        source_label = 'Конспект материала по частям'
+    else:
+        text = '\n\n'.join(texts)
+        source_label = 'Текст материала'
     
     prompt = f"""Ты помощник студента. Создай КОМПАКТНУЮ шпаргалку по материалу "{title}" {f'({subject})' if subject else ''}.
 
-Текст материала:
+{source_label}:
 {text}
 
 Создай шпаргалку в формате:
@@ -116,25 +406,174 @@ def generate_cheat_sheet(material_data: dict) -> str:
 - Сжато и конкретно
 - Удобно для быстрого повторения"""
 
+    coverage['used_chars'] = source_chars
+    return call_deepseek(prompt, 1500), coverage
+
+
+def get_material_fingerprints(conn, user_id: int, material_ids: list = None, subject: str = None) -> list:
+    """Хэши и длина исходного текста сразу для нескольких материалов: по списку id или по предмету"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    condition = 'm.id = ANY(%s)' if material_ids else 'm.subject = %s'
+    cursor.execute(f'''
+        SELECT m.id, m.title, m.subject,
+               md5(COALESCE(m.recognized_text, '') || COALESCE((
+                   SELECT string_agg(md5(dc.chunk_text), '' ORDER BY dc.chunk_index)
+                   FROM {SCHEMA_NAME}.document_chunks dc
+                   WHERE dc.material_id = m.id
+               ), '')) AS content_hash,
+               CASE WHEN m.total_chunks > 1 THEN COALESCE((
+                   SELECT SUM(length(dc.chunk_text))
+                   FROM {SCHEMA_NAME}.document_chunks dc
+                   WHERE dc.material_id = m.id
+               ), 0) ELSE COALESCE(length(m.recognized_text), 0) END AS source_chars
+        FROM {SCHEMA_NAME}.materials m
+        WHERE m.user_id = %s AND {condition}
+        ORDER BY m.created_at, m.id
+        LIMIT %s
+    ''', (user_id, material_ids or subject, BATCH_MAX_MATERIALS))
+    
+    materials = [dict(m) for m in cursor.fetchall()]
+    cursor.close()
+    return materials
+
+
+def find_saved_cheat_sheets(conn, user_id: int, keys: list) -> dict:
+    """Сохранённые шпаргалки для набора пар (material_id, content_hash), одним запросом"""
+    if not keys:
+        return {}
+    
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'''
+        SELECT cs.id, cs.material_id, cs.content_hash, cs.title, cs.subject, cs.cheat_sheet, cs.updated_at
+        FROM {SCHEMA_NAME}.cheat_sheets cs
+        JOIN unnest(%s::int[], %s::text[]) AS f(material_id, content_hash)
+          ON cs.material_id = f.material_id AND cs.content_hash = f.content_hash
+        WHERE cs.user_id = %s AND cs.prompt_version = %s
+    ''', ([k[0] for k in keys], [k[1] for k in keys], user_id, PROMPT_VERSION))
+    
+    saved = {(row['material_id'], row['content_hash']): dict(row) for row in cursor.fetchall()}
+    cursor.close()
+    return saved
+
+
+def handle_batch(conn, user_id: int, body: dict, headers: dict) -> dict:
+    """Шпаргалки для всех материалов предмета (или списка id) за один вызов: одно подключение, одна проверка доступа"""
+    material_ids = body.get('material_ids') or []
+    subject = (body.get('subject') or '').strip()
+    regenerate = bool(body.get('regenerate', False))
+    
+    if not material_ids and not subject:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Укажите subject или material_ids'})
+        }
+    
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1500,
-            temperature=0.3
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"[CHEAT-SHEET] Ошибка DeepSeek: {e}")
-        error_str = str(e)
+        material_ids = [int(m) for m in material_ids]
+        concurrency = int(body.get('concurrency') or BATCH_DEFAULT_CONCURRENCY)
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'material_ids и concurrency должны быть числами'})
+        }
+    if not 1 <= concurrency <= BATCH_MAX_CONCURRENCY:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f'concurrency должно быть от 1 до {BATCH_MAX_CONCURRENCY}'})
+        }
+    
+    fingerprints = get_material_fingerprints(conn, user_id, material_ids, subject)
+    if not fingerprints:
+        return {
+            'statusCode': 404,
+            'headers': headers,
+            'body': json.dumps({'error': 'Материалы не найдены'})
+        }
+    
+    # Материал длиннее бюджета пакета сжимается по началу текста — такая шпаргалка хранится
+    # под отдельным ключом и не выдаётся потом за полную; готовая полная подходит пакету всегда
+    for f in fingerprints:
+        f['sheet_hash'] = f['content_hash']
+        if f['source_chars'] > BATCH_MAX_SOURCE_CHARS:
+            f['sheet_hash'] = scoped_content_hash(f['content_hash'], max_chars=BATCH_MAX_SOURCE_CHARS)
+    
+    saved = {} if regenerate else find_saved_cheat_sheets(
+        conn, user_id,
+        [(f['id'], f['content_hash']) for f in fingerprints]
+        + [(f['id'], f['sheet_hash']) for f in fingerprints if f['sheet_hash'] != f['content_hash']]
+    )
+    results = {}
+    completed_order = []
+    
+    for f in fingerprints:
+        sheet = saved.get((f['id'], f['content_hash'])) or saved.get((f['id'], f['sheet_hash']))
+        if sheet:
+            results[f['id']] = {
+                'cheat_sheet_id': sheet['id'],
+                'material_id': f['id'],
+                'title': sheet.get('title'),
+                'subject': sheet.get('subject'),
+                'cheat_sheet': sheet['cheat_sheet'],
+                'truncated': f['source_chars'] > (
+                    MAX_SOURCE_CHARS if sheet['content_hash'] == f['content_hash'] else BATCH_MAX_SOURCE_CHARS
+                ),
+                'cached': True
+            }
+            completed_order.append(f['id'])
+    
+    pending = [f for f in fingerprints if f['id'] not in results]
+    print(f"[CHEAT-SHEET] Пакет: {len(fingerprints)} материалов, из БД {len(results)}, генерация {len(pending)}, параллельно {concurrency}")
+    
+    # Чтение из БД и сохранение — в основном потоке, в пуле только запросы к LLM
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {}
+        for f in pending:
+            material = get_material_content(conn, f['id'], user_id, BATCH_MAX_SOURCE_CHARS)
+            futures[pool.submit(generate_cheat_sheet, material)] = (f, material)
         
-        # Человекопонятное сообщение об ошибке
-        if 'Insufficient Balance' in error_str or '402' in error_str:
-            return "⚠️ Шпаргалка временно недоступна: закончился баланс DeepSeek API. Попробуйте позже или обратитесь к администратору."
-        elif 'timeout' in error_str.lower():
-            return "⏱️ Превышено время ожидания. Попробуйте с более коротким материалом."
-        else:
-            return f"❌ Ошибка генерации шпаргалки: {error_str[:200]}"
+        for future in as_completed(futures):
+            f, material = futures[future]
+            result = {
+                'material_id': f['id'],
+                'title': material.get('title'),
+                'subject': material.get('subject'),
+                'truncated': f['source_chars'] > BATCH_MAX_SOURCE_CHARS,
+                'cached': False
+            }
+            try:
+                cheat_sheet, coverage = future.result()
+                result.update({'cheat_sheet': cheat_sheet, 'coverage': coverage})
+                # Шпаргалку с пропущенными частями не сохраняем: повторный запрос попробует их снова
+                if not coverage['failed_sections']:
+                    sheet = save_cheat_sheet(conn, user_id, f['id'], f['sheet_hash'], material, cheat_sheet)
+                    result['cheat_sheet_id'] = sheet['id']
+            except Exception as e:
+                result.update({'cheat_sheet': None, 'error': str(e)})
+            
+            print(f"[CHEAT-SHEET] Пакет: готово {len(completed_order) + 1}/{len(fingerprints)} (материал {f['id']})")
+            results[f['id']] = result
+            completed_order.append(f['id'])
+    
+    combined = '\n\n'.join(
+        f"## {results[f['id']]['title']}\n\n{results[f['id']]['cheat_sheet']}"
+        for f in fingerprints if results[f['id']].get('cheat_sheet')
+    )
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({
+            'subject': subject or None,
+            'concurrency': concurrency,
+            'combined_cheat_sheet': combined,
+            'cheat_sheets': [results[f['id']] for f in fingerprints],
+            'completed_order': completed_order,
+            'failed': sum(1 for r in results.values() if r.get('error'))
+        }, default=str)
+    }
 
 
 def handler(event: dict, context) -> dict:
@@ -146,7 +585,7 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization'
             },
             'body': ''
@@ -177,9 +616,64 @@ def handler(event: dict, context) -> dict:
     
     user_id = payload['user_id']
     
+    # GET - список сохранённых шпаргалок или одна шпаргалка (id / material_id)
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        try:
+            sheet_id = int(params['id']) if params.get('id') else None
+            material_id = int(params['material_id']) if params.get('material_id') else None
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'id и material_id должны быть числами'})
+            }
+        
+        conn = psycopg2.connect(DATABASE_URL)
+        try:
+            if sheet_id or material_id:
+                sheet = get_cheat_sheet(conn, user_id, sheet_id=sheet_id, material_id=material_id)
+                if not sheet:
+                    return {
+                        'statusCode': 404,
+                        'headers': headers,
+                        'body': json.dumps({'error': 'Шпаргалка не найдена'})
+                    }
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({'cheat_sheet': sheet}, default=str)
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'cheat_sheets': list_cheat_sheets(conn, user_id)}, default=str)
+            }
+        finally:
+            conn.close()
+    
     if method == 'POST':
         body = json.loads(event.get('body', '{}'))
+        
+        if body.get('action') == 'batch':
+            conn = psycopg2.connect(DATABASE_URL)
+            try:
+                access = check_premium_access(conn, user_id)
+                if not access['has_access']:
+                    return {
+                        'statusCode': 403,
+                        'headers': headers,
+                        'body': json.dumps({'error': '🔒 Генерация шпаргалок доступна только в Premium подписке'})
+                    }
+                return handle_batch(conn, user_id, body, headers)
+            finally:
+                conn.close()
+        
         material_id = body.get('material_id')
+        regenerate = bool(body.get('regenerate', False))
+        chunk_start = body.get('chunk_start')
+        chunk_end = body.get('chunk_end')
         
         if not material_id:
             return {
@@ -187,6 +681,33 @@ def handler(event: dict, context) -> dict:
                 'headers': headers,
                 'body': json.dumps({'error': 'Укажите material_id'})
             }
+        # Как в GET: id из тела приводим к int до запросов в БД, true/1.5/"abc" — ошибка клиента
+        if isinstance(material_id, bool) or not str(material_id).isdigit():
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'material_id должен быть числом'})
+            }
+        material_id = int(material_id)
+        
+        try:
+            chunk_start = int(chunk_start) if chunk_start is not None else 0
+            chunk_end = int(chunk_end) if chunk_end is not None else None
+            max_chars = body.get('max_chars')
+            max_chars = min(int(max_chars), MAX_SOURCE_CHARS) if max_chars is not None else MAX_SOURCE_CHARS
+        except (TypeError, ValueError):
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'chunk_start, chunk_end и max_chars должны быть числами'})
+            }
+        
+        if max_chars <= 0 or chunk_start < 0 or (chunk_end is not None and chunk_end <= chunk_start):
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Нужно max_chars > 0 и 0 <= chunk_start < chunk_end'})
+            }
         
         conn = psycopg2.connect(DATABASE_URL)
         try:
@@ -199,8 +720,38 @@ def handler(event: dict, context) -> dict:
                     'body': json.dumps({'error': '🔒 Генерация шпаргалок доступна только в Premium подписке'})
                 }
             
+            fingerprint = get_material_fingerprint(conn, material_id, user_id)
+            
+            if not fingerprint:
+                return {
+                    'statusCode': 404,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Материал не найден'})
+                }
+            
+            content_hash = scoped_content_hash(fingerprint['content_hash'], chunk_start, chunk_end, max_chars)
+            
+            # Уже сгенерированная шпаргалка для этой версии материала отдаётся из БД
+            if not regenerate:
+                saved = find_saved_cheat_sheet(conn, user_id, material_id, content_hash)
+                if saved:
+                    print(f"[CHEAT-SHEET] Шпаргалка {saved['id']} для материала {material_id} из БД")
+                    return {
+                        'statusCode': 200,
+                        'headers': headers,
+                        'body': json.dumps({
+                            'cheat_sheet_id': saved['id'],
+                            'material_id': material_id,
+                            'title': saved.get('title'),
+                            'subject': saved.get('subject'),
+                            'cheat_sheet': saved['cheat_sheet'],
+                            'created_at': saved['updated_at'],
+                            'cached': True
+                        }, default=str)
+                    }
+            
             # Получаем материал
-            material = get_material_content(conn, material_id, user_id)
+            material = get_material_content(conn, material_id, user_id, max_chars, chunk_start, chunk_end)
             
             if not material:
                 return {
@@ -211,17 +762,55 @@ def handler(event: dict, context) -> dict:
             
             # Генерируем шпаргалку
             print(f"[CHEAT-SHEET] Генерация для материала {material_id}")
-            cheat_sheet = generate_cheat_sheet(material)
+            try:
+                cheat_sheet, coverage = generate_cheat_sheet(material)
+            except Exception as e:
+                # Ошибку показываем пользователю, но не сохраняем
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'material_id': material_id,
+                        'title': material.get('title'),
+                        'subject': material.get('subject'),
+                        'cheat_sheet': str(e),
+                        'cached': False
+                    })
+                }
+            
+            coverage['source_chars'] = fingerprint['source_chars']
+            coverage['truncated'] = coverage['used_chars'] >= max_chars and fingerprint['source_chars'] > max_chars
+            
+            # Шпаргалку с пропущенными частями отдаём, но не сохраняем: повторный запрос попробует их снова
+            if coverage['failed_sections']:
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'material_id': material_id,
+                        'title': material.get('title'),
+                        'subject': material.get('subject'),
+                        'cheat_sheet': cheat_sheet,
+                        'coverage': coverage,
+                        'cached': False
+                    }, default=str)
+                }
+            
+            saved = save_cheat_sheet(conn, user_id, material_id, content_hash, material, cheat_sheet)
             
             return {
                 'statusCode': 200,
                 'headers': headers,
                 'body': json.dumps({
+                    'cheat_sheet_id': saved['id'],
                     'material_id': material_id,
                     'title': material.get('title'),
                     'subject': material.get('subject'),
-                    'cheat_sheet': cheat_sheet
-                })
+                    'cheat_sheet': cheat_sheet,
+                    'coverage': coverage,
+                    'created_at': saved['updated_at'],
+                    'cached': False
+                }, default=str)
             }
         finally:
             conn.close()
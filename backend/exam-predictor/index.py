@@ -2,12 +2,58 @@
 
 import json
 import os
+import re
+import hashlib
+import gzip
+import base64
+from collections import Counter, defaultdict
+import numpy as np
+from scipy.sparse import csr_matrix
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
 from openai import OpenAI
 from datetime import datetime
 
+PROMPT_VERSION = 'v2'
+
+# Локальный отбор тем перед запросом к LLM
+PASSAGE_SIZE = 800
+ANALYSIS_MAX_CHUNKS = 250
+# Пределы на весь запрос, а не на материал: матрица терминов должна укладываться в память и время функции
+ANALYSIS_MAX_MATERIALS = 10
+ANALYSIS_MAX_CHUNKS_TOTAL = 500
+ANALYSIS_MAX_PASSAGES = 4000
+SURFACE_SAMPLE_PASSAGES = 20
+ANALYSIS_MAX_TERMS = 3000
+ANALYSIS_TOP_TOPICS = 30
+ANALYSIS_TOP_PASSAGES = 12
+PAST_EXAMS_BOOST = 1.5
+DIGEST_MAX_CHARS = 9000
+PAST_EXAMS_MAX_CHARS = 4000
+
+PREDICTIONS_PAGE_SIZE = 20
+PREDICTIONS_MAX_PAGE_SIZE = 100
+GZIP_MIN_BYTES = 1024
+
+WORD_RE = re.compile(r'[a-zа-яё][a-zа-яё0-9-]{2,}')
+SENTENCE_BREAK_RE = re.compile(r'[.!?;:\n]')
+RU_SUFFIXES = sorted([
+    'иями', 'ями', 'ами', 'ией', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее',
+    'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ию', 'ия',
+    'ии', 'ью', 'ть', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь'
+], key=len, reverse=True)
+STOPWORDS = {
+    'это', 'как', 'так', 'что', 'чтобы', 'для', 'при', 'или', 'его', 'её', 'она', 'они', 'оно',
+    'был', 'была', 'было', 'были', 'быть', 'есть', 'также', 'который', 'которая', 'которое',
+    'которые', 'которых', 'этот', 'эта', 'эти', 'этих', 'этого', 'того', 'тот', 'там', 'тут',
+    'где', 'когда', 'если', 'то', 'все', 'всё', 'всех', 'уже', 'ещё', 'еще', 'только', 'может',
+    'можно', 'нужно', 'очень', 'более', 'менее', 'между', 'через', 'после', 'перед', 'под', 'над',
+    'без', 'про', 'from', 'the', 'and', 'for', 'with', 'that', 'this', 'are', 'was', 'were',
+    'his', 'her', 'its', 'into', 'not', 'but', 'have', 'has', 'рис', 'стр', 'том', 'них',
+    'свой', 'своя', 'свои', 'своих', 'себя', 'один', 'одна', 'два', 'три', 'наш', 'ваш'
+}
+
 
 def get_db_connection():
     """Создаёт подключение к PostgreSQL базе данных"""
@@ -58,6 +104,263 @@ def check_premium_access(conn, user_id: int) -> dict:
     return {'has_access': False, 'reason': 'no_premium'}
 
 
+def content_hash(text: str) -> str:
+    """Возвращает SHA-256 хэш текста"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def build_prediction_cache_key(materials: list, past_exams: str = None) -> str:
+    """Строит отпечаток прогноза: материалы (id + хэш содержимого), прошлые билеты и версия промпта"""
+    fingerprint = {
+        'prompt_version': PROMPT_VERSION,
+        'materials': sorted(
+            [m['id'], content_hash(f"{m.get('recognized_text') or ''}\n{m.get('summary') or ''}\n{m.get('chunks_hash') or ''}")]
+            for m in materials
+        ),
+        'past_exams': content_hash(past_exams)
+    }
+    return content_hash(json.dumps(fingerprint, sort_keys=True))
+
+
+def get_cached_prediction(cur, user_id: int, cache_key: str):
+    """Ищет последний прогноз пользователя с тем же отпечатком"""
+    cur.execute("""
+        SELECT id, predicted_questions, created_at
+        FROM exam_predictions
+        WHERE user_id = %s AND cache_key = %s
+        ORDER BY created_at DESC
+        LIMIT 1
+    """, (user_id, cache_key))
+    return cur.fetchone()
+
+
+def load_material_chunks(cur, materials: list) -> None:
+    """Подгружает чанки больших документов одним запросом.
+    
+    Общий бюджет ANALYSIS_MAX_CHUNKS_TOTAL делится поровну между материалами (не больше ANALYSIS_MAX_CHUNKS на каждый).
+    """
+    chunked_ids = [m['id'] for m in materials if (m.get('total_chunks') or 1) > 1]
+    for m in materials:
+        m['chunks'] = []
+    if not chunked_ids:
+        return
+    per_material = max(1, min(ANALYSIS_MAX_CHUNKS, ANALYSIS_MAX_CHUNKS_TOTAL // len(chunked_ids)))
+    
+    cur.execute("""
+        SELECT material_id, chunk_text
+        FROM document_chunks
+        WHERE material_id = ANY(%s) AND chunk_index < %s
+        ORDER BY material_id, chunk_index
+    """, (chunked_ids, per_material))
+    
+    by_id = {m['id']: m for m in materials}
+    for row in cur.fetchall():
+        by_id[row['material_id']]['chunks'].append(row['chunk_text'])
+
+
+def split_into_passages(text: str) -> list:
+    """Режет текст на фрагменты около PASSAGE_SIZE символов по границам абзацев"""
+    passages = []
+    current = ''
+    for para in re.split(r'\n\s*\n', text or ''):
+        para = para.strip()
+        if not para:
+            continue
+        if current and len(current) + len(para) + 1 > PASSAGE_SIZE:
+            passages.append(current)
+            current = ''
+        current = f"{current}\n{para}" if current else para
+        while len(current) > PASSAGE_SIZE * 2:
+            passages.append(current[:PASSAGE_SIZE])
+            current = current[PASSAGE_SIZE:]
+    if current:
+        passages.append(current)
+    return passages
+
+
+def stem_word(word: str) -> str:
+    """Грубый стемминг: отрезает типичные окончания, чтобы склонения считались одним термином"""
+    for suffix in RU_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def extract_terms(text: str, surface_forms: dict = None) -> list:
+    """Возвращает термины текста: стеммы слов и биграммы соседних значимых слов"""
+    terms = []
+    prev = None
+    last_end = 0
+    text = text.lower()
+    for match in WORD_RE.finditer(text):
+        word = match.group(0)
+        # Биграммы не переходят через границу предложения
+        if SENTENCE_BREAK_RE.search(text, last_end, match.start()):
+            prev = None
+        last_end = match.end()
+        if word in STOPWORDS:
+            prev = None
+            continue
+        stem = stem_word(word)
+        terms.append(stem)
+        if surface_forms is not None:
+            surface_forms[stem][word] += 1
+        if prev:
+            bigram = f"{prev[0]} {stem}"
+            terms.append(bigram)
+            if surface_forms is not None:
+                surface_forms[bigram][f"{prev[1]} {word}"] += 1
+        prev = (stem, word)
+    return terms
+
+
+def build_topic_digest(materials: list, past_exams: str = None) -> dict:
+    """Локально ранжирует темы (частоты, TF-IDF, пересечение с билетами) и отбирает характерные фрагменты"""
+    passages = []
+    for m in materials:
+        sources = m.get('chunks') or [m.get('recognized_text') or '']
+        for text in sources:
+            for passage in split_into_passages(text):
+                passages.append((m['title'], passage))
+    
+    if not passages:
+        return {'topics': [], 'passages': [], 'past_exams_overlap': 0.0}
+    
+    # Сверх предела берём фрагменты равномерно по всему тексту, чтобы не потерять конец материалов
+    if len(passages) > ANALYSIS_MAX_PASSAGES:
+        step = len(passages) / ANALYSIS_MAX_PASSAGES
+        passages = [passages[int(i * step)] for i in range(ANALYSIS_MAX_PASSAGES)]
+    
+    passage_terms = [Counter(extract_terms(text)) for _, text in passages]
+    
+    total_counts = Counter()
+    for counts in passage_terms:
+        total_counts.update(counts)
+    
+    # Биграммы, встретившиеся один раз, — шум; словарь ограничиваем самыми частыми терминами
+    vocab = [
+        term for term, count in total_counts.most_common()
+        if count >= 2 or ' ' not in term
+    ][:ANALYSIS_MAX_TERMS]
+    if not vocab:
+        return {'topics': [], 'passages': [], 'past_exams_overlap': 0.0}
+    index = {term: i for i, term in enumerate(vocab)}
+    
+    # Разреженная матрица: во фрагменте лишь десятки терминов из тысяч, плотная заняла бы гигабайт
+    indptr = [0]
+    indices = []
+    data = []
+    for counts in passage_terms:
+        for term, count in counts.items():
+            col = index.get(term)
+            if col is not None:
+                indices.append(col)
+                data.append(count)
+        indptr.append(len(indices))
+    tfidf = csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(passages), len(vocab))
+    )
+    
+    # TF-IDF с log-TF и L2-нормой строк считается прямо над ненулевыми элементами
+    df = np.bincount(tfidf.indices, minlength=len(vocab))
+    idf = (np.log((1 + len(passages)) / (1 + df)) + 1).astype(np.float32)
+    tfidf.data = np.log1p(tfidf.data) * idf[tfidf.indices]
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    tfidf.data /= np.repeat(norms, np.diff(tfidf.indptr)).astype(np.float32)
+    
+    past_terms = set(extract_terms(past_exams)) if past_exams else set()
+    in_past = np.array([term in past_terms for term in vocab], dtype=np.float32)
+    # Биграммы точнее описывают тему, чем отдельные слова
+    is_bigram = np.array([' ' in term for term in vocab], dtype=np.float32)
+    
+    scores = np.asarray(tfidf.sum(axis=0)).ravel() * (1 + PAST_EXAMS_BOOST * in_past) * (1 + 0.5 * is_bigram)
+    
+    topics = []
+    covered = set()
+    for col in np.argsort(-scores):
+        term = vocab[col]
+        if scores[col] <= 0 or len(topics) >= ANALYSIS_TOP_TOPICS:
+            break
+        parts = term.split(' ')
+        if term in covered or all(part in covered for part in parts):
+            continue
+        covered.update(parts)
+        covered.add(term)
+        topics.append({
+            'topic': term,
+            'frequency': int(total_counts[term]),
+            'in_past_exams': bool(in_past[col]),
+            'score': round(float(scores[col]), 3)
+        })
+    
+    # Написание темы берём из нескольких фрагментов с ней, а не копим формы всех терминов корпуса
+    term_passages = tfidf.tocsc()
+    sample_rows = set()
+    for topic in topics:
+        col = index[topic['topic']]
+        sample_rows.update(term_passages.indices[term_passages.indptr[col]:term_passages.indptr[col + 1]][:SURFACE_SAMPLE_PASSAGES].tolist())
+    surface_forms = defaultdict(Counter)
+    for row in sample_rows:
+        extract_terms(passages[row][1], surface_forms)
+    for topic in topics:
+        if surface_forms[topic['topic']]:
+            topic['topic'] = surface_forms[topic['topic']].most_common(1)[0][0]
+    
+    # Фрагмент тем характернее, чем больше в нём весомых терминов; почти дубликаты пропускаем
+    topic_weights = np.zeros(len(vocab), dtype=np.float32)
+    for col in np.argsort(-scores)[:ANALYSIS_TOP_TOPICS * 2]:
+        topic_weights[col] = scores[col]
+    passage_scores = tfidf @ topic_weights
+    
+    selected = []
+    selected_vectors = np.zeros((ANALYSIS_TOP_PASSAGES, len(vocab)), dtype=np.float32)
+    for row in np.argsort(-passage_scores):
+        if len(selected) >= ANALYSIS_TOP_PASSAGES or passage_scores[row] <= 0:
+            break
+        vector = tfidf.getrow(row)
+        if selected and (vector @ selected_vectors[:len(selected)].T).max() > 0.8:
+            continue
+        selected_vectors[len(selected)] = vector.toarray().ravel()
+        selected.append(row)
+    
+    past_exams_overlap = float(in_past.sum() / len(past_terms)) if past_terms else 0.0
+    
+    return {
+        'topics': topics,
+        'passages': [
+            {'title': passages[row][0], 'text': passages[row][1]}
+            for row in sorted(selected)
+        ],
+        'past_exams_overlap': round(min(past_exams_overlap, 1.0), 3)
+    }
+
+
+def format_topic_digest(materials: list, digest: dict) -> str:
+    """Собирает сжатый дайджест материалов для промпта"""
+    lines = ['=== МАТЕРИАЛЫ ===']
+    for m in materials:
+        summary = (m.get('summary') or '').strip()
+        lines.append(f"- {m['title']} ({m['subject']})" + (f": {summary[:500]}" if summary else ''))
+    
+    lines.append('\n=== КЛЮЧЕВЫЕ ТЕМЫ (по частоте и TF-IDF) ===')
+    for i, topic in enumerate(digest['topics'], 1):
+        mark = ', есть в прошлых билетах' if topic['in_past_exams'] else ''
+        lines.append(f"{i}. {topic['topic']} (упоминаний: {topic['frequency']}{mark})")
+    
+    lines.append('\n=== ХАРАКТЕРНЫЕ ФРАГМЕНТЫ ===')
+    total = 0
+    for passage in digest['passages']:
+        block = f"[{passage['title']}]\n{passage['text']}"
+        if total + len(block) > DIGEST_MAX_CHARS:
+            break
+        lines.append(block)
+        total += len(block)
+    
+    return '\n'.join(lines)
+
+
 def analyze_materials_with_deepseek(materials: list, past_exams: str = None) -> dict:
     """Анализирует материалы студента и генерирует прогноз вопросов через DeepSeek"""
     deepseek_key = os.environ.get('DEEPSEEK_API_KEY')
@@ -72,27 +375,30 @@ def analyze_materials_with_deepseek(materials: list, past_exams: str = None) ->
         base_url="https://api.deepseek.com"
     )
     
-    # Собираем весь текст из материалов
-    all_text = "\n\n".join([
-        f"=== {m['title']} ({m['subject']}) ===\n{m['recognized_text'] or ''}\n{m['summary'] or ''}"
+    raw_length = sum(
+        len(m.get('recognized_text') or '') + len(m.get('summary') or '') + sum(len(c) for c in m.get('chunks') or [])
         for m in materials
-    ])
+    )
     
-    if len(all_text.strip()) < 50:
+    if raw_length < 50:
         raise ValueError("Материалы слишком короткие для анализа. Добавьте больше текста.")
     
-    print(f"[EXAM-PREDICTOR] Всего текста: {len(all_text)} символов")
+    # Вместо сырого текста отправляем локально отобранные темы и фрагменты
+    digest = build_topic_digest(materials, past_exams)
+    digest_text = format_topic_digest(materials, digest)
     
-    past_exams_section = f"\n\n=== ПРОШЛОГОДНИЕ БИЛЕТЫ ===\n{past_exams}" if past_exams else ""
+    print(f"[EXAM-PREDICTOR] Исходного текста: {raw_length} символов, дайджест: {len(digest_text)} символов, тем: {len(digest['topics'])}")
     
-    prompt = f"""Ты — AI-ассистент для подготовки к экзамену. Проанализируй учебные материалы студента и спрогнозируй вопросы на экзамене.
+    past_exams_section = f"\n\n=== ПРОШЛОГОДНИЕ БИЛЕТЫ ===\n{past_exams[:PAST_EXAMS_MAX_CHARS]}" if past_exams else ""
+    
+    prompt = f"""Ты — AI-ассистент для подготовки к экзамену. Ниже — дайджест учебных материалов студента: темы, ранжированные по частоте и TF-IDF, и самые характерные фрагменты. Спрогнозируй вопросы на экзамене.
 
-МАТЕРИАЛЫ СТУДЕНТА:
-{all_text}
+ДАЙДЖЕСТ МАТЕРИАЛОВ:
+{digest_text}
 {past_exams_section}
 
 ЗАДАЧА:
-1. Определи ключевые темы и концепции из материалов
+1. Определи ключевые темы и концепции, опираясь на ранжированный список тем и фрагменты
 2. Если есть прошлогодние билеты — учти паттерны (какие темы повторяются, стиль вопросов)
 3. Выдели, что преподаватель подчёркивал (повторяющиеся темы, акценты)
 4. Сгенерируй 20 наиболее вероятных экзаменационных вопросов с вероятностью и готовыми ответами
@@ -131,7 +437,7 @@ def analyze_materials_with_deepseek(materials: list, past_exams: str = None) ->
 """
     
     try:
-        print(f"[EXAM-PREDICTOR] Отправка запроса в DeepSeek API...")
+        print("[EXAM-PREDICTOR] Отправка запроса в DeepSeek API...")
         response = client.chat.completions.create(
             model="deepseek-chat",
             messages=[{"role": "user", "content": prompt}],
@@ -159,6 +465,66 @@ def analyze_materials_with_deepseek(materials: list, past_exams: str = None) ->
             raise Exception(f"Не удалось сгенерировать прогноз: {error_str[:200]}")
 
 
+def json_response(event: dict, status_code: int, headers: dict, payload: dict) -> dict:
+    """Формирует JSON-ответ, сжимая его gzip, если клиент это поддерживает"""
+    body = json.dumps(payload, default=str)
+    request_headers = event.get('headers') or {}
+    accept_encoding = request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or ''
+    
+    if 'gzip' in accept_encoding.lower() and len(body) >= GZIP_MIN_BYTES:
+        return {
+            'statusCode': status_code,
+            'headers': {**headers, 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'},
+            'body': base64.b64encode(gzip.compress(body.encode('utf-8'))).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    
+    return {'statusCode': status_code, 'headers': headers, 'body': body}
+
+
+def encode_cursor(created_at, prediction_id: int) -> str:
+    """Кодирует позицию keyset-пагинации"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{prediction_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Декодирует позицию keyset-пагинации, возвращает (created_at, id) или None"""
+    try:
+        created_at, prediction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(prediction_id)
+    except Exception:
+        return None
+
+
+def list_predictions(cur, user_id: int, limit: int, cursor=None) -> dict:
+    """Возвращает страницу прогнозов без тяжёлых JSON-полей"""
+    if cursor:
+        cur.execute("""
+            SELECT id, subject, created_at, COALESCE(questions_count, 0) AS questions_count
+            FROM exam_predictions
+            WHERE user_id = %s AND (created_at, id) < (%s, %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (user_id, cursor[0], cursor[1], limit + 1))
+    else:
+        cur.execute("""
+            SELECT id, subject, created_at, COALESCE(questions_count, 0) AS questions_count
+            FROM exam_predictions
+            WHERE user_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (user_id, limit + 1))
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return {
+        'predictions': [dict(r) for r in rows],
+        'next_cursor': encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+    }
+
+
 def handler(event: dict, context) -> dict:
     """Обработчик запросов для прогнозирования экзаменационных вопросов"""
     method = event.get('httpMethod', 'GET')
@@ -205,6 +571,7 @@ def handler(event: dict, context) -> dict:
         subject = body.get('subject', '').strip()
         material_ids = body.get('material_ids', [])
         past_exams = body.get('past_exams', '').strip()
+        force_refresh = bool(body.get('force_refresh', False))
         
         if not subject or not material_ids:
             return {
@@ -213,6 +580,13 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'error': 'Укажите предмет и выберите материалы'})
             }
         
+        if not isinstance(material_ids, list) or len(material_ids) > ANALYSIS_MAX_MATERIALS:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f'Выберите не больше {ANALYSIS_MAX_MATERIALS} материалов'})
+            }
+        
         conn = get_db_connection()
         try:
             # Проверяем премиум доступ
@@ -229,9 +603,11 @@ def handler(event: dict, context) -> dict:
                 print(f"[EXAM-PREDICTOR] Запрос материалов для user_id={user_id}, material_ids={material_ids}")
                 
                 cur.execute("""
-                    SELECT id, title, subject, recognized_text, summary
-                    FROM materials
-                    WHERE user_id = %s AND id = ANY(%s)
+                    SELECT m.id, m.title, m.subject, m.recognized_text, m.summary, m.total_chunks,
+                           (SELECT md5(string_agg(md5(dc.chunk_text), '' ORDER BY dc.chunk_index))
+                            FROM document_chunks dc WHERE dc.material_id = m.id) AS chunks_hash
+                    FROM materials m
+                    WHERE m.user_id = %s AND m.id = ANY(%s)
                 """, (user_id, material_ids))
                 
                 materials = cur.fetchall()
@@ -249,11 +625,32 @@ def handler(event: dict, context) -> dict:
                     text_len = len(mat.get('recognized_text') or '') + len(mat.get('summary') or '')
                     print(f"[EXAM-PREDICTOR] Материал {mat['id']}: {text_len} символов")
                 
+                # Отпечаток меняется при любом изменении материалов, поэтому устаревший кэш не найдётся
+                cache_key = build_prediction_cache_key(materials, past_exams if past_exams else None)
+                
+                if not force_refresh:
+                    cached = get_cached_prediction(cur, user_id, cache_key)
+                    if cached:
+                        print(f"[EXAM-PREDICTOR] Прогноз найден в кэше: id={cached['id']}")
+                        return {
+                            'statusCode': 200,
+                            'headers': headers,
+                            'body': json.dumps({
+                                'prediction_id': cached['id'],
+                                'prediction': cached['predicted_questions'],
+                                'created_at': str(cached['created_at']),
+                                'cached': True
+                            }, default=str)
+                        }
+                
+                materials = [dict(m) for m in materials]
+                load_material_chunks(cur, materials)
+                
                 # Анализируем материалы через DeepSeek
-                print(f"[EXAM-PREDICTOR] Начинаем анализ через DeepSeek...")
+                print("[EXAM-PREDICTOR] Начинаем анализ через DeepSeek...")
                 try:
                     prediction = analyze_materials_with_deepseek(
-                        [dict(m) for m in materials],
+                        materials,
                         past_exams if past_exams else None
                     )
                     print(f"[EXAM-PREDICTOR] Анализ завершен, вопросов: {len(prediction.get('questions', []))}")
@@ -269,8 +666,8 @@ def handler(event: dict, context) -> dict:
                 
                 # Сохраняем прогноз в БД
                 cur.execute("""
-                    INSERT INTO exam_predictions (user_id, subject, material_ids, predicted_questions, study_plan, past_exams_text)
-                    VALUES (%s, %s, %s, %s, %s, %s)
+                    INSERT INTO exam_predictions (user_id, subject, material_ids, predicted_questions, study_plan, past_exams_text, cache_key, prompt_version, questions_count)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id, created_at
                 """, (
                     user_id,
@@ -278,7 +675,10 @@ def handler(event: dict, context) -> dict:
                     material_ids,
                     json.dumps(prediction),
                     json.dumps(prediction.get('study_plan', {})),
-                    past_exams if past_exams else None
+                    past_exams if past_exams else None,
+                    cache_key,
+                    PROMPT_VERSION,
+                    len(prediction.get('questions') or [])
                 ))
                 
                 saved = cur.fetchone()
@@ -290,7 +690,8 @@ def handler(event: dict, context) -> dict:
                     'body': json.dumps({
                         'prediction_id': saved['id'],
                         'prediction': prediction,
-                        'created_at': str(saved['created_at'])
+                        'created_at': str(saved['created_at']),
+                        'cached': False
                     }, default=str)
                 }
         except Exception as e:
@@ -305,27 +706,56 @@ def handler(event: dict, context) -> dict:
         finally:
             conn.close()
     
-    # GET /predictions - Получить все прогнозы пользователя
+    # GET /predictions - Список прогнозов (action=list) или один прогноз (action=detail)
     elif method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        action = params.get('action', 'list')
+        
         conn = get_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, subject, material_ids, predicted_questions, study_plan, created_at
-                    FROM exam_predictions
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                """, (user_id,))
+                if action == 'detail':
+                    prediction_id = params.get('id')
+                    if not prediction_id or not str(prediction_id).isdigit():
+                        return {
+                            'statusCode': 400,
+                            'headers': headers,
+                            'body': json.dumps({'error': 'Укажите id прогноза'})
+                        }
+                    
+                    cur.execute("""
+                        SELECT id, subject, material_ids, predicted_questions, study_plan, created_at
+                        FROM exam_predictions
+                        WHERE id = %s AND user_id = %s
+                    """, (int(prediction_id), user_id))
+                    
+                    prediction = cur.fetchone()
+                    if not prediction:
+                        return {
+                            'statusCode': 404,
+                            'headers': headers,
+                            'body': json.dumps({'error': 'Прогноз не найден'})
+                        }
+                    
+                    return json_response(event, 200, headers, {'prediction': dict(prediction)})
                 
-                predictions = cur.fetchall()
+                try:
+                    limit = int(params.get('limit', PREDICTIONS_PAGE_SIZE))
+                except ValueError:
+                    limit = PREDICTIONS_PAGE_SIZE
+                limit = max(1, min(limit, PREDICTIONS_MAX_PAGE_SIZE))
                 
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({
-                        'predictions': [dict(p) for p in predictions]
-                    }, default=str)
-                }
+                cursor = None
+                if params.get('cursor'):
+                    cursor = decode_cursor(params['cursor'])
+                    if not cursor:
+                        return {
+                            'statusCode': 400,
+                            'headers': headers,
+                            'body': json.dumps({'error': 'Некорректный cursor'})
+                        }
+                
+                return json_response(event, 200, headers, list_predictions(cur, user_id, limit, cursor))
         finally:
             conn.close()
     
@@ -1,15 +1,73 @@
+import hmac
 import json
 import os
+import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 import jwt
 import psycopg2
-from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+import requests
+from requests.adapters import HTTPAdapter
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from pywebpush import webpush, WebPushException
+from py_vapid import Vapid
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
+# Рассылки, обслуживание очереди и бенчмарк вызывают крон и координатор, а не пользователи:
+# такие запросы должны нести заголовок X-Cron-Secret; без настроенного секрета они закрыты
+NOTIFICATIONS_CRON_SECRET = os.environ.get('NOTIFICATIONS_CRON_SECRET', '')
+SERVICE_POST_ACTIONS = ('send_lesson_reminders', 'send_deadline_reminders', 'send_due_reminders', 'send_daily_digests',
+                        'send_share_updates', 'dispatch_reminders', 'roll_reminder_queue', 'push_benchmark')
+SERVICE_GET_ACTIONS = ('shard_status',)
+SHARDED_ACTIONS = ('send_lesson_reminders', 'send_deadline_reminders', 'send_due_reminders', 'send_daily_digests')
 VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
 VAPID_PUBLIC_KEY = os.environ.get('VAPID_PUBLIC_KEY', '')
 VAPID_EMAIL = os.environ.get('VAPID_EMAIL', 'mailto:admin@studyfay.app')
+REMINDER_DRAIN_BATCH = int(os.environ.get('REMINDER_DRAIN_BATCH', '500'))
+# Сколько секунд один вызов крона разбирает очередь; остальное заберёт следующий тик или соседний воркер
+REMINDER_DRAIN_SECONDS = int(os.environ.get('REMINDER_DRAIN_SECONDS', '240'))
+# Напоминание, опоздавшее сильнее, уже бесполезно — удаляем без отправки
+REMINDER_MAX_DELAY_MINUTES = 30
+REMINDER_KINDS = ('lesson', 'deadline')
+REMINDER_MAX_SHARDS = 64
+# Пользователей в одной порции ежедневных сводок; журнал пишется после каждой порции
+DIGEST_FETCH_BATCH = 1000
+# Окно «тишины» после последней правки владельца и предел ожидания для непрерывно редактируемых расписаний
+SHARE_UPDATES_QUIET_MINUTES = 2
+SHARE_UPDATES_MAX_WAIT_MINUTES = 15
+SHARE_UPDATES_FETCH_BATCH = 1000
+# Адрес этой же функции: координатор вызывает её по шарду на каждый вызов
+NOTIFICATIONS_SELF_URL = os.environ.get('NOTIFICATIONS_SELF_URL', '')
+PUSH_CONCURRENCY = int(os.environ.get('PUSH_CONCURRENCY', '32'))
+PUSH_TIMEOUT = float(os.environ.get('PUSH_TIMEOUT', '10'))
+# Подмена origin всех endpoint'ов, чтобы нагрузочные прогоны шли в локальный стенд вместо FCM/Mozilla
+PUSH_ENDPOINT_OVERRIDE = os.environ.get('PUSH_ENDPOINT_OVERRIDE', '')
+PUSH_BENCHMARK_MAX_COUNT = 10000
+PUSH_BENCHMARK_MAX_CONCURRENCY = 256
+# 404/410 — подписка отозвана браузером и удаляется. Временные ошибки самого push-сервиса (429/5xx)
+# только считаются: подписка отключается, если они идут подряд не меньше PUSH_MAX_FAILURES раз
+# и дольше PUSH_DEACTIVATE_AFTER_HOURS. Локальные сбои (сеть, VAPID, конфиг) подписку не трогают.
+PUSH_GONE_STATUSES = (404, 410)
+PUSH_MAX_FAILURES = int(os.environ.get('PUSH_MAX_FAILURES', '10'))
+PUSH_DEACTIVATE_AFTER_HOURS = int(os.environ.get('PUSH_DEACTIVATE_AFTER_HOURS', '72'))
+
+# VAPID JWT живёт 12 часов (максимум 24 по RFC 8292); обновляем заранее, чтобы не отправить протухший
+VAPID_TOKEN_TTL = 12 * 60 * 60
+VAPID_REFRESH_MARGIN = 60 * 60
+
+# Keep-alive сессии по origin push-сервиса живут между вызовами тёплого контейнера
+_push_sessions = {}
+_push_sessions_lock = threading.Lock()
+
+# Ключ VAPID и подписанные заголовки Authorization по audience (origin push-сервиса)
+_vapid_key = None
+_vapid_headers = {}
+_vapid_lock = threading.Lock()
 
 def get_user_id_from_token(token: str) -> int:
     """Извлечение user_id из JWT токена"""
@@ -34,6 +92,22 @@ def handler(event: dict, context) -> dict:
             'body': ''
         }
     
+    if method == 'POST':
+        body = json.loads(event.get('body') or '{}')
+        action = body.get('action')
+    else:
+        body = {}
+        action = (event.get('queryStringParameters') or {}).get('action')
+    
+    if action in SERVICE_POST_ACTIONS + SERVICE_GET_ACTIONS:
+        if not is_service_request(event):
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Service action requires X-Cron-Secret'})
+            }
+        return handle_service_action(event, method, action, body)
+    
     token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
     user_id = get_user_id_from_token(token)
     
@@ -48,23 +122,16 @@ def handler(event: dict, context) -> dict:
     
     try:
         if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
             if action == 'subscribe':
-                return handle_subscribe(conn, user_id, body.get('subscription'))
+                return handle_subscribe(conn, user_id, body.get('subscription'), body.get('timezone'))
+            elif action == 'update_settings':
+                return handle_update_settings(conn, user_id, body)
             elif action == 'unsubscribe':
                 return handle_unsubscribe(conn, user_id)
             elif action == 'send_test':
                 return handle_send_test(conn, user_id)
-            elif action == 'send_lesson_reminders':
-                return handle_send_lesson_reminders(conn)
-            elif action == 'send_deadline_reminders':
-                return handle_send_deadline_reminders(conn)
         
         elif method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action')
-            
             if action == 'status':
                 return get_subscription_status(conn, user_id)
         
@@ -77,7 +144,51 @@ def handler(event: dict, context) -> dict:
     finally:
         conn.close()
 
-def handle_subscribe(conn, user_id: int, subscription: dict) -> dict:
+def is_service_request(event: dict) -> bool:
+    """Запрос от крона или координатора: заголовок X-Cron-Secret совпадает с NOTIFICATIONS_CRON_SECRET"""
+    secret = (event.get('headers') or {}).get('X-Cron-Secret', '')
+    return bool(NOTIFICATIONS_CRON_SECRET) and hmac.compare_digest(secret.encode(), NOTIFICATIONS_CRON_SECRET.encode())
+
+def handle_service_action(event: dict, method: str, action: str, body: dict) -> dict:
+    """Служебные действия: рассылки по расписанию, обслуживание очереди, шарды и бенчмарк"""
+    if action == 'dispatch_reminders':
+        return handle_dispatch_reminders(body)
+    if action == 'push_benchmark':
+        return handle_push_benchmark(body)
+    if (method == 'GET') != (action in SERVICE_GET_ACTIONS):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid action'})
+        }
+    
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if action == 'send_lesson_reminders':
+            return handle_send_due_reminders(conn, ('lesson',), body)
+        elif action == 'send_deadline_reminders':
+            return handle_send_due_reminders(conn, ('deadline',), body)
+        elif action == 'send_due_reminders':
+            return handle_send_due_reminders(conn, REMINDER_KINDS, body)
+        elif action == 'send_daily_digests':
+            return handle_send_daily_digests(conn, body)
+        elif action == 'send_share_updates':
+            return handle_send_share_updates(conn)
+        elif action == 'roll_reminder_queue':
+            return handle_roll_reminder_queue(conn)
+        return get_shard_status(conn)
+    finally:
+        conn.close()
+
+def is_valid_timezone(name: str) -> bool:
+    """Проверяет имя часового пояса IANA (его же понимает AT TIME ZONE в Postgres)"""
+    try:
+        ZoneInfo(name)
+        return True
+    except Exception:
+        return False
+
+def handle_subscribe(conn, user_id: int, subscription: dict, timezone_name: str = None) -> dict:
     """Подписка пользователя на push-уведомления"""
     if not subscription:
         return {
@@ -96,7 +207,8 @@ def handle_subscribe(conn, user_id: int, subscription: dict) -> dict:
         INSERT INTO push_subscriptions (user_id, endpoint, p256dh, auth)
         VALUES (%s, %s, %s, %s)
         ON CONFLICT (user_id, endpoint) DO UPDATE
-        SET p256dh = EXCLUDED.p256dh, auth = EXCLUDED.auth
+        SET p256dh = EXCLUDED.p256dh, auth = EXCLUDED.auth,
+            is_active = TRUE, failure_count = 0, failing_since = NULL
     ''', (user_id, endpoint, p256dh, auth))
     
     cursor.execute('''
@@ -105,6 +217,15 @@ def handle_subscribe(conn, user_id: int, subscription: dict) -> dict:
         ON CONFLICT (user_id) DO NOTHING
     ''', (user_id,))
     
+    if timezone_name and is_valid_timezone(timezone_name):
+        cursor.execute('''
+            UPDATE notification_settings SET timezone = %s
+            WHERE user_id = %s AND timezone <> %s
+        ''', (timezone_name, user_id, timezone_name))
+    
+    # Без подписки очередь пользователя не заполняется — после первой подписки строим её целиком
+    cursor.execute('SELECT rebuild_user_reminders(%s)', (user_id,))
+    
     conn.commit()
     cursor.close()
     
@@ -117,7 +238,7 @@ def handle_subscribe(conn, user_id: int, subscription: dict) -> dict:
 def handle_unsubscribe(conn, user_id: int) -> dict:
     """Отписка от push-уведомлений"""
     cursor = conn.cursor()
-    cursor.execute('UPDATE push_subscriptions SET endpoint = NULL WHERE user_id = %s', (user_id,))
+    cursor.execute('DELETE FROM push_subscriptions WHERE user_id = %s', (user_id,))
     conn.commit()
     cursor.close()
     
@@ -127,12 +248,58 @@ def handle_unsubscribe(conn, user_id: int) -> dict:
         'body': json.dumps({'success': True, 'message': 'Unsubscribed from notifications'})
     }
 
+def handle_update_settings(conn, user_id: int, body: dict) -> dict:
+    """Изменение настроек напоминаний; очередь пересобирает триггер на notification_settings"""
+    fields = {k: bool(body[k]) for k in ('lessons_reminder', 'tasks_reminder', 'deadline_reminder', 'daily_digest') if k in body}
+    if 'reminder_time' in body:
+        try:
+            fields['reminder_time'] = datetime.strptime(str(body['reminder_time'])[:5], '%H:%M').time()
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid reminder_time, expected HH:MM'})
+            }
+    if 'timezone' in body:
+        if not is_valid_timezone(body['timezone'] or ''):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid timezone'})
+            }
+        fields['timezone'] = body['timezone']
+    
+    if not fields:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'No settings to update'})
+        }
+    
+    columns = ', '.join(fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    assignments = ', '.join(f'{k} = EXCLUDED.{k}' for k in fields)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        INSERT INTO notification_settings (user_id, {columns})
+        VALUES (%s, {placeholders})
+        ON CONFLICT (user_id) DO UPDATE SET {assignments}
+    ''', [user_id] + list(fields.values()))
+    conn.commit()
+    cursor.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'settings': fields}, default=str)
+    }
+
 def get_subscription_status(conn, user_id: int) -> dict:
     """Проверка статуса подписки"""
     cursor = conn.cursor()
     cursor.execute('''
         SELECT COUNT(*) FROM push_subscriptions 
-        WHERE user_id = %s AND endpoint IS NOT NULL
+        WHERE user_id = %s AND endpoint IS NOT NULL AND is_active
     ''', (user_id,))
     count = cursor.fetchone()[0]
     cursor.close()
@@ -147,8 +314,8 @@ def handle_send_test(conn, user_id: int) -> dict:
     """Отправка тестового уведомления"""
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT endpoint, p256dh, auth FROM push_subscriptions
-        WHERE user_id = %s AND endpoint IS NOT NULL
+        SELECT id, endpoint, p256dh, auth FROM push_subscriptions
+        WHERE user_id = %s AND endpoint IS NOT NULL AND is_active
     ''', (user_id,))
     
     subscriptions = cursor.fetchall()
@@ -168,128 +335,601 @@ def handle_send_test(conn, user_id: int) -> dict:
         'url': '/'
     }
     
-    sent_count = 0
-    for endpoint, p256dh, auth in subscriptions:
-        try:
-            send_push_notification(endpoint, p256dh, auth, notification_data)
-            sent_count += 1
-        except Exception as e:
-            print(f'Failed to send to {endpoint}: {e}')
+    results, stats = deliver_pushes(
+        {'subscription_id': subscription_id, 'endpoint': endpoint, 'p256dh': p256dh, 'auth': auth, 'data': notification_data}
+        for subscription_id, endpoint, p256dh, auth in subscriptions
+    )
+    apply_delivery_results(conn, results)
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'success': True, 'sent': sent_count})
+        'body': json.dumps({'success': True, 'sent': stats['sent']})
     }
 
-def handle_send_lesson_reminders(conn) -> dict:
-    """Отправка напоминаний о занятиях (запускается по расписанию)"""
+def claim_due_reminders(conn, kinds: tuple, limit: int, shard: tuple = None) -> list:
+    """Забирает созревшие строки очереди под блокировку; SKIP LOCKED даёт параллельным воркерам разные строки"""
+    shard_index, shard_count = shard or (0, 1)
     cursor = conn.cursor()
+    cursor.execute('''
+        WITH claimed AS (
+            SELECT id, user_id, kind, object_id, occurrence_date, fire_at
+            FROM reminder_queue
+            WHERE fire_at <= now() AND kind = ANY(%s)
+            AND (%s = 1 OR reminder_shard(user_id, %s) = %s)
+            ORDER BY fire_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        SELECT c.id, c.user_id, c.kind, c.object_id, c.occurrence_date,
+               c.fire_at < now() - make_interval(mins => %s)
+               OR EXISTS (
+                   SELECT 1 FROM notification_log nl
+                   WHERE nl.user_id = c.user_id AND nl.kind = c.kind
+                   AND nl.object_id = c.object_id AND nl.occurrence_date = c.occurrence_date
+               ) AS skip,
+               s.subject, s.start_time, s.room, t.title
+        FROM claimed c
+        LEFT JOIN schedule s ON c.kind = 'lesson' AND s.id = c.object_id
+        LEFT JOIN tasks t ON c.kind = 'deadline' AND t.id = c.object_id
+        ORDER BY c.fire_at
+    ''', (list(kinds), shard_count, shard_count, shard_index, limit, REMINDER_MAX_DELAY_MINUTES))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def build_reminder_messages(conn, rows: list) -> list:
+    """Сообщения по забранным строкам: пара — отдельный push, дедлайны пользователя — один общий"""
+    lessons = []
+    deadlines = {}
+    for queue_id, user_id, kind, object_id, occurrence_date, skip, subject, start_time, room, title in rows:
+        if skip:
+            continue
+        if kind == 'lesson' and subject:
+            lessons.append((user_id, object_id, occurrence_date, subject, start_time, room))
+        elif kind == 'deadline' and title:
+            deadlines.setdefault(user_id, []).append((object_id, occurrence_date, title))
     
-    today = datetime.now()
-    day_of_week = today.isoweekday()
+    user_ids = list({lesson[0] for lesson in lessons} | set(deadlines))
+    if not user_ids:
+        return []
     
+    cursor = conn.cursor()
     cursor.execute('''
-        SELECT DISTINCT u.id, u.full_name, ps.endpoint, ps.p256dh, ps.auth
-        FROM users u
-        JOIN push_subscriptions ps ON u.id = ps.user_id
-        JOIN notification_settings ns ON u.id = ns.user_id
-        JOIN schedule s ON u.id = s.user_id
-        WHERE ps.endpoint IS NOT NULL
-        AND ns.lessons_reminder = TRUE
-        AND s.day_of_week = %s
-        AND s.start_time > CURRENT_TIME
-        AND s.start_time <= CURRENT_TIME + INTERVAL '2 hours'
-    ''', (day_of_week,))
-    
-    users = cursor.fetchall()
-    
-    for user_id, full_name, endpoint, p256dh, auth in users:
-        cursor.execute('''
-            SELECT subject, start_time, room FROM schedule
-            WHERE user_id = %s AND day_of_week = %s
-            AND start_time > CURRENT_TIME
-            ORDER BY start_time LIMIT 1
-        ''', (user_id, day_of_week))
+        SELECT id, user_id, endpoint, p256dh, auth FROM push_subscriptions
+        WHERE user_id = ANY(%s) AND endpoint IS NOT NULL AND is_active
+    ''', (user_ids,))
+    subscriptions = {}
+    for subscription_id, user_id, endpoint, p256dh, auth in cursor.fetchall():
+        subscriptions.setdefault(user_id, []).append({
+            'subscription_id': subscription_id,
+            'user_id': user_id,
+            'endpoint': endpoint,
+            'p256dh': p256dh,
+            'auth': auth
+        })
+    cursor.close()
+    
+    messages = []
+    for user_id, lesson_id, occurrence_date, subject, start_time, room in lessons:
+        data = {
+            'title': f'📚 Скоро пара: {subject}',
+            'body': f'Начало в {start_time.strftime("%H:%M")}' + (f', {room}' if room else ''),
+            'tag': f'lesson-{user_id}',
+            'url': '/'
+        }
+        for subscription in subscriptions.get(user_id, []):
+            messages.append({**subscription, 'ledger': [('lesson', lesson_id, occurrence_date)], 'data': data})
+    
+    for user_id, tasks in deadlines.items():
+        task_count = len(tasks)
+        data = {
+            'title': f'⏰ Дедлайн через 24 часа!',
+            'body': f'{tasks[0][2]}' + (f' и ещё {task_count - 1}' if task_count > 1 else ''),
+            'tag': f'deadline-{user_id}',
+            'url': '/'
+        }
+        ledger = [('deadline', task_id, day) for task_id, day, _ in tasks]
+        for subscription in subscriptions.get(user_id, []):
+            messages.append({**subscription, 'ledger': ledger, 'data': data})
+    
+    return messages
+
+def drain_reminder_queue(conn, kinds: tuple, shard: tuple = None, stop_at: float = None) -> dict:
+    """Разбирает очередь (или один шард) порциями, пока есть созревшие строки и не вышло время вызова"""
+    totals = {'claimed': 0, 'skipped': 0, 'total': 0, 'sent': 0, 'failed': 0, 'pruned': 0, 'logged': 0, 'batches': 0}
+    stop_at = stop_at or time.monotonic() + REMINDER_DRAIN_SECONDS
+    
+    while time.monotonic() < stop_at:
+        rows = claim_due_reminders(conn, kinds, REMINDER_DRAIN_BATCH, shard)
+        if not rows:
+            conn.commit()
+            break
         
-        lesson = cursor.fetchone()
-        if lesson:
-            subject, start_time, room = lesson
-            notification_data = {
-                'title': f'📚 Скоро пара: {subject}',
-                'body': f'Начало в {start_time.strftime("%H:%M")}' + (f', {room}' if room else ''),
-                'tag': f'lesson-{user_id}',
-                'url': '/'
-            }
-            
-            try:
-                send_push_notification(endpoint, p256dh, auth, notification_data)
-            except Exception as e:
-                print(f'Failed to send lesson reminder: {e}')
+        results, stats = deliver_pushes(build_reminder_messages(conn, rows))
+        
+        # Удаление забранных строк коммитится вместе с журналом — блокировки держатся до конца отправки
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM reminder_queue WHERE id = ANY(%s)', ([row[0] for row in rows],))
+        cursor.close()
+        totals['logged'] += record_notifications(conn, results)
+        totals['pruned'] += apply_delivery_results(conn, results)
+        
+        totals['batches'] += 1
+        totals['claimed'] += len(rows)
+        totals['skipped'] += sum(1 for row in rows if row[5])
+        for key in ('total', 'sent', 'failed'):
+            totals[key] += stats[key]
+        totals['latency_ms'] = stats['latency_ms']
     
+    return totals
+
+def parse_shard(body: dict):
+    """Шард из тела запроса: (shard_index, shard_count), None без шардирования или ошибка текстом"""
+    if 'shard_count' not in body:
+        return None
+    try:
+        shard_index, shard_count = int(body.get('shard_index', 0)), int(body['shard_count'])
+    except (TypeError, ValueError):
+        return 'shard_index and shard_count must be integers'
+    if not 1 <= shard_count <= REMINDER_MAX_SHARDS or not 0 <= shard_index < shard_count:
+        return f'Expected 0 <= shard_index < shard_count <= {REMINDER_MAX_SHARDS}'
+    return shard_index, shard_count
+
+def acquire_shard_lease(conn, shard_count: int, worker_id: str, exclude: list = None):
+    """Арендует свободный шард на время вызова; давно не обработанные шарды выдаются первыми.
+    
+    exclude — шарды, уже пройденные этим вызовом: каждый шард арендуется не больше одного раза.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO reminder_shards (shard_count, shard_index)
+        SELECT %s, i FROM generate_series(0, %s - 1) AS i
+        ON CONFLICT DO NOTHING
+    ''', (shard_count, shard_count))
+    cursor.execute('''
+        UPDATE reminder_shards SET worker_id = %s, leased_until = now() + make_interval(secs => %s),
+                                   last_started_at = now()
+        WHERE (shard_count, shard_index) = (
+            SELECT shard_count, shard_index FROM reminder_shards
+            WHERE shard_count = %s AND (leased_until IS NULL OR leased_until < now())
+            AND shard_index <> ALL(%s)
+            ORDER BY last_finished_at NULLS FIRST
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING shard_index
+    ''', (worker_id, REMINDER_DRAIN_SECONDS + 60, shard_count, list(exclude or [])))
+    row = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return (row[0], shard_count) if row else None
+
+def record_shard_progress(conn, shard: tuple, stats: dict):
+    """Сохраняет итоги прогона шарда и снимает аренду"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO reminder_shards (shard_index, shard_count, last_started_at, last_finished_at,
+                                     last_claimed, last_sent, last_failed)
+        VALUES (%s, %s, now(), now(), %s, %s, %s)
+        ON CONFLICT (shard_count, shard_index) DO UPDATE
+        SET last_finished_at = now(), last_claimed = EXCLUDED.last_claimed, last_sent = EXCLUDED.last_sent,
+            last_failed = EXCLUDED.last_failed, leased_until = NULL, worker_id = NULL
+    ''', (shard[0], shard[1], stats['claimed'], stats['sent'], stats['failed']))
+    conn.commit()
     cursor.close()
+
+def handle_send_due_reminders(conn, kinds: tuple, body: dict) -> dict:
+    """Отправка созревших напоминаний из очереди (запускается по расписанию, можно несколькими воркерами).
+    
+    Без параметров разбирается вся очередь; shard_index/shard_count ограничивают прогон шардом,
+    lease=true с shard_count — воркер по очереди арендует свободные шарды (каждый не больше раза за вызов),
+    пока не выйдет время или не кончатся шарды.
+    """
+    shard = parse_shard(body)
+    if isinstance(shard, str):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': shard})
+        }
+    
+    if shard and body.get('lease'):
+        worker_id = body.get('worker_id') or uuid.uuid4().hex[:12]
+        stop_at = time.monotonic() + REMINDER_DRAIN_SECONDS
+        shards = []
+        while time.monotonic() < stop_at:
+            leased = acquire_shard_lease(conn, shard[1], worker_id, [s['shard_index'] for s in shards])
+            if not leased:
+                break
+            stats = drain_reminder_queue(conn, kinds, leased, stop_at)
+            record_shard_progress(conn, leased, stats)
+            shards.append({'shard_index': leased[0], **stats})
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'success': True,
+                'worker_id': worker_id,
+                'sent': sum(s['sent'] for s in shards),
+                'shards': shards
+            })
+        }
+    
+    stats = drain_reminder_queue(conn, kinds, shard)
+    if shard:
+        record_shard_progress(conn, shard, stats)
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'success': True, 'sent': len(users)})
+        'body': json.dumps({'success': True, 'sent': stats['sent'], 'stats': stats})
     }
 
-def handle_send_deadline_reminders(conn) -> dict:
-    """Отправка напоминаний о дедлайнах (запускается по расписанию)"""
-    cursor = conn.cursor()
+def handle_dispatch_reminders(body: dict) -> dict:
+    """Координатор: параллельно вызывает эту же функцию по разу на шард и собирает прогресс шардов"""
+    if not NOTIFICATIONS_SELF_URL:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'NOTIFICATIONS_SELF_URL is not configured'})
+        }
+    
+    shard = parse_shard({'shard_count': body.get('shards', 4)})
+    if isinstance(shard, str):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': shard})
+        }
+    shard_count = shard[1]
+    shard_action = body.get('shard_action', 'send_due_reminders')
+    if shard_action not in SHARDED_ACTIONS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'shard_action must be one of {", ".join(SHARDED_ACTIONS)}'})
+        }
+    
+    def invoke(shard_index):
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                NOTIFICATIONS_SELF_URL,
+                json={'action': shard_action, 'shard_index': shard_index, 'shard_count': shard_count},
+                headers={'X-Cron-Secret': NOTIFICATIONS_CRON_SECRET},
+                timeout=REMINDER_DRAIN_SECONDS + 60
+            )
+            payload = response.json() if response.ok else {'error': response.text[:200]}
+            result = {'shard_index': shard_index, 'status': response.status_code, **payload.get('stats', payload)}
+        except Exception as e:
+            result = {'shard_index': shard_index, 'status': None, 'error': str(e)[:200]}
+        result['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return result
     
-    tomorrow = datetime.now() + timedelta(days=1)
+    with ThreadPoolExecutor(max_workers=shard_count) as pool:
+        shards = list(pool.map(invoke, range(shard_count)))
     
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': all(s['status'] == 200 for s in shards),
+            'sent': sum(s.get('sent', 0) for s in shards),
+            'shards': shards
+        })
+    }
+
+def get_shard_status(conn) -> dict:
+    """Прогресс шардов по последним прогонам"""
+    cursor = conn.cursor()
     cursor.execute('''
-        SELECT DISTINCT u.id, u.full_name, ps.endpoint, ps.p256dh, ps.auth
-        FROM users u
-        JOIN push_subscriptions ps ON u.id = ps.user_id
-        JOIN notification_settings ns ON u.id = ns.user_id
-        JOIN tasks t ON u.id = t.user_id
-        WHERE ps.endpoint IS NOT NULL
-        AND ns.deadline_reminder = TRUE
-        AND t.completed = FALSE
-        AND t.deadline >= CURRENT_TIMESTAMP
-        AND t.deadline <= %s
-    ''', (tomorrow,))
-    
-    users = cursor.fetchall()
-    
-    for user_id, full_name, endpoint, p256dh, auth in users:
+        SELECT shard_count, shard_index, worker_id, leased_until, last_started_at, last_finished_at,
+               last_claimed, last_sent, last_failed
+        FROM reminder_shards
+        ORDER BY shard_count, shard_index
+    ''')
+    columns = [c[0] for c in cursor.description]
+    shards = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'shards': shards}, default=str)
+    }
+
+def format_digest(lessons_today: int, first_subject: str, first_start, due_soon: int, next_title: str, overdue: int) -> str:
+    """Текст сводки дня"""
+    parts = []
+    if lessons_today:
+        parts.append(f'Пар сегодня: {lessons_today}, первая — {first_subject} в {first_start.strftime("%H:%M")}')
+    if due_soon:
+        parts.append(f'Дедлайнов до завтра: {due_soon}' + (f', ближайший — {next_title}' if next_title else ''))
+    if overdue:
+        parts.append(f'Просрочено: {overdue}')
+    return '. '.join(parts)
+
+def handle_send_daily_digests(conn, body: dict) -> dict:
+    """Сводка дня одним push на пользователя в его reminder_time (крон раз в 15 минут, поддерживает шарды).
+    
+    Пользователи идут порциями по user_id; журнал пишется после каждой порции, поэтому вызов,
+    оборванный по таймауту, не приводит к повторной сводке тем, кому она уже ушла.
+    Сводка уходит не позже REMINDER_MAX_DELAY_MINUTES после reminder_time; пустая сводка тоже
+    отмечается в журнале, чтобы пользователь не попадал в выборку каждые 15 минут до конца дня.
+    """
+    shard = parse_shard(body)
+    if isinstance(shard, str):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': shard})
+        }
+    shard_index, shard_count = shard or (0, 1)
+    
+    totals = {'users': 0, 'empty': 0, 'total': 0, 'sent': 0, 'failed': 0, 'logged': 0, 'pruned': 0, 'batches': 0}
+    stop_at = time.monotonic() + REMINDER_DRAIN_SECONDS
+    after_user_id = 0
+    
+    while time.monotonic() < stop_at:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ns.user_id
+            FROM notification_settings ns
+            WHERE ns.daily_digest = TRUE AND ns.user_id > %(after)s
+            -- Приведение интервала к time берёт его по модулю суток: окно переходит через полночь
+            AND ((now() AT TIME ZONE ns.timezone)::time - ns.reminder_time)::time < make_interval(mins => %(window)s)::time
+            AND (%(shard_count)s = 1 OR reminder_shard(ns.user_id, %(shard_count)s) = %(shard_index)s)
+            AND EXISTS (
+                SELECT 1 FROM push_subscriptions ps
+                WHERE ps.user_id = ns.user_id AND ps.endpoint IS NOT NULL AND ps.is_active
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM notification_log nl
+                WHERE nl.user_id = ns.user_id AND nl.kind = 'digest'
+                AND nl.object_id = ns.user_id AND nl.occurrence_date = (now() AT TIME ZONE ns.timezone)::date
+            )
+            ORDER BY ns.user_id
+            LIMIT %(limit)s
+        ''', {'after': after_user_id, 'window': REMINDER_MAX_DELAY_MINUTES, 'shard_count': shard_count,
+              'shard_index': shard_index, 'limit': DIGEST_FETCH_BATCH})
+        user_ids = [row[0] for row in cursor.fetchall()]
+        if not user_ids:
+            cursor.close()
+            conn.commit()
+            break
+        after_user_id = user_ids[-1]
+        
+        # Все подписки пользователя попадают в одну порцию: журнал не отметит сводку, пока не отправлены все
         cursor.execute('''
-            SELECT title, deadline FROM tasks
-            WHERE user_id = %s AND completed = FALSE
-            AND deadline >= CURRENT_TIMESTAMP AND deadline <= %s
-            ORDER BY deadline LIMIT 3
-        ''', (user_id, tomorrow))
+            WITH due_users AS (
+                SELECT ns.user_id, (now() AT TIME ZONE ns.timezone) AS local_now
+                FROM notification_settings ns
+                WHERE ns.user_id = ANY(%s)
+            ),
+            lessons AS (
+                SELECT s.user_id, COUNT(*) AS lessons_today,
+                       (array_agg(s.subject ORDER BY s.start_time))[1] AS first_subject,
+                       MIN(s.start_time) AS first_start
+                FROM due_users du
+                JOIN schedule s ON s.user_id = du.user_id
+                WHERE s.day_of_week = EXTRACT(ISODOW FROM du.local_now)::int
+                AND lesson_occurs_on(s.week_parity, s.starts_on, s.active_dates, s.excluded_dates, du.local_now::date)
+                GROUP BY s.user_id
+            ),
+            task_counts AS (
+                SELECT t.user_id,
+                       COUNT(*) FILTER (WHERE t.deadline < du.local_now) AS overdue,
+                       COUNT(*) FILTER (WHERE t.deadline >= du.local_now) AS due_soon,
+                       (array_agg(t.title ORDER BY t.deadline) FILTER (WHERE t.deadline >= du.local_now))[1] AS next_title
+                FROM due_users du
+                JOIN tasks t ON t.user_id = du.user_id AND t.completed = FALSE
+                            AND t.deadline < du.local_now::date + 2
+                GROUP BY t.user_id
+            )
+            SELECT ps.id, du.user_id, ps.endpoint, ps.p256dh, ps.auth, du.local_now::date,
+                   COALESCE(l.lessons_today, 0), l.first_subject, l.first_start,
+                   COALESCE(tc.due_soon, 0), tc.next_title, COALESCE(tc.overdue, 0)
+            FROM due_users du
+            JOIN push_subscriptions ps ON ps.user_id = du.user_id AND ps.endpoint IS NOT NULL AND ps.is_active
+            LEFT JOIN lessons l ON l.user_id = du.user_id
+            LEFT JOIN task_counts tc ON tc.user_id = du.user_id
+            WHERE l.user_id IS NOT NULL OR tc.user_id IS NOT NULL
+        ''', (user_ids,))
+        rows = cursor.fetchall()
+        
+        # Пустая сводка или подписка, отключённая между запросами, — сегодня отправлять нечего
+        empty_user_ids = sorted(set(user_ids) - {row[1] for row in rows})
+        if empty_user_ids:
+            cursor.execute('''
+                INSERT INTO notification_log (user_id, kind, object_id, occurrence_date)
+                SELECT ns.user_id, 'digest', ns.user_id, (now() AT TIME ZONE ns.timezone)::date
+                FROM notification_settings ns
+                WHERE ns.user_id = ANY(%s)
+                ON CONFLICT (user_id, kind, object_id, occurrence_date) DO NOTHING
+            ''', (empty_user_ids,))
+        conn.commit()
+        cursor.close()
+        totals['empty'] += len(empty_user_ids)
         
-        tasks = cursor.fetchall()
-        if tasks:
-            task_count = len(tasks)
-            first_task = tasks[0]
-            notification_data = {
-                'title': f'⏰ Дедлайн через 24 часа!',
-                'body': f'{first_task[0]}' + (f' и ещё {task_count - 1}' if task_count > 1 else ''),
-                'tag': f'deadline-{user_id}',
+        results, stats = deliver_pushes(
+            {
+                'subscription_id': subscription_id,
+                'user_id': user_id,
+                'ledger': [('digest', user_id, local_date)],
+                'endpoint': endpoint,
+                'p256dh': p256dh,
+                'auth': auth,
+                'data': {
+                    'title': '🗓 Сводка на сегодня',
+                    'body': format_digest(lessons_today, first_subject, first_start, due_soon, next_title, overdue),
+                    'tag': f'digest-{user_id}',
+                    'url': '/'
+                }
+            }
+            for (subscription_id, user_id, endpoint, p256dh, auth, local_date,
+                 lessons_today, first_subject, first_start, due_soon, next_title, overdue) in rows
+        )
+        totals['logged'] += record_notifications(conn, results)
+        totals['pruned'] += apply_delivery_results(conn, results)
+        
+        totals['batches'] += 1
+        totals['users'] += len(user_ids)
+        for key in ('total', 'sent', 'failed'):
+            totals[key] += stats[key]
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'sent': totals['sent'], 'stats': totals})
+    }
+
+def handle_send_share_updates(conn) -> dict:
+    """Рассылка подписчикам об изменениях расшаренных расписаний (крон раз в минуту).
+    
+    Пачка правок отправляется, когда владелец затих на SHARE_UPDATES_QUIET_MINUTES
+    или правки идут дольше SHARE_UPDATES_MAX_WAIT_MINUTES.
+    """
+    cursor = conn.cursor()
+    # Забираем созревшие пачки и сразу коммитим, чтобы не держать блокировку на время рассылки
+    cursor.execute('''
+        DELETE FROM shared_schedule_changes
+        WHERE shared_schedule_id IN (
+            SELECT shared_schedule_id FROM shared_schedule_changes
+            WHERE last_change_at <= now() - make_interval(mins => %s)
+               OR first_change_at <= now() - make_interval(mins => %s)
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING shared_schedule_id, change_count
+    ''', (SHARE_UPDATES_QUIET_MINUTES, SHARE_UPDATES_MAX_WAIT_MINUTES))
+    changes = dict(cursor.fetchall())
+    conn.commit()
+    cursor.close()
+    
+    if not changes:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, 'sent': 0, 'shares': 0})
+        }
+    
+    # Подписчики всех пачек одним запросом через серверный курсор — у расписания группы их могут быть тысячи
+    cursor = conn.cursor(name='share_updates')
+    cursor.itersize = SHARE_UPDATES_FETCH_BATCH
+    cursor.execute('''
+        SELECT ps.id, ps.user_id, ps.endpoint, ps.p256dh, ps.auth, ss.id, ss.title
+        FROM shared_schedules ss
+        JOIN schedule_subscribers sub ON sub.shared_schedule_id = ss.id
+        JOIN push_subscriptions ps ON ps.user_id = sub.user_id AND ps.endpoint IS NOT NULL AND ps.is_active
+        LEFT JOIN notification_settings ns ON ns.user_id = sub.user_id
+        WHERE ss.id = ANY(%s) AND ss.is_active = TRUE
+        AND sub.user_id <> ss.owner_user_id
+        AND ns.lessons_reminder IS DISTINCT FROM FALSE
+    ''', (list(changes),))
+    
+    results, stats = deliver_pushes(
+        {
+            'subscription_id': subscription_id,
+            'endpoint': endpoint,
+            'p256dh': p256dh,
+            'auth': auth,
+            'data': {
+                'title': f'🔄 Расписание «{title}» обновлено',
+                'body': f'Изменений: {changes[shared_schedule_id]}. Откройте приложение, чтобы посмотреть',
+                'tag': f'share-{shared_schedule_id}',
                 'url': '/'
             }
-            
-            try:
-                send_push_notification(endpoint, p256dh, auth, notification_data)
-            except Exception as e:
-                print(f'Failed to send deadline reminder: {e}')
+        }
+        for subscription_id, user_id, endpoint, p256dh, auth, shared_schedule_id, title in cursor
+    )
     
     cursor.close()
+    stats['pruned'] = apply_delivery_results(conn, results)
+    stats['shares'] = len(changes)
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'success': True, 'sent': len(users)})
+        'body': json.dumps({'success': True, 'sent': stats['sent'], 'stats': stats})
     }
 
-def send_push_notification(endpoint: str, p256dh: str, auth: str, data: dict):
-    """Отправка push-уведомления через Web Push API"""
+def handle_roll_reminder_queue(conn) -> dict:
+    """Еженедельная докрутка повторяющихся пар на горизонт очереди (запускается по расписанию)"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM reminder_queue WHERE fire_at < now() - make_interval(mins => %s)
+    ''', (REMINDER_MAX_DELAY_MINUTES,))
+    expired = cursor.rowcount
+    cursor.execute('SELECT enqueue_lesson_reminders(NULL, NULL)')
+    enqueued = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'enqueued': enqueued, 'expired': expired})
+    }
+
+def record_notifications(conn, results: list) -> int:
+    """Записывает в журнал напоминания, дошедшие хотя бы до одного устройства; повторы гасит уникальный индекс"""
+    rows = {
+        (r['user_id'], kind, object_id, day)
+        for r in results if r['ok'] and r.get('user_id')
+        for kind, object_id, day in r.get('ledger', [])
+    }
+    if not rows:
+        return 0
+    
+    cursor = conn.cursor()
+    execute_values(cursor, '''
+        INSERT INTO notification_log (user_id, kind, object_id, occurrence_date)
+        VALUES %s
+        ON CONFLICT (user_id, kind, object_id, occurrence_date) DO NOTHING
+    ''', list(rows), page_size=1000)
+    conn.commit()
+    cursor.close()
+    return len(rows)
+
+def get_push_session(origin: str) -> requests.Session:
+    """Keep-alive сессия для origin push-сервиса: TLS-рукопожатие одно на соединение пула, а не на сообщение"""
+    with _push_sessions_lock:
+        session = _push_sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PUSH_CONCURRENCY)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _push_sessions[origin] = session
+        return session
+
+def get_vapid_headers(audience: str) -> dict:
+    """Заголовок Authorization VAPID для audience: ECDSA-подпись одна на origin за окно действия токена"""
+    global _vapid_key
+    now = int(time.time())
+    with _vapid_lock:
+        cached = _vapid_headers.get(audience)
+        if cached and cached[1] - VAPID_REFRESH_MARGIN > now:
+            return cached[0]
+        
+        if _vapid_key is None:
+            if os.path.isfile(VAPID_PRIVATE_KEY):
+                _vapid_key = Vapid.from_file(private_key_file=VAPID_PRIVATE_KEY)
+            else:
+                _vapid_key = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+        
+        expires = now + VAPID_TOKEN_TTL
+        headers = _vapid_key.sign({'sub': VAPID_EMAIL, 'aud': audience, 'exp': expires})
+        _vapid_headers[audience] = (headers, expires)
+        return headers
+
+def send_push_notification(endpoint: str, p256dh: str, auth: str, data: dict, requests_session: requests.Session = None):
+    """Отправка push-уведомления через Web Push API; на сообщение остаётся только шифрование payload"""
+    if PUSH_ENDPOINT_OVERRIDE:
+        parts = urlsplit(endpoint)
+        endpoint = PUSH_ENDPOINT_OVERRIDE.rstrip('/') + parts.path + (f'?{parts.query}' if parts.query else '')
+    
     subscription_info = {
         'endpoint': endpoint,
         'keys': {
@@ -298,11 +938,179 @@ def send_push_notification(endpoint: str, p256dh: str, auth: str, data: dict):
         }
     }
     
-    webpush(
+    origin = endpoint_origin(endpoint)
+    # Без vapid_claims pywebpush не подписывает JWT заново — передаём готовый заголовок
+    return webpush(
         subscription_info=subscription_info,
         data=json.dumps(data),
-        vapid_private_key=VAPID_PRIVATE_KEY,
-        vapid_claims={
-            'sub': VAPID_EMAIL
+        headers=get_vapid_headers(origin),
+        timeout=PUSH_TIMEOUT,
+        requests_session=requests_session or get_push_session(origin)
+    )
+
+def endpoint_origin(endpoint: str) -> str:
+    """scheme://host[:port] endpoint'а — ключ keep-alive сессии"""
+    if PUSH_ENDPOINT_OVERRIDE:
+        return PUSH_ENDPOINT_OVERRIDE.rstrip('/')
+    parts = urlsplit(endpoint)
+    return f'{parts.scheme}://{parts.netloc}'
+
+def deliver_one(message: dict) -> dict:
+    """Отправляет одно сообщение и возвращает результат с задержкой и кодом ответа push-сервиса"""
+    started = time.perf_counter()
+    result = {key: value for key, value in message.items() if key not in ('p256dh', 'auth', 'data')}
+    try:
+        response = send_push_notification(message['endpoint'], message['p256dh'], message['auth'], message['data'])
+        result.update(ok=True, status=getattr(response, 'status_code', None))
+    except WebPushException as e:
+        result.update(ok=False, status=e.response.status_code if e.response is not None else None, error=str(e)[:200])
+    except Exception as e:
+        result.update(ok=False, status=None, error=str(e)[:200])
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+def percentile(sorted_values: list, share: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(share * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def deliver_pushes(messages, concurrency: int = None) -> tuple:
+    """Параллельная отправка через ограниченный пул потоков.
+    
+    messages может быть генератором: в работе не больше 2×concurrency сообщений, остальные ещё не прочитаны.
+    Возвращает (результаты по endpoint'ам, сводка с пропускной способностью и перцентилями задержки).
+    """
+    concurrency = max(1, concurrency or PUSH_CONCURRENCY)
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    results = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    
+    def run(message):
+        try:
+            return deliver_one(message)
+        finally:
+            in_flight.release()
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        for message in messages:
+            in_flight.acquire()
+            futures.append(pool.submit(run, message))
+        for future in futures:
+            results.append(future.result())
+    
+    elapsed = time.perf_counter() - started
+    cpu_elapsed = time.process_time() - cpu_started
+    latencies = sorted(r['latency_ms'] for r in results)
+    sent = sum(1 for r in results if r['ok'])
+    
+    for r in results:
+        if not r['ok']:
+            print(f"Failed to send to {r['endpoint']}: {r.get('status')} {r.get('error')}")
+    
+    stats = {
+        'total': len(results),
+        'sent': sent,
+        'failed': len(results) - sent,
+        'duration_ms': round(elapsed * 1000, 1),
+        'throughput_per_sec': round(len(results) / elapsed, 1) if elapsed > 0 else 0,
+        'cpu_ms_per_push': round(cpu_elapsed * 1000 / len(results), 3) if results else 0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0
         }
+    }
+    return results, stats
+
+def is_transient_push_error(status) -> bool:
+    """Временная ошибка на стороне push-сервиса; без кода ответа — сбой у нас, а не у подписки"""
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+def apply_delivery_results(conn, results: list) -> int:
+    """Записывает итоги прогона в push_subscriptions пакетно: отозванные удаляет,
+    временные ошибки push-сервиса считает и отключает подписки с долгой серией ошибок"""
+    gone_ids = [r['subscription_id'] for r in results if r.get('subscription_id') and r['status'] in PUSH_GONE_STATUSES]
+    failed_ids = [r['subscription_id'] for r in results
+                  if r.get('subscription_id') and not r['ok'] and is_transient_push_error(r['status'])]
+    ok_ids = [r['subscription_id'] for r in results if r.get('subscription_id') and r['ok']]
+    
+    cursor = conn.cursor()
+    pruned = 0
+    if gone_ids:
+        cursor.execute('DELETE FROM push_subscriptions WHERE id = ANY(%s)', (gone_ids,))
+        pruned += cursor.rowcount
+    
+    if failed_ids or ok_ids:
+        cursor.execute('''
+            UPDATE push_subscriptions
+            SET failure_count = CASE WHEN id = ANY(%(failed)s) THEN failure_count + 1 ELSE 0 END,
+                last_failure_at = CASE WHEN id = ANY(%(failed)s) THEN CURRENT_TIMESTAMP ELSE last_failure_at END,
+                failing_since = CASE WHEN id = ANY(%(failed)s) THEN COALESCE(failing_since, CURRENT_TIMESTAMP) END
+            WHERE id = ANY(%(failed)s) OR (id = ANY(%(ok)s) AND failure_count > 0)
+        ''', {'failed': failed_ids, 'ok': ok_ids})
+    
+    deactivated = 0
+    if failed_ids:
+        cursor.execute('''
+            UPDATE push_subscriptions SET is_active = FALSE
+            WHERE id = ANY(%s) AND is_active AND failure_count >= %s
+            AND failing_since <= CURRENT_TIMESTAMP - make_interval(hours => %s)
+        ''', (failed_ids, PUSH_MAX_FAILURES, PUSH_DEACTIVATE_AFTER_HOURS))
+        deactivated = cursor.rowcount
+    
+    conn.commit()
+    cursor.close()
+    
+    if pruned or deactivated:
+        print(f'Pruned {pruned} revoked push subscriptions, deactivated {deactivated} failing')
+    return pruned
+
+def handle_push_benchmark(body: dict) -> dict:
+    """Нагрузочный прогон движка отправки на локальный стенд (включается PUSH_ENDPOINT_OVERRIDE)"""
+    if not PUSH_ENDPOINT_OVERRIDE:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Benchmark is available only with PUSH_ENDPOINT_OVERRIDE'})
+        }
+    
+    subscription = body.get('subscription') or {}
+    keys = subscription.get('keys', {})
+    if not keys.get('p256dh') or not keys.get('auth'):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Subscription keys required'})
+        }
+    
+    try:
+        count = int(body.get('count', 100))
+        concurrency = int(body.get('concurrency') or PUSH_CONCURRENCY)
+    except (TypeError, ValueError):
+        count = concurrency = 0
+    if count < 1 or concurrency < 1 or isinstance(body.get('count'), bool) or isinstance(body.get('concurrency'), bool):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'count and concurrency must be positive integers'})
+        }
+    count = min(count, PUSH_BENCHMARK_MAX_COUNT)
+    concurrency = min(concurrency, PUSH_BENCHMARK_MAX_CONCURRENCY)
+    
+    data = {'title': 'benchmark', 'body': 'x' * 100, 'tag': 'benchmark', 'url': '/'}
+    _, stats = deliver_pushes(
+        ({'endpoint': f'{PUSH_ENDPOINT_OVERRIDE.rstrip("/")}/push/{i}', 'p256dh': keys['p256dh'], 'auth': keys['auth'], 'data': data}
+         for i in range(count)),
+        concurrency=concurrency
     )
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'count': count, 'concurrency': concurrency, 'stats': stats})
+    }
@@ -2,10 +2,60 @@
 
 import json
 import os
-from datetime import datetime
+import io
+import base64
+import hashlib
+import secrets
+import heapq
+from datetime import datetime, date, time, timezone, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+from zoneinfo import ZoneInfo
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.errors import ExclusionViolation
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ, ISOLATION_LEVEL_READ_COMMITTED
 import jwt
+from openpyxl import load_workbook
+
+IMPORT_MAX_ROWS = 300
+IMPORT_RETURNING = 'id, subject, type, start_time, end_time, day_of_week, room, teacher, color, week_parity, starts_on, ends_on, excluded_dates'
+FEED_TIMEZONE = os.environ.get('SCHEDULE_FEED_TZ', 'Europe/Moscow')
+FEED_FORMAT_VERSION = 2
+OCCURRENCES_MAX_DAYS = 186
+TASKS_PAGE_DEFAULT = 50
+TASKS_PAGE_MAX = 500
+TASK_STATUSES = ('open', 'completed', 'all')
+TASK_PRIORITIES = ('low', 'medium', 'high')
+TASK_EDITABLE_FIELDS = ('title', 'description', 'subject', 'deadline', 'priority', 'completed')
+TASK_BATCH_ACTIONS = ('complete', 'reopen', 'delete', 'reschedule', 'clear_completed')
+TASK_BATCH_MAX_IDS = 500
+DASHBOARD_TASKS_DAYS = 7
+DASHBOARD_TASKS_LIMIT = 20
+WEEK_PARITY_ALIASES = {
+    '1': 1, 'odd': 1, 'числитель': 1, 'нечет': 1, 'нечетная': 1, 'нечётная': 1,
+    '2': 2, 'even': 2, 'знаменатель': 2, 'чет': 2, 'четная': 2, 'чётная': 2
+}
+IMPORT_TIMEZONE = os.environ.get('SCHEDULE_IMPORT_TZ', 'Europe/Moscow')
+LESSON_TYPES = ('lecture', 'practice', 'lab')
+DAY_PREFIXES = (
+    ('пн', 1), ('пон', 1), ('mon', 1),
+    ('вт', 2), ('tue', 2),
+    ('ср', 3), ('wed', 3),
+    ('чт', 4), ('чет', 4), ('thu', 4),
+    ('пт', 5), ('пят', 5), ('fri', 5),
+    ('сб', 6), ('суб', 6), ('sat', 6),
+    ('вс', 7), ('вос', 7), ('sun', 7)
+)
+XLSX_COLUMNS = {
+    'day_of_week': ('день', 'day'),
+    'start_time': ('начало', 'start', 'время начала'),
+    'end_time': ('конец', 'окончание', 'end', 'время окончания'),
+    'subject': ('предмет', 'дисциплина', 'subject'),
+    'type': ('тип', 'вид', 'type'),
+    'room': ('аудитория', 'ауд', 'room'),
+    'teacher': ('преподаватель', 'teacher'),
+    'week_parity': ('неделя', 'числитель', 'week', 'parity')
+}
 
 
 def get_db_connection():
@@ -25,6 +75,1222 @@ def verify_token(token: str) -> dict:
         return None
 
 
+def check_unlimited_access(cur, user_id: int) -> bool:
+    """Проверяет, действует ли премиум или триал (без лимитов Free)"""
+    cur.execute("""
+        SELECT subscription_type, subscription_expires_at, trial_ends_at, is_trial_used
+        FROM users WHERE id = %s
+    """, (user_id,))
+    user = cur.fetchone()
+    
+    if not user:
+        return False
+    
+    return has_unlimited_access(user)
+
+
+def has_unlimited_access(user: dict) -> bool:
+    """Премиум или триал по уже прочитанной строке users"""
+    now = datetime.now()
+    if user['subscription_type'] == 'premium':
+        expires = user.get('subscription_expires_at')
+        if expires and expires.replace(tzinfo=None) > now:
+            return True
+    
+    trial_ends = user.get('trial_ends_at')
+    if trial_ends and not user.get('is_trial_used'):
+        if trial_ends.replace(tzinfo=None) > now:
+            return True
+    
+    return False
+
+
+def get_subscription_limits(user: dict, lessons_count: int, tasks_count: int) -> dict:
+    """Тот же ответ, что subscription.get_limits, по уже прочитанной строке users.
+    
+    Истёкшую подписку и месячные сбросы квот записывает subscription; здесь они только учитываются.
+    """
+    now = datetime.now()
+    is_premium = False
+    if user['subscription_type'] == 'premium':
+        expires = user.get('subscription_expires_at')
+        is_premium = not expires or expires.replace(tzinfo=None) > now
+    
+    trial_ends_at = None
+    trial_ends = user.get('trial_ends_at')
+    if not is_premium and trial_ends and not user.get('is_trial_used') and trial_ends.replace(tzinfo=None) > now:
+        trial_ends_at = trial_ends
+    
+    materials_used = user.get('materials_quota_used') or 0
+    materials_reset_at = user.get('materials_quota_reset_at')
+    if materials_reset_at and materials_reset_at < now:
+        materials_used = 0
+    ai_used = user.get('ai_questions_used') or 0
+    ai_reset_at = user.get('ai_questions_reset_at')
+    if ai_reset_at and ai_reset_at < now:
+        ai_used = 0
+    
+    status = {
+        'is_premium': is_premium,
+        'is_trial': trial_ends_at is not None,
+        'subscription_type': user['subscription_type'],
+        'subscription_expires_at': user['subscription_expires_at'].isoformat() if user.get('subscription_expires_at') else None,
+        'trial_ends_at': trial_ends_at.isoformat() if trial_ends_at else None,
+        'materials_quota_used': materials_used,
+        'materials_quota_reset_at': materials_reset_at.isoformat() if materials_reset_at else None,
+        'ai_questions_used': ai_used,
+        'ai_questions_reset_at': ai_reset_at.isoformat() if ai_reset_at else None
+    }
+    
+    if is_premium:
+        return {
+            **status,
+            'limits': {
+                'schedule': {'used': lessons_count, 'max': None, 'unlimited': True},
+                'tasks': {'used': tasks_count, 'max': None, 'unlimited': True},
+                'materials': {'used': materials_used, 'max': None, 'unlimited': True},
+                'exam_predictions': {'unlimited': True}
+            }
+        }
+    return {
+        **status,
+        'limits': {
+            'schedule': {'used': lessons_count, 'max': 15, 'unlimited': False},
+            'tasks': {'used': tasks_count, 'max': 20, 'unlimited': False},
+            'materials': {'used': materials_used, 'max': 3, 'unlimited': False},
+            'ai_questions': {'used': ai_used, 'max': 3, 'unlimited': False},
+            'exam_predictions': {'unlimited': False, 'available': False}
+        }
+    }
+
+
+def get_usage_counters(cur, user_id: int) -> dict:
+    """Читает счётчики занятий и активных задач (поддерживаются триггерами, см. V0024)"""
+    cur.execute("""
+        SELECT lessons_count, active_tasks_count
+        FROM user_usage_counters WHERE user_id = %s
+    """, (user_id,))
+    counters = cur.fetchone()
+    return dict(counters) if counters else {'lessons_count': 0, 'active_tasks_count': 0}
+
+
+def parse_time_value(value):
+    """Приводит время из JSON/ICS/XLSX к объекту time"""
+    if isinstance(value, datetime):
+        return value.time().replace(second=0, microsecond=0)
+    if isinstance(value, time):
+        return value.replace(second=0, microsecond=0)
+    text = str(value or '').strip().replace('.', ':')
+    for fmt in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_day_value(value):
+    """Приводит день недели (1-7, 'Пн', 'понедельник', 'Monday') к номеру ISO"""
+    if isinstance(value, (int, float)):
+        return int(value) if 1 <= int(value) <= 7 else None
+    text = str(value or '').strip().lower()
+    if text.isdigit():
+        return int(text) if 1 <= int(text) <= 7 else None
+    for prefix, day in DAY_PREFIXES:
+        if text.startswith(prefix):
+            return day
+    return None
+
+
+def guess_lesson_type(text: str) -> str:
+    """Определяет тип занятия по названию или явному значению"""
+    text = (text or '').lower()
+    if 'лаб' in text or 'lab' in text:
+        return 'lab'
+    if 'прак' in text or 'семин' in text or 'practice' in text or 'seminar' in text:
+        return 'practice'
+    return 'lecture'
+
+
+def parse_date_value(value):
+    """Приводит дату из JSON/XLSX к объекту date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or '').strip()
+    for fmt in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_deadline_value(value):
+    """Приводит дедлайн задачи из JSON к datetime: ISO 8601, datetime-local из формы или дата (начало дня).
+    
+    Смещение часового пояса отбрасывается, как это сделал бы PostgreSQL при записи в TIMESTAMP. None — не дата.
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        pass
+    day = parse_date_value(text)
+    return datetime.combine(day, time.min) if day else None
+
+
+def parse_recurrence(raw: dict) -> tuple:
+    """Проверяет правило повторения занятия, возвращает ((week_parity, starts_on, ends_on), ошибка)"""
+    week_parity = raw.get('week_parity')
+    if week_parity in (None, '', 0, '0', 'every', 'all'):
+        week_parity = None
+    else:
+        week_parity = WEEK_PARITY_ALIASES.get(str(week_parity).strip().lower())
+        if week_parity is None:
+            return None, 'Некорректная чётность недели (1 — числитель, 2 — знаменатель)'
+    
+    starts_on = parse_date_value(raw['starts_on']) if raw.get('starts_on') else None
+    ends_on = parse_date_value(raw['ends_on']) if raw.get('ends_on') else None
+    if (raw.get('starts_on') and not starts_on) or (raw.get('ends_on') and not ends_on):
+        return None, 'Некорректная дата начала или окончания (YYYY-MM-DD)'
+    if starts_on and ends_on and ends_on < starts_on:
+        return None, 'Дата окончания раньше даты начала'
+    
+    return (week_parity, starts_on, ends_on), None
+
+
+def lesson_week_parity(lesson: dict, day: date) -> int:
+    """Чётность недели дня для занятия: от недели starts_on (первая — числитель), иначе по ISO-неделе"""
+    starts_on = lesson.get('starts_on')
+    if starts_on:
+        anchor = starts_on - timedelta(days=starts_on.isoweekday() - 1)
+        return ((day - anchor).days // 7) % 2 + 1
+    return 2 - day.isocalendar()[1] % 2
+
+
+def validate_lesson(raw: dict) -> tuple:
+    """Проверяет одну строку импорта, возвращает (кортеж для вставки, ошибка)"""
+    subject = str(raw.get('subject') or '').strip()
+    start_time = parse_time_value(raw.get('start_time'))
+    end_time = parse_time_value(raw.get('end_time'))
+    day_of_week = parse_day_value(raw.get('day_of_week'))
+    
+    if not subject:
+        return None, 'Не указан предмет'
+    if day_of_week is None:
+        return None, 'Некорректный день недели'
+    if not start_time or not end_time:
+        return None, 'Некорректное время начала или окончания'
+    if end_time <= start_time:
+        return None, 'Время окончания раньше начала'
+    
+    recurrence, error = parse_recurrence(raw)
+    if error:
+        return None, error
+    
+    lesson_type = raw.get('type')
+    if lesson_type not in LESSON_TYPES:
+        lesson_type = guess_lesson_type(f"{lesson_type or ''} {subject}")
+    
+    return (
+        subject[:200],
+        lesson_type,
+        start_time,
+        end_time,
+        day_of_week,
+        (str(raw['room']).strip()[:100] or None) if raw.get('room') else None,
+        (str(raw['teacher']).strip()[:200] or None) if raw.get('teacher') else None,
+        *recurrence,
+        raw.get('color') or 'bg-purple-500'
+    ), None
+
+
+def unescape_ics_text(value: str) -> str:
+    """Снимает экранирование текстовых полей ICS"""
+    return value.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\').strip()
+
+
+def parse_ics_datetime(value: str, params: str):
+    """Разбирает DTSTART/DTEND; время в UTC переводится в часовой пояс импорта"""
+    value = value.strip()
+    if 'VALUE=DATE' in params.upper() and 'T' not in value:
+        return None
+    try:
+        if value.endswith('Z'):
+            dt = datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return dt.astimezone(ZoneInfo(IMPORT_TIMEZONE))
+        return datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    except ValueError:
+        return None
+
+
+def parse_ics(content: str) -> list:
+    """Извлекает занятия из ICS: каждое событие (или серия RRULE) — одно занятие по дню недели"""
+    lines = []
+    for line in content.splitlines():
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        else:
+            lines.append(line)
+    
+    lessons = []
+    event = None
+    for line in lines:
+        if line == 'BEGIN:VEVENT':
+            event = {}
+        elif line == 'END:VEVENT' and event is not None:
+            start = event.get('DTSTART')
+            end = event.get('DTEND')
+            rrule = event.get('RRULE', {})
+            # Серия «через неделю» начинается с числителя в неделю DTSTART
+            biweekly = rrule.get('FREQ') == 'WEEKLY' and rrule.get('INTERVAL') == '2'
+            lessons.append({
+                'subject': event.get('SUMMARY'),
+                'type': guess_lesson_type(event.get('SUMMARY', '') + ' ' + event.get('DESCRIPTION', '')),
+                'day_of_week': start.isoweekday() if start else None,
+                'start_time': start,
+                'end_time': end,
+                'room': event.get('LOCATION'),
+                'week_parity': 1 if biweekly and start else None,
+                'starts_on': start.date() if biweekly and start else None,
+                'ends_on': datetime.strptime(rrule['UNTIL'][:8], '%Y%m%d').date() if rrule.get('UNTIL', '')[:8].isdigit() else None
+            })
+            event = None
+        elif event is not None and ':' in line:
+            name, value = line.split(':', 1)
+            key, _, params = name.partition(';')
+            key = key.upper()
+            if key in ('DTSTART', 'DTEND'):
+                event[key] = parse_ics_datetime(value, params)
+            elif key in ('SUMMARY', 'LOCATION', 'DESCRIPTION'):
+                event[key] = unescape_ics_text(value)
+            elif key == 'RRULE':
+                event[key] = dict(part.split('=', 1) for part in value.strip().upper().split(';') if '=' in part)
+    
+    return lessons
+
+
+def parse_xlsx(data: bytes) -> list:
+    """Извлекает занятия из XLSX: первая строка — заголовки (день, начало, конец, предмет, тип, аудитория, преподаватель)"""
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    header = next(rows, None) or []
+    
+    columns = {}
+    for idx, title in enumerate(header):
+        title = str(title or '').strip().lower()
+        for field, aliases in XLSX_COLUMNS.items():
+            if field not in columns and any(title.startswith(a) for a in aliases):
+                columns[field] = idx
+    
+    lessons = []
+    for row in rows:
+        if not row or all(cell is None for cell in row):
+            continue
+        lessons.append({
+            field: row[idx] if idx < len(row) else None
+            for field, idx in columns.items()
+        })
+    workbook.close()
+    return lessons
+
+
+def insert_lessons_skipping_conflicts(conn, rows: list, row_numbers: list) -> tuple:
+    """Вставка по одной строке под точкой сохранения: пересекающиеся пропускаются. Возвращает (занятия, конфликты)"""
+    lessons = []
+    conflicts = []
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        for row_number, row in zip(row_numbers, rows):
+            cur.execute("SAVEPOINT import_row")
+            try:
+                cur.execute(f"""
+                    INSERT INTO schedule (user_id, subject, type, start_time, end_time, day_of_week, room, teacher,
+                                          week_parity, starts_on, ends_on, color)
+                    VALUES %s
+                    RETURNING {IMPORT_RETURNING}
+                """, (row,))
+                lessons.append(cur.fetchone())
+                cur.execute("RELEASE SAVEPOINT import_row")
+            except ExclusionViolation as e:
+                cur.execute("ROLLBACK TO SAVEPOINT import_row")
+                conflicts.append({
+                    'row': row_number,
+                    'error': 'lesson_conflict',
+                    'conflicts': [int(i) for i in (e.diag.message_detail or '').split(',') if i.strip().isdigit()]
+                })
+    conn.commit()
+    return lessons, conflicts
+
+
+def import_lessons(conn, user_id: int, body: dict, headers: dict) -> dict:
+    """Импорт расписания списком или файлом ICS/XLSX: одна проверка квоты и одна многострочная вставка.
+    
+    Пересекающиеся строки по умолчанию пропускаются и попадают в errors, остальные импортируются;
+    all_or_nothing=true отменяет весь импорт при первом пересечении (409).
+    """
+    raw_lessons = body.get('lessons')
+    all_or_nothing = bool(body.get('all_or_nothing', False))
+    
+    if raw_lessons is None and body.get('file'):
+        file_format = (body.get('format') or body.get('filename', '').rsplit('.', 1)[-1]).lower()
+        try:
+            data = base64.b64decode(body['file'])
+            if file_format in ('ics', 'ical', 'text/calendar'):
+                raw_lessons = parse_ics(data.decode('utf-8', errors='ignore'))
+            elif file_format in ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'):
+                raw_lessons = parse_xlsx(data)
+            else:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Поддерживаются файлы ICS и XLSX'})
+                }
+        except Exception as e:
+            print(f"[SCHEDULE] Ошибка разбора файла импорта: {e}")
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Не удалось прочитать файл расписания'})
+            }
+    
+    if not isinstance(raw_lessons, list) or not raw_lessons:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Передайте lessons или файл расписания'})
+        }
+    
+    if len(raw_lessons) > IMPORT_MAX_ROWS:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f'Слишком много строк (максимум {IMPORT_MAX_ROWS})'})
+        }
+    
+    rows = []
+    row_numbers = []
+    errors = []
+    seen = set()
+    for index, raw in enumerate(raw_lessons, 1):
+        values, error = validate_lesson(raw if isinstance(raw, dict) else {})
+        if error:
+            errors.append({'row': index, 'error': error})
+            continue
+        # Повторяющиеся события календаря (каждую неделю) дают одно занятие
+        if values[:-1] in seen:
+            continue
+        seen.add(values[:-1])
+        rows.append((user_id,) + values)
+        row_numbers.append(index)
+    
+    if not rows:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Нет корректных строк для импорта', 'errors': errors})
+        }
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if not check_unlimited_access(cur, user_id):
+            schedule_count = get_usage_counters(cur, user_id)['lessons_count']
+            if schedule_count + len(rows) > 15:
+                return {
+                    'statusCode': 403,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'error': 'quota_exceeded',
+                        'message': f'📚 Импорт превысит лимит занятий (свободно {max(0, 15 - schedule_count)} из 15). Перейдите на Premium для безлимитного расписания',
+                        'errors': errors
+                    })
+                }
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            lessons = execute_values(cur, f"""
+                INSERT INTO schedule (user_id, subject, type, start_time, end_time, day_of_week, room, teacher,
+                                      week_parity, starts_on, ends_on, color)
+                VALUES %s
+                RETURNING {IMPORT_RETURNING}
+            """, rows, page_size=len(rows), fetch=True)
+            conn.commit()
+    except ExclusionViolation as e:
+        if all_or_nothing:
+            return lesson_conflict_response(conn, user_id, e, headers)
+        # Обычно пересечений нет и хватает одной вставки; при конфликте повторяем построчно
+        conn.rollback()
+        lessons, conflicts = insert_lessons_skipping_conflicts(conn, rows, row_numbers)
+        errors = sorted(errors + conflicts, key=lambda e: e['row'])
+        if not lessons:
+            return {
+                'statusCode': 409,
+                'headers': headers,
+                'body': json.dumps({'error': 'lesson_conflict', 'message': 'Все занятия пересекаются с уже добавленными', 'errors': errors})
+            }
+    
+    return {
+        'statusCode': 201,
+        'headers': headers,
+        'body': json.dumps({
+            'imported': len(lessons),
+            'lessons': [dict(l) for l in lessons],
+            'errors': errors
+        }, default=str)
+    }
+
+
+def get_request_header(event: dict, name: str) -> str:
+    """Возвращает заголовок запроса без учёта регистра"""
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def escape_ics_text(value: str) -> str:
+    """Экранирует текстовое поле ICS"""
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold_ics_line(line: str) -> str:
+    """Переносит строку ICS по 75 октетов (RFC 5545)"""
+    parts = []
+    current = ''
+    current_len = 0
+    for char in line:
+        char_len = len(char.encode('utf-8'))
+        if current_len + char_len > 75:
+            parts.append(current)
+            current = ' '
+            current_len = 1
+        current += char
+        current_len += char_len
+    parts.append(current)
+    return '\r\n'.join(parts)
+
+
+def render_calendar(lessons: list, tasks: list, stamp: datetime) -> str:
+    """Рендерит расписание (еженедельные события) и дедлайны задач в ICS"""
+    dtstamp = stamp.strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Studyfay//Schedule//RU',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:Studyfay',
+        f'X-WR-TIMEZONE:{FEED_TIMEZONE}'
+    ]
+    
+    for lesson in lessons:
+        # Якорь серии — неделя starts_on или неделя создания занятия, чтобы DTSTART не менялся между опросами
+        anchor = lesson.get('starts_on') or (lesson.get('created_at') or stamp).date()
+        day = anchor - timedelta(days=anchor.isoweekday() - 1) + timedelta(days=lesson['day_of_week'] - 1)
+        if day < anchor:
+            day += timedelta(days=7)
+        if lesson.get('week_parity') and lesson_week_parity(lesson, day) != lesson['week_parity']:
+            day += timedelta(days=7)
+        start = datetime.combine(day, lesson['start_time'])
+        end = datetime.combine(day, lesson['end_time'])
+        
+        rrule = 'RRULE:FREQ=WEEKLY'
+        if lesson.get('week_parity'):
+            rrule += ';INTERVAL=2'
+        if lesson.get('ends_on'):
+            rrule += f";UNTIL={lesson['ends_on'].strftime('%Y%m%d')}T235959"
+        
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:lesson-{lesson['id']}@studyfay.app",
+            f'DTSTAMP:{dtstamp}',
+            f"DTSTART:{start.strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND:{end.strftime('%Y%m%dT%H%M%S')}",
+            rrule,
+            f"SUMMARY:{escape_ics_text(lesson['subject'])}"
+        ]
+        for excluded in lesson.get('excluded_dates') or []:
+            lines.append(f"EXDATE:{datetime.combine(excluded, lesson['start_time']).strftime('%Y%m%dT%H%M%S')}")
+        if lesson.get('room'):
+            lines.append(f"LOCATION:{escape_ics_text(lesson['room'])}")
+        if lesson.get('teacher'):
+            lines.append(f"DESCRIPTION:{escape_ics_text(lesson['teacher'])}")
+        lines.append('END:VEVENT')
+    
+    for task in tasks:
+        deadline = task['deadline']
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:task-{task['id']}@studyfay.app",
+            f'DTSTAMP:{dtstamp}',
+            f"DTSTART:{deadline.strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND:{(deadline + timedelta(minutes=30)).strftime('%Y%m%dT%H%M%S')}",
+            f"SUMMARY:{escape_ics_text('⏰ ' + task['title'])}"
+        ]
+        if task.get('subject'):
+            lines.append(f"DESCRIPTION:{escape_ics_text(task['subject'])}")
+        lines.append('END:VEVENT')
+    
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(fold_ics_line(line) for line in lines) + '\r\n'
+
+
+def get_or_create_feed_token(conn, user_id: int, rotate: bool = False) -> str:
+    """Выдаёт токен ICS-фида пользователя; rotate=True отзывает старую ссылку"""
+    with conn.cursor() as cur:
+        if rotate:
+            cur.execute("""
+                INSERT INTO calendar_feeds (user_id, feed_token) VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE
+                SET feed_token = EXCLUDED.feed_token, cached_version = NULL, cached_format = NULL, cached_body = NULL
+                RETURNING feed_token
+            """, (user_id, secrets.token_urlsafe(32)))
+        else:
+            cur.execute("""
+                INSERT INTO calendar_feeds (user_id, feed_token) VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET feed_token = calendar_feeds.feed_token
+                RETURNING feed_token
+            """, (user_id, secrets.token_urlsafe(32)))
+        token = cur.fetchone()[0]
+        conn.commit()
+    return token
+
+
+def serve_calendar_feed(event: dict, token: str) -> dict:
+    """Публичный ICS-фид по токену с ETag/Last-Modified; неизменившиеся данные отдаются 304 без чтения строк"""
+    headers = {'Access-Control-Allow-Origin': '*'}
+    
+    if not token:
+        return {'statusCode': 404, 'headers': headers, 'body': ''}
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT cf.user_id, cf.cached_version, cf.cached_format, cf.created_at,
+                       COALESCE(v.version, 0) AS version, v.updated_at
+                FROM calendar_feeds cf
+                LEFT JOIN user_data_versions v ON v.user_id = cf.user_id
+                WHERE cf.feed_token = %s
+            """, (token,))
+            feed = cur.fetchone()
+            
+            if not feed:
+                return {'statusCode': 404, 'headers': headers, 'body': ''}
+            
+            user_id = feed['user_id']
+            version = feed['version']
+            # TIMESTAMPTZ приходит с поясом сессии — приводим к UTC для Last-Modified и DTSTAMP
+            modified_at = (feed['updated_at'] or feed['created_at']).astimezone(timezone.utc).replace(microsecond=0)
+            etag = '"' + hashlib.sha256(f"{user_id}:{version}:{FEED_FORMAT_VERSION}".encode()).hexdigest()[:32] + '"'
+            headers.update({
+                'ETag': etag,
+                'Last-Modified': format_datetime(modified_at, usegmt=True),
+                'Cache-Control': 'private, max-age=300'
+            })
+            
+            if_none_match = get_request_header(event, 'If-None-Match')
+            if_modified_since = get_request_header(event, 'If-Modified-Since')
+            if if_none_match:
+                if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+                    return {'statusCode': 304, 'headers': headers, 'body': ''}
+            elif if_modified_since:
+                try:
+                    since = parsedate_to_datetime(if_modified_since)
+                    if since.tzinfo is None:
+                        since = since.replace(tzinfo=timezone.utc)
+                    if since >= modified_at:
+                        return {'statusCode': 304, 'headers': headers, 'body': ''}
+                except (TypeError, ValueError):
+                    pass
+            
+            headers['Content-Type'] = 'text/calendar; charset=utf-8'
+            
+            # Кэш годится только для той же версии данных и того же формата рендера
+            if feed['cached_version'] == version and feed['cached_format'] == FEED_FORMAT_VERSION:
+                cur.execute("SELECT cached_body FROM calendar_feeds WHERE user_id = %s", (user_id,))
+                cached_body = cur.fetchone()['cached_body']
+                if cached_body:
+                    return {'statusCode': 200, 'headers': headers, 'body': cached_body}
+            
+            cur.execute("""
+                SELECT id, subject, start_time, end_time, day_of_week, room, teacher, created_at,
+                       week_parity, starts_on, ends_on, excluded_dates
+                FROM schedule
+                WHERE user_id = %s
+                ORDER BY day_of_week, start_time
+            """, (user_id,))
+            lessons = cur.fetchall()
+            
+            cur.execute("""
+                SELECT id, title, subject, deadline
+                FROM tasks
+                WHERE user_id = %s AND completed = FALSE AND deadline IS NOT NULL
+                  AND deadline >= CURRENT_TIMESTAMP - INTERVAL '30 days'
+                ORDER BY deadline
+            """, (user_id,))
+            tasks = cur.fetchall()
+            
+            body = render_calendar(lessons, tasks, modified_at)
+            
+            # Кэш пишем только для той версии, по которой рендерили
+            cur.execute("""
+                UPDATE calendar_feeds
+                SET cached_version = %s, cached_format = %s, cached_body = %s, cached_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s
+            """, (version, FEED_FORMAT_VERSION, body, user_id))
+            conn.commit()
+            
+            return {'statusCode': 200, 'headers': headers, 'body': body}
+    finally:
+        conn.close()
+
+
+def get_sync_delta(conn, user_id: int, since: int) -> dict:
+    """Изменения расписания и задач после версии since; since=0 — полный снимок"""
+    # Снимок на одну точку во времени: версия и строки согласованы между собой
+    conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT version FROM user_data_versions WHERE user_id = %s", (user_id,))
+            row = cur.fetchone()
+            version = row['version'] if row else 0
+            
+            # Версия клиента из будущего (например, после восстановления БД) — отдаём полный снимок
+            if since > version:
+                since = 0
+            
+            if since and since == version:
+                return {
+                    'version': version,
+                    'full': False,
+                    'schedule': [],
+                    'tasks': [],
+                    'deleted': {'schedule': [], 'tasks': []}
+                }
+            
+            cur.execute("""
+                SELECT id, subject, type, start_time, end_time, day_of_week, room, teacher, color,
+                       week_parity, starts_on, ends_on, excluded_dates, sync_version
+                FROM schedule
+                WHERE user_id = %s AND sync_version > %s
+                ORDER BY day_of_week, start_time
+            """, (user_id, since))
+            lessons = cur.fetchall()
+            
+            cur.execute("""
+                SELECT id, title, description, subject, deadline, priority, completed, created_at, sync_version
+                FROM tasks
+                WHERE user_id = %s AND sync_version > %s
+                ORDER BY completed ASC, deadline ASC NULLS LAST, created_at DESC
+            """, (user_id, since))
+            tasks = cur.fetchall()
+            
+            deleted = {'schedule': [], 'tasks': []}
+            if since:
+                cur.execute("""
+                    SELECT entity, entity_id
+                    FROM sync_tombstones
+                    WHERE user_id = %s AND sync_version > %s
+                """, (user_id, since))
+                for tombstone in cur.fetchall():
+                    if tombstone['entity'] in deleted:
+                        deleted[tombstone['entity']].append(tombstone['entity_id'])
+        
+        return {
+            'version': version,
+            'full': not since,
+            'schedule': [dict(l) for l in lessons],
+            'tasks': [dict(t) for t in tasks],
+            'deleted': deleted
+        }
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level=ISOLATION_LEVEL_READ_COMMITTED, readonly=False)
+
+
+def encode_task_cursor(task: dict) -> str:
+    """Кодирует позицию keyset-пагинации задач: (completed, дедлайн или infinity, id)"""
+    deadline = task['deadline'].isoformat() if task.get('deadline') else 'infinity'
+    return base64.urlsafe_b64encode(f"{int(task['completed'])}|{deadline}|{task['id']}".encode()).decode()
+
+
+def decode_task_cursor(cursor: str):
+    """Декодирует позицию keyset-пагинации задач, возвращает (completed, deadline, id) или None"""
+    try:
+        completed, deadline, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        if deadline != 'infinity':
+            deadline = datetime.fromisoformat(deadline)
+        return completed == '1', deadline, int(task_id)
+    except Exception:
+        return None
+
+
+def list_tasks(cur, user_id: int, params: dict) -> tuple:
+    """Страница задач с фильтрами; порядок совпадает с индексом (user_id, completed, deadline, id). Возвращает (результат, ошибка)"""
+    status = params.get('status') or 'open'
+    if status not in TASK_STATUSES:
+        return None, 'status должен быть open, completed или all'
+    
+    try:
+        limit = min(max(int(params.get('limit', TASKS_PAGE_DEFAULT)), 1), TASKS_PAGE_MAX)
+    except ValueError:
+        return None, 'Некорректный limit'
+    
+    conditions = ['user_id = %s']
+    values = [user_id]
+    
+    if status != 'all':
+        conditions.append('completed = %s')
+        values.append(status == 'completed')
+    
+    if params.get('subject'):
+        conditions.append('subject = %s')
+        values.append(params['subject'])
+    
+    if params.get('priority'):
+        priorities = [p for p in params['priority'].split(',') if p in TASK_PRIORITIES]
+        if not priorities:
+            return None, 'Некорректный priority'
+        conditions.append('priority = ANY(%s)')
+        values.append(priorities)
+    
+    for key, operator, shift in (('deadline_from', '>=', 0), ('deadline_to', '<', 1)):
+        if params.get(key):
+            bound = parse_date_value(params[key])
+            if not bound:
+                return None, f'Некорректный {key} (YYYY-MM-DD)'
+            conditions.append(f'deadline {operator} %s')
+            values.append(bound + timedelta(days=shift))
+    
+    if params.get('cursor'):
+        cursor = decode_task_cursor(params['cursor'])
+        if not cursor:
+            return None, 'Некорректный cursor'
+        conditions.append("(completed, COALESCE(deadline, 'infinity'::timestamp), id) > (%s, %s::timestamp, %s)")
+        values.extend(cursor)
+    
+    cur.execute(f"""
+        SELECT id, title, description, subject, deadline, priority, completed, created_at
+        FROM tasks
+        WHERE {' AND '.join(conditions)}
+        ORDER BY completed, COALESCE(deadline, 'infinity'::timestamp), id
+        LIMIT %s
+    """, values + [limit + 1])
+    
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return {
+        'tasks': [dict(t) for t in rows],
+        'next_cursor': encode_task_cursor(rows[-1]) if has_more else None
+    }, None
+
+
+def update_task(conn, user_id: int, body: dict, headers: dict) -> dict:
+    """Частичное обновление задачи: меняются только переданные поля"""
+    fields = {k: body[k] for k in TASK_EDITABLE_FIELDS if k in body}
+    
+    if not body.get('id') or not fields:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Укажите id задачи и хотя бы одно поле'})
+        }
+    if 'title' in fields and not str(fields['title'] or '').strip():
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Название задачи не может быть пустым'})
+        }
+    if 'priority' in fields and fields['priority'] not in TASK_PRIORITIES:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Некорректный priority'})
+        }
+    if fields.get('deadline') not in (None, ''):
+        fields['deadline'] = parse_deadline_value(fields['deadline'])
+        if not fields['deadline']:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Некорректный deadline (YYYY-MM-DD или YYYY-MM-DDTHH:MM)'})
+            }
+    elif 'deadline' in fields:
+        fields['deadline'] = None
+    if 'completed' in fields:
+        fields['completed'] = bool(fields['completed'])
+    
+    assignments = ', '.join(f'{k} = %s' for k in fields)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            UPDATE tasks
+            SET {assignments}, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND user_id = %s
+            RETURNING id, title, description, subject, deadline, priority, completed, created_at
+        """, list(fields.values()) + [body['id'], user_id])
+        task = cur.fetchone()
+        conn.commit()
+    
+    if not task:
+        return {
+            'statusCode': 404,
+            'headers': headers,
+            'body': json.dumps({'error': 'Задача не найдена'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'task': dict(task)}, default=str)
+    }
+
+
+def batch_tasks(conn, user_id: int, body: dict, headers: dict) -> dict:
+    """Массовые действия над задачами одним запросом к БД: complete, reopen, delete, reschedule, clear_completed"""
+    action = body.get('action')
+    ids = body.get('ids') or []
+    
+    if action not in TASK_BATCH_ACTIONS:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': f"action должен быть одним из: {', '.join(TASK_BATCH_ACTIONS)}"})
+        }
+    if action != 'clear_completed':
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Передайте ids — список id задач'})
+            }
+        if len(ids) > TASK_BATCH_MAX_IDS:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': f'Не больше {TASK_BATCH_MAX_IDS} задач за раз'})
+            }
+    
+    deadline = None
+    if action == 'reschedule' and body.get('deadline'):
+        deadline = parse_deadline_value(body['deadline'])
+        if not deadline:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Некорректный deadline (YYYY-MM-DD или YYYY-MM-DDTHH:MM)'})
+            }
+    
+    with conn.cursor() as cur:
+        if action in ('complete', 'reopen'):
+            completed = action == 'complete'
+            cur.execute("""
+                UPDATE tasks SET completed = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND id = ANY(%s) AND completed <> %s
+                RETURNING id
+            """, (completed, user_id, ids, completed))
+        elif action == 'delete':
+            cur.execute("""
+                DELETE FROM tasks
+                WHERE user_id = %s AND id = ANY(%s)
+                RETURNING id
+            """, (user_id, ids))
+        elif action == 'clear_completed':
+            cur.execute("""
+                DELETE FROM tasks
+                WHERE user_id = %s AND completed = TRUE
+                RETURNING id
+            """, (user_id,))
+        elif deadline:
+            cur.execute("""
+                UPDATE tasks SET deadline = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND id = ANY(%s)
+                RETURNING id
+            """, (deadline, user_id, ids))
+        elif isinstance(body.get('shift_days'), int) and not isinstance(body['shift_days'], bool):
+            # Сдвиг сохраняет разницу между дедлайнами; задачи без дедлайна не трогаем
+            cur.execute("""
+                UPDATE tasks SET deadline = deadline + make_interval(days => %s), updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND id = ANY(%s) AND deadline IS NOT NULL
+                RETURNING id
+            """, (body['shift_days'], user_id, ids))
+        else:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Для reschedule укажите deadline или shift_days'})
+            }
+        
+        affected = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'action': action, 'affected': len(affected), 'ids': affected})
+    }
+
+
+def get_occurrences(conn, user_id: int, date_from: date, date_to: date) -> list:
+    """Разворачивает занятия в конкретные даты окна [date_from, date_to] одним запросом по GiST-индексу"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT s.id AS lesson_id, d::date AS date, s.subject, s.type, s.start_time, s.end_time,
+                   s.day_of_week, s.room, s.teacher, s.color, s.week_parity
+            FROM schedule s
+            JOIN generate_series(%(date_from)s::date, %(date_to)s::date, INTERVAL '1 day') AS d
+              ON EXTRACT(ISODOW FROM d)::int = s.day_of_week
+            WHERE s.user_id = %(user_id)s
+              AND s.active_dates && daterange(%(date_from)s::date, %(date_to)s::date, '[]')
+              AND s.active_dates @> d::date
+              AND NOT (d::date = ANY(s.excluded_dates))
+              AND (
+                  s.week_parity IS NULL
+                  OR s.week_parity = CASE
+                      WHEN s.starts_on IS NOT NULL
+                      THEN ((d::date - (s.starts_on - (EXTRACT(ISODOW FROM s.starts_on)::int - 1))) / 7) %% 2 + 1
+                      ELSE 2 - EXTRACT(WEEK FROM d)::int %% 2
+                  END
+              )
+            ORDER BY d, s.start_time
+        """, {'user_id': user_id, 'date_from': date_from, 'date_to': date_to})
+        return [dict(o) for o in cur.fetchall()]
+
+
+def lessons_share_weeks(a: dict, b: dict) -> bool:
+    """Идут ли два занятия одного дня недели хотя бы в одну общую неделю (чётность и границы дат)"""
+    if a.get('week_parity') and b.get('week_parity') and a['week_parity'] != b['week_parity']:
+        return False
+    if a.get('ends_on') and b.get('starts_on') and a['ends_on'] < b['starts_on']:
+        return False
+    if b.get('ends_on') and a.get('starts_on') and b['ends_on'] < a['starts_on']:
+        return False
+    return True
+
+
+def find_schedule_conflicts(lessons: list) -> list:
+    """Пары пересекающихся занятий заметающей прямой: сортировка по началу и куча открытых занятий по окончанию"""
+    ordered = sorted(lessons, key=lambda l: (l['day_of_week'], l['start_time'], l['end_time']))
+    conflicts = []
+    active = []
+    current_day = None
+    
+    for position, lesson in enumerate(ordered):
+        if lesson['day_of_week'] != current_day:
+            current_day = lesson['day_of_week']
+            active = []
+        # Закрываем занятия, закончившиеся до начала текущего
+        while active and active[0][0] <= lesson['start_time']:
+            heapq.heappop(active)
+        for _, _, other in active:
+            if lessons_share_weeks(other, lesson):
+                conflicts.append((other, lesson))
+        heapq.heappush(active, (lesson['end_time'], position, lesson))
+    
+    return conflicts
+
+
+def load_merged_schedule(conn, user_id: int) -> list:
+    """Свои занятия и занятия из расписаний, на которые подписан пользователь"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT s.id, s.subject, s.start_time, s.end_time, s.day_of_week, s.room,
+                   s.week_parity, s.starts_on, s.ends_on, NULL::integer AS shared_schedule_id, NULL AS shared_title
+            FROM schedule s
+            WHERE s.user_id = %(user_id)s
+            UNION ALL
+            SELECT DISTINCT ON (s.id) s.id, s.subject, s.start_time, s.end_time, s.day_of_week, s.room,
+                   s.week_parity, s.starts_on, s.ends_on, ss.id, ss.title
+            FROM schedule_subscribers sub
+            JOIN shared_schedules ss ON ss.id = sub.shared_schedule_id AND ss.is_active = TRUE
+            JOIN schedule s ON s.user_id = ss.owner_user_id
+            WHERE sub.user_id = %(user_id)s AND ss.owner_user_id <> %(user_id)s
+        """, {'user_id': user_id})
+        return [dict(l) for l in cur.fetchall()]
+
+
+def lesson_conflict_response(conn, user_id: int, error: ExclusionViolation, headers: dict) -> dict:
+    """Ответ 409 со списком занятий, с которыми пересеклось новое (id приходят из триггера в DETAIL)"""
+    conn.rollback()
+    conflict_ids = [int(i) for i in (error.diag.message_detail or '').split(',') if i.strip().isdigit()]
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, subject, type, start_time, end_time, day_of_week, room, week_parity, starts_on, ends_on
+            FROM schedule
+            WHERE user_id = %s AND id = ANY(%s)
+            ORDER BY start_time
+        """, (user_id, conflict_ids))
+        conflicts = cur.fetchall()
+    
+    return {
+        'statusCode': 409,
+        'headers': headers,
+        'body': json.dumps({
+            'error': 'lesson_conflict',
+            'message': 'Занятие пересекается с уже добавленными',
+            'conflicts': [dict(c) for c in conflicts]
+        }, default=str)
+    }
+
+
+def update_lesson(conn, user_id: int, body: dict, headers: dict) -> dict:
+    """Изменение занятия: переданные поля накладываются на текущие и проверяются как при импорте"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT subject, type, start_time, end_time, day_of_week, room, teacher, color,
+                   week_parity, starts_on, ends_on
+            FROM schedule
+            WHERE id = %s AND user_id = %s
+        """, (body.get('id'), user_id))
+        current = cur.fetchone()
+    
+    if not current:
+        return {
+            'statusCode': 404,
+            'headers': headers,
+            'body': json.dumps({'error': 'Занятие не найдено'})
+        }
+    
+    merged = dict(current)
+    merged.update({k: v for k, v in body.items() if k in current})
+    values, error = validate_lesson(merged)
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': error})
+        }
+    
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                UPDATE schedule
+                SET subject = %s, type = %s, start_time = %s, end_time = %s, day_of_week = %s, room = %s,
+                    teacher = %s, week_parity = %s, starts_on = %s, ends_on = %s, color = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND user_id = %s
+                RETURNING id, subject, type, start_time, end_time, day_of_week, room, teacher, color,
+                          week_parity, starts_on, ends_on, excluded_dates
+            """, values + (body['id'], user_id))
+            lesson = cur.fetchone()
+            conn.commit()
+    except ExclusionViolation as e:
+        return lesson_conflict_response(conn, user_id, e, headers)
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'lesson': dict(lesson)}, default=str)
+    }
+
+
+def get_dashboard(conn, user_id: int, tz_name: str = None) -> dict:
+    """Данные главного экрана тремя запросами: занятия на сегодня и завтра, ближайшие задачи, лимиты и push-статус"""
+    try:
+        tz = ZoneInfo(tz_name or FEED_TIMEZONE)
+    except Exception:
+        tz = ZoneInfo(FEED_TIMEZONE)
+    now = datetime.now(tz)
+    today = now.date()
+    
+    occurrences = get_occurrences(conn, user_id, today, today + timedelta(days=1))
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Просроченные и ближайшие открытые задачи — префикс индекса (user_id, completed, deadline)
+        cur.execute("""
+            SELECT id, title, description, subject, deadline, priority, completed, created_at
+            FROM tasks
+            WHERE user_id = %s AND completed = FALSE
+              AND COALESCE(deadline, 'infinity'::timestamp) < %s
+            ORDER BY COALESCE(deadline, 'infinity'::timestamp), id
+            LIMIT %s
+        """, (user_id, now.replace(tzinfo=None) + timedelta(days=DASHBOARD_TASKS_DAYS), DASHBOARD_TASKS_LIMIT))
+        tasks = cur.fetchall()
+        
+        cur.execute("""
+            SELECT u.subscription_type, u.subscription_expires_at, u.trial_ends_at, u.is_trial_used,
+                   u.materials_quota_used, u.materials_quota_reset_at, u.ai_questions_used, u.ai_questions_reset_at,
+                   COALESCE(c.lessons_count, 0) AS lessons_count,
+                   COALESCE(c.active_tasks_count, 0) AS active_tasks_count,
+                   EXISTS (
+                       SELECT 1 FROM push_subscriptions p
+                       WHERE p.user_id = u.id AND p.endpoint IS NOT NULL AND p.is_active
+                   ) AS push_subscribed
+            FROM users u
+            LEFT JOIN user_usage_counters c ON c.user_id = u.id
+            WHERE u.id = %s
+        """, (user_id,))
+        user = cur.fetchone() or {}
+    
+    # Лимиты в том же виде и по тем же правилам, что на экране подписки (subscription.get_limits)
+    if user:
+        subscription = get_subscription_limits(user, user['lessons_count'], user['active_tasks_count'])
+    else:
+        subscription = {'is_premium': False, 'subscription_type': 'free', 'is_trial': False}
+    
+    return {
+        'date': today.isoformat(),
+        'today': [o for o in occurrences if o['date'] == today],
+        'tomorrow': [o for o in occurrences if o['date'] != today],
+        'tasks_due': [dict(t) for t in tasks],
+        'subscription': subscription,
+        'notifications': {'subscribed': bool(user.get('push_subscribed'))}
+    }
+
+
+def get_task_stats(conn, user_id: int, tz_name: str = None) -> dict:
+    """Счётчики задач для статистики одним проходом по задачам пользователя: итоги, по предметам и приоритетам"""
+    try:
+        tz = ZoneInfo(tz_name or FEED_TIMEZONE)
+    except Exception:
+        tz = ZoneInfo(FEED_TIMEZONE)
+    now = datetime.now(tz).replace(tzinfo=None)
+    week_start = datetime.combine(now.date() - timedelta(days=now.weekday()), time.min)
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT GROUPING(subject) AS by_subject, GROUPING(priority) AS by_priority, subject, priority,
+                   COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE completed) AS completed,
+                   COUNT(*) FILTER (WHERE NOT completed AND deadline < %s) AS overdue,
+                   COUNT(*) FILTER (WHERE NOT completed AND priority = 'high') AS high_priority,
+                   COUNT(*) FILTER (WHERE deadline >= %s) AS week_total,
+                   COUNT(*) FILTER (WHERE deadline >= %s AND completed) AS week_completed,
+                   COUNT(*) FILTER (WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days') AS created_week
+            FROM tasks
+            WHERE user_id = %s
+            GROUP BY GROUPING SETS ((), (subject), (priority))
+        """, (now, week_start, week_start, user_id))
+        rows = cur.fetchall()
+
+    stats = {
+        'total': 0, 'completed': 0, 'active': 0, 'overdue': 0, 'high_priority': 0,
+        'week_total': 0, 'week_completed': 0, 'created_week': 0,
+        'subjects': [], 'priorities': []
+    }
+    for row in rows:
+        if row['by_subject'] and row['by_priority']:
+            stats.update({key: row[key] for key in (
+                'total', 'completed', 'overdue', 'high_priority', 'week_total', 'week_completed', 'created_week'
+            )})
+            stats['active'] = row['total'] - row['completed']
+        elif not row['by_subject']:
+            if row['subject']:
+                stats['subjects'].append({'subject': row['subject'], 'total': row['total'], 'completed': row['completed']})
+        elif row['priority']:
+            stats['priorities'].append({'priority': row['priority'], 'total': row['total'], 'completed': row['completed']})
+
+    stats['subjects'].sort(key=lambda s: (-s['total'], s['subject']))
+    return stats
+
+
 def handler(event: dict, context) -> dict:
     """Обработчик запросов для расписания и задач"""
     method = event.get('httpMethod', 'GET')
@@ -34,12 +1300,17 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization'
             },
             'body': ''
         }
     
+    # ICS-фид опрашивают календари без заголовка авторизации — доступ по токену в ссылке
+    params = event.get('queryStringParameters') or {}
+    if method == 'GET' and params.get('path') == 'calendar.ics':
+        return serve_calendar_feed(event, params.get('token'))
+    
     headers = {
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': '*'
@@ -73,7 +1344,8 @@ def handler(event: dict, context) -> dict:
         if method == 'GET' and path == 'schedule':
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
-                    SELECT id, subject, type, start_time, end_time, day_of_week, room, teacher, color
+                    SELECT id, subject, type, start_time, end_time, day_of_week, room, teacher, color,
+                           week_parity, starts_on, ends_on, excluded_dates
                     FROM schedule
                     WHERE user_id = %s
                     ORDER BY day_of_week, start_time
@@ -91,32 +1363,19 @@ def handler(event: dict, context) -> dict:
         elif method == 'POST' and path == 'schedule':
             body = json.loads(event.get('body', '{}'))
             
+            recurrence, error = parse_recurrence(body)
+            if error:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': error})
+                }
+            
             # Проверяем лимит для Free пользователей
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT subscription_type, subscription_expires_at, trial_ends_at, is_trial_used
-                    FROM users WHERE id = %s
-                """, (user_id,))
-                user = cur.fetchone()
-                
-                is_premium = False
-                if user and user['subscription_type'] == 'premium':
-                    expires = user.get('subscription_expires_at')
-                    if expires and expires.replace(tzinfo=None) > datetime.now():
-                        is_premium = True
-                
-                # Проверяем триал
-                is_trial = False
-                if not is_premium and user:
-                    trial_ends = user.get('trial_ends_at')
-                    if trial_ends and not user.get('is_trial_used'):
-                        if trial_ends.replace(tzinfo=None) > datetime.now():
-                            is_trial = True
-                
                 # Для Free проверяем лимит в 15 занятий
-                if not is_premium and not is_trial:
-                    cur.execute("SELECT COUNT(*) as count FROM schedule WHERE user_id = %s", (user_id,))
-                    schedule_count = cur.fetchone()['count']
+                if not check_unlimited_access(cur, user_id):
+                    schedule_count = get_usage_counters(cur, user_id)['lessons_count']
                     if schedule_count >= 15:
                         return {
                             'statusCode': 403,
@@ -124,31 +1383,160 @@ def handler(event: dict, context) -> dict:
                             'body': json.dumps({'error': 'quota_exceeded', 'message': '📚 Достигнут лимит занятий (15/15). Перейдите на Premium для безлимитного расписания'})
                         }
             
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        INSERT INTO schedule (user_id, subject, type, start_time, end_time, day_of_week, room, teacher, color,
+                                              week_parity, starts_on, ends_on)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id, subject, type, start_time, end_time, day_of_week, room, teacher, color,
+                                  week_parity, starts_on, ends_on, excluded_dates
+                    """, (
+                        user_id,
+                        body.get('subject'),
+                        body.get('type'),
+                        body.get('start_time'),
+                        body.get('end_time'),
+                        body.get('day_of_week'),
+                        body.get('room'),
+                        body.get('teacher'),
+                        body.get('color', 'bg-purple-500'),
+                        *recurrence
+                    ))
+                    
+                    lesson = cur.fetchone()
+                    conn.commit()
+            except ExclusionViolation as e:
+                return lesson_conflict_response(conn, user_id, e, headers)
+            
+            return {
+                'statusCode': 201,
+                'headers': headers,
+                'body': json.dumps({'lesson': dict(lesson)}, default=str)
+            }
+        
+        # PUT /schedule - Изменить занятие
+        elif method == 'PUT' and path == 'schedule':
+            body = json.loads(event.get('body', '{}'))
+            return update_lesson(conn, user_id, body, headers)
+        
+        # GET /conflicts - Пересечения своих занятий и занятий из подписок
+        elif method == 'GET' and path == 'conflicts':
+            conflicts = find_schedule_conflicts(load_merged_schedule(conn, user_id))
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({
+                    'conflicts': [{'first': a, 'second': b} for a, b in conflicts],
+                    'count': len(conflicts)
+                }, default=str)
+            }
+        
+        # POST /schedule_import - Импорт расписания списком или файлом ICS/XLSX
+        elif method == 'POST' and path == 'schedule_import':
+            body = json.loads(event.get('body', '{}'))
+            return import_lessons(conn, user_id, body, headers)
+        
+        # GET /occurrences - Занятия по датам в окне from..to с учётом чётности недель и исключений
+        elif method == 'GET' and path == 'occurrences':
+            params = event.get('queryStringParameters', {})
+            date_from = parse_date_value(params.get('from'))
+            date_to = parse_date_value(params.get('to'))
+            
+            if not date_from or not date_to or date_to < date_from:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Укажите from и to в формате YYYY-MM-DD'})
+                }
+            if (date_to - date_from).days > OCCURRENCES_MAX_DAYS:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': f'Окно не больше {OCCURRENCES_MAX_DAYS} дней'})
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'occurrences': get_occurrences(conn, user_id, date_from, date_to)}, default=str)
+            }
+        
+        # POST /schedule_exception - Отменить (или вернуть) занятие в конкретную дату
+        elif method == 'POST' and path == 'schedule_exception':
+            body = json.loads(event.get('body', '{}'))
+            excluded = parse_date_value(body.get('date'))
+            
+            if not body.get('id') or not excluded:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Укажите id занятия и date'})
+                }
+            
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    INSERT INTO schedule (user_id, subject, type, start_time, end_time, day_of_week, room, teacher, color)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id, subject, type, start_time, end_time, day_of_week, room, teacher, color
-                """, (
-                    user_id,
-                    body.get('subject'),
-                    body.get('type'),
-                    body.get('start_time'),
-                    body.get('end_time'),
-                    body.get('day_of_week'),
-                    body.get('room'),
-                    body.get('teacher'),
-                    body.get('color', 'bg-purple-500')
-                ))
+                if body.get('restore'):
+                    cur.execute("""
+                        UPDATE schedule SET excluded_dates = array_remove(excluded_dates, %s)
+                        WHERE id = %s AND user_id = %s
+                        RETURNING id, excluded_dates
+                    """, (excluded, body['id'], user_id))
+                else:
+                    cur.execute("""
+                        UPDATE schedule SET excluded_dates = array_append(array_remove(excluded_dates, %s), %s)
+                        WHERE id = %s AND user_id = %s
+                        RETURNING id, excluded_dates
+                    """, (excluded, excluded, body['id'], user_id))
                 
                 lesson = cur.fetchone()
                 conn.commit()
-                
+            
+            if not lesson:
                 return {
-                    'statusCode': 201,
+                    'statusCode': 404,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Занятие не найдено'})
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'lesson': dict(lesson)}, default=str)
+            }
+        
+        # GET /dashboard - Всё для главного экрана одним запросом
+        elif method == 'GET' and path == 'dashboard':
+            params = event.get('queryStringParameters', {})
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(get_dashboard(conn, user_id, params.get('tz')), default=str)
+            }
+        
+        # GET /sync - Изменения расписания и задач после версии клиента
+        elif method == 'GET' and path == 'sync':
+            since = event.get('queryStringParameters', {}).get('since') or '0'
+            if not since.isdigit():
+                return {
+                    'statusCode': 400,
                     'headers': headers,
-                    'body': json.dumps({'lesson': dict(lesson)}, default=str)
+                    'body': json.dumps({'error': 'since должен быть числом'})
                 }
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(get_sync_delta(conn, user_id, int(since)), default=str)
+            }
+        
+        # GET /calendar_feed - Получить ссылку на ICS-фид, POST - перевыпустить её
+        elif method in ('GET', 'POST') and path == 'calendar_feed':
+            feed_token = get_or_create_feed_token(conn, user_id, rotate=(method == 'POST'))
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps({'token': feed_token, 'query': f'?path=calendar.ics&token={feed_token}'})
+            }
         
         # DELETE /schedule - Удалить занятие
         elif method == 'DELETE' and path == 'schedule':
@@ -170,52 +1558,50 @@ def handler(event: dict, context) -> dict:
         
         # GET /tasks - Получить задачи
         elif method == 'GET' and path == 'tasks':
+            params = event.get('queryStringParameters', {})
+            
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, title, description, subject, deadline, priority, completed, created_at
-                    FROM tasks
-                    WHERE user_id = %s
-                    ORDER BY completed ASC, deadline ASC NULLS LAST, created_at DESC
-                """, (user_id,))
-                
-                tasks = cur.fetchall()
-                
+                result, error = list_tasks(cur, user_id, params)
+            
+            if error:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': headers,
-                    'body': json.dumps({'tasks': [dict(t) for t in tasks]}, default=str)
+                    'body': json.dumps({'error': error})
                 }
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(result, default=str)
+            }
         
+        # GET /tasks_stats - Счётчики задач для статистики без выгрузки списка
+        elif method == 'GET' and path == 'tasks_stats':
+            params = event.get('queryStringParameters', {})
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(get_task_stats(conn, user_id, params.get('tz')), default=str)
+            }
+
         # POST /tasks - Создать задачу
         elif method == 'POST' and path == 'tasks':
             body = json.loads(event.get('body', '{}'))
             
+            deadline = parse_deadline_value(body['deadline']) if body.get('deadline') else None
+            if body.get('deadline') and not deadline:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Некорректный deadline (YYYY-MM-DD или YYYY-MM-DDTHH:MM)'})
+                }
+            
             # Проверяем лимит для Free пользователей
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT subscription_type, subscription_expires_at, trial_ends_at, is_trial_used
-                    FROM users WHERE id = %s
-                """, (user_id,))
-                user = cur.fetchone()
-                
-                is_premium = False
-                if user and user['subscription_type'] == 'premium':
-                    expires = user.get('subscription_expires_at')
-                    if expires and expires.replace(tzinfo=None) > datetime.now():
-                        is_premium = True
-                
-                # Проверяем триал
-                is_trial = False
-                if not is_premium and user:
-                    trial_ends = user.get('trial_ends_at')
-                    if trial_ends and not user.get('is_trial_used'):
-                        if trial_ends.replace(tzinfo=None) > datetime.now():
-                            is_trial = True
-                
                 # Для Free проверяем лимит в 20 активных задач
-                if not is_premium and not is_trial:
-                    cur.execute("SELECT COUNT(*) as count FROM tasks WHERE user_id = %s AND completed = false", (user_id,))
-                    tasks_count = cur.fetchone()['count']
+                if not check_unlimited_access(cur, user_id):
+                    tasks_count = get_usage_counters(cur, user_id)['active_tasks_count']
                     if tasks_count >= 20:
                         return {
                             'statusCode': 403,
@@ -233,7 +1619,7 @@ def handler(event: dict, context) -> dict:
                     body.get('title'),
                     body.get('description'),
                     body.get('subject'),
-                    body.get('deadline'),
+                    deadline,
                     body.get('priority', 'medium')
                 ))
                 
@@ -246,37 +1632,15 @@ def handler(event: dict, context) -> dict:
                     'body': json.dumps({'task': dict(task)}, default=str)
                 }
         
-        # PUT /tasks - Обновить задачу
-        elif method == 'PUT' and path == 'tasks':
+        # PUT/PATCH /tasks - Обновить переданные поля задачи
+        elif method in ('PUT', 'PATCH') and path == 'tasks':
             body = json.loads(event.get('body', '{}'))
-            task_id = body.get('id')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    UPDATE tasks
-                    SET title = %s, description = %s, subject = %s, deadline = %s, 
-                        priority = %s, completed = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s AND user_id = %s
-                    RETURNING id, title, description, subject, deadline, priority, completed, created_at
-                """, (
-                    body.get('title'),
-                    body.get('description'),
-                    body.get('subject'),
-                    body.get('deadline'),
-                    body.get('priority'),
-                    body.get('completed'),
-                    task_id,
-                    user_id
-                ))
-                
-                task = cur.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({'task': dict(task)}, default=str)
-                }
+            return update_task(conn, user_id, body, headers)
+        
+        # POST /tasks_batch - Массовые действия над задачами
+        elif method == 'POST' and path == 'tasks_batch':
+            body = json.loads(event.get('body', '{}'))
+            return batch_tasks(conn, user_id, body, headers)
         
         # DELETE /tasks - Удалить задачу
         elif method == 'DELETE' and path == 'tasks':
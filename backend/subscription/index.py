@@ -107,12 +107,16 @@ def get_limits(conn, user_id: int) -> dict:
     """Получает текущие лимиты пользователя"""
     status = check_subscription_status(user_id, conn)
     
+    # Счётчики поддерживаются триггерами (V0024), COUNT(*) по таблицам не нужен
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT COUNT(*) as count FROM schedule WHERE user_id = %s", (user_id,))
-        schedule_count = cur.fetchone()['count']
-        
-        cur.execute("SELECT COUNT(*) as count FROM tasks WHERE user_id = %s AND completed = false", (user_id,))
-        tasks_count = cur.fetchone()['count']
+        cur.execute("""
+            SELECT lessons_count, active_tasks_count
+            FROM user_usage_counters WHERE user_id = %s
+        """, (user_id,))
+        counters = cur.fetchone()
+    
+    schedule_count = counters['lessons_count'] if counters else 0
+    tasks_count = counters['active_tasks_count'] if counters else 0
     
     if status['is_premium']:
         return {
@@ -202,7 +206,20 @@ def handler(event: dict, context) -> dict:
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
             
-            if action == 'upgrade_demo':
+            if action == 'repair_counters':
+                # Пересчёт счётчиков из исходных таблиц (на случай расхождения)
+                with conn.cursor() as cur:
+                    cur.execute("SELECT rebuild_user_usage_counters(%s)", (user_id,))
+                    conn.commit()
+                
+                limits = get_limits(conn, user_id)
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps(limits, default=str)
+                }
+            
+            elif action == 'upgrade_demo':
                 with conn.cursor() as cur:
                     cur.execute("""
                         UPDATE users 
@@ -0,0 +1,9 @@
+-- Кэш прогнозов: отпечаток материалов, прошлых билетов и версии промпта
+ALTER TABLE exam_predictions
+ADD COLUMN IF NOT EXISTS cache_key VARCHAR(64),
+ADD COLUMN IF NOT EXISTS prompt_version VARCHAR(20);
+
+CREATE INDEX IF NOT EXISTS idx_exam_predictions_cache_key ON exam_predictions(user_id, cache_key, created_at DESC);
+
+COMMENT ON COLUMN exam_predictions.cache_key IS 'SHA-256 от отсортированных material_ids, хэшей их содержимого, хэша past_exams и версии промпта';
+COMMENT ON COLUMN exam_predictions.prompt_version IS 'Версия промпта, которым сгенерирован прогноз';
@@ -0,0 +1,17 @@
+-- Лёгкий список прогнозов: количество вопросов хранится отдельно от JSON
+ALTER TABLE exam_predictions
+ADD COLUMN IF NOT EXISTS questions_count INTEGER;
+
+-- Все старые строки получают число: вопросы в поле questions, в массиве верхнего уровня или 0
+UPDATE exam_predictions
+SET questions_count = CASE
+    WHEN jsonb_typeof(predicted_questions->'questions') = 'array' THEN jsonb_array_length(predicted_questions->'questions')
+    WHEN jsonb_typeof(predicted_questions) = 'array' THEN jsonb_array_length(predicted_questions)
+    ELSE 0
+END
+WHERE questions_count IS NULL;
+
+-- Keyset-пагинация: (created_at, id) по убыванию в рамках пользователя
+CREATE INDEX IF NOT EXISTS idx_exam_predictions_user_keyset ON exam_predictions(user_id, created_at DESC, id DESC);
+
+COMMENT ON COLUMN exam_predictions.questions_count IS 'Количество вопросов в прогнозе (для списка без загрузки JSON)';
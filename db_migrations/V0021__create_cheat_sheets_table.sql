@@ -0,0 +1,20 @@
+-- Сохранённые шпаргалки: повторный запрос отдаётся из БД без обращения к LLM
+CREATE TABLE IF NOT EXISTS cheat_sheets (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    material_id INTEGER NOT NULL REFERENCES materials(id) ON DELETE CASCADE,
+    content_hash VARCHAR(64) NOT NULL,
+    prompt_version VARCHAR(20) NOT NULL,
+    title VARCHAR(500),
+    subject VARCHAR(200),
+    cheat_sheet TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(material_id, content_hash, prompt_version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_cheat_sheets_user_created ON cheat_sheets(user_id, created_at DESC);
+
+COMMENT ON TABLE cheat_sheets IS 'Сгенерированные шпаргалки по материалам';
+COMMENT ON COLUMN cheat_sheets.content_hash IS 'MD5 содержимого материала (текст + чанки) на момент генерации';
+COMMENT ON COLUMN cheat_sheets.prompt_version IS 'Версия промпта генерации';
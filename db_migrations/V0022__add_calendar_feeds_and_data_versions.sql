@@ -0,0 +1,53 @@
+-- Версия данных пользователя: растёт при любом изменении расписания или задач
+CREATE TABLE IF NOT EXISTS user_data_versions (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_user_data_version() RETURNS TRIGGER AS $$
+DECLARE
+    target_user_id INTEGER;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        target_user_id := OLD.user_id;
+    ELSE
+        target_user_id := NEW.user_id;
+    END IF;
+
+    INSERT INTO user_data_versions (user_id, version, updated_at)
+    VALUES (target_user_id, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE
+    SET version = user_data_versions.version + 1,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_bump_version ON schedule;
+CREATE TRIGGER trg_schedule_bump_version
+AFTER INSERT OR UPDATE OR DELETE ON schedule
+FOR EACH ROW EXECUTE FUNCTION bump_user_data_version();
+
+DROP TRIGGER IF EXISTS trg_tasks_bump_version ON tasks;
+CREATE TRIGGER trg_tasks_bump_version
+AFTER INSERT OR UPDATE OR DELETE ON tasks
+FOR EACH ROW EXECUTE FUNCTION bump_user_data_version();
+
+-- ICS-фид: секретный токен и закэшированный результат рендера
+CREATE TABLE IF NOT EXISTS calendar_feeds (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    feed_token VARCHAR(64) UNIQUE NOT NULL,
+    cached_version BIGINT,
+    cached_format SMALLINT,
+    cached_body TEXT,
+    cached_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE user_data_versions IS 'Монотонная версия данных пользователя (schedule + tasks), обновляется триггерами';
+COMMENT ON TABLE calendar_feeds IS 'Токены ICS-фидов и кэш отрендеренного календаря';
+COMMENT ON COLUMN calendar_feeds.cached_version IS 'Версия данных, для которой отрендерен cached_body';
+COMMENT ON COLUMN calendar_feeds.cached_format IS 'FEED_FORMAT_VERSION рендера: после смены формата кэш не используется';
+COMMENT ON COLUMN user_data_versions.updated_at IS 'Время последнего изменения, отдаётся в Last-Modified фида';
@@ -0,0 +1,90 @@
+-- Инкрементальная синхронизация: версия изменения на каждой строке и надгробия для удалений
+ALTER TABLE schedule
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+ADD COLUMN IF NOT EXISTS sync_version BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE tasks
+ADD COLUMN IF NOT EXISTS sync_version BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS sync_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    entity VARCHAR(20) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    sync_version BIGINT NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_user_sync_version ON schedule(user_id, sync_version);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_sync_version ON tasks(user_id, sync_version);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_user_version ON sync_tombstones(user_id, sync_version);
+
+-- Вместо простого счётчика из V0022: строка получает новую версию пользователя.
+-- Блокировка строки user_data_versions упорядочивает коммиты одного пользователя по версиям.
+DROP TRIGGER IF EXISTS trg_schedule_bump_version ON schedule;
+DROP TRIGGER IF EXISTS trg_tasks_bump_version ON tasks;
+DROP FUNCTION IF EXISTS bump_user_data_version();
+
+CREATE OR REPLACE FUNCTION next_user_data_version(target_user_id INTEGER) RETURNS BIGINT AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    INSERT INTO user_data_versions (user_id, version, updated_at)
+    VALUES (target_user_id, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE
+    SET version = user_data_versions.version + 1,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING version INTO new_version;
+
+    RETURN new_version;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stamp_sync_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.sync_version := next_user_data_version(NEW.user_id);
+    NEW.updated_at := CURRENT_TIMESTAMP;
+
+    -- Перенос строки к другому пользователю — удаление для прежнего владельца
+    IF TG_OP = 'UPDATE' AND OLD.user_id <> NEW.user_id THEN
+        INSERT INTO sync_tombstones (user_id, entity, entity_id, sync_version)
+        VALUES (OLD.user_id, TG_TABLE_NAME, OLD.id, next_user_data_version(OLD.user_id));
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_sync_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO sync_tombstones (user_id, entity, entity_id, sync_version)
+    VALUES (OLD.user_id, TG_TABLE_NAME, OLD.id, next_user_data_version(OLD.user_id));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Существующие строки получают версию, иначе полный снимок (sync_version > 0) их не вернёт.
+-- Триггеры ещё не созданы, поэтому updated_at не трогаем.
+UPDATE schedule SET sync_version = next_user_data_version(user_id) WHERE sync_version = 0;
+UPDATE tasks SET sync_version = next_user_data_version(user_id) WHERE sync_version = 0;
+
+CREATE TRIGGER trg_schedule_sync_version
+BEFORE INSERT OR UPDATE ON schedule
+FOR EACH ROW EXECUTE FUNCTION stamp_sync_version();
+
+CREATE TRIGGER trg_schedule_sync_tombstone
+AFTER DELETE ON schedule
+FOR EACH ROW EXECUTE FUNCTION record_sync_tombstone();
+
+CREATE TRIGGER trg_tasks_sync_version
+BEFORE INSERT OR UPDATE ON tasks
+FOR EACH ROW EXECUTE FUNCTION stamp_sync_version();
+
+CREATE TRIGGER trg_tasks_sync_tombstone
+AFTER DELETE ON tasks
+FOR EACH ROW EXECUTE FUNCTION record_sync_tombstone();
+
+COMMENT ON COLUMN schedule.sync_version IS 'Версия данных пользователя, в которой строка изменилась последний раз';
+COMMENT ON COLUMN tasks.sync_version IS 'Версия данных пользователя, в которой строка изменилась последний раз';
+COMMENT ON TABLE sync_tombstones IS 'Удалённые строки schedule/tasks для дельта-синхронизации';
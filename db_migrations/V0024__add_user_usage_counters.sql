@@ -0,0 +1,120 @@
+-- Денормализованные счётчики для проверки лимитов Free за O(1) вместо COUNT(*)
+CREATE TABLE IF NOT EXISTS user_usage_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    lessons_count INTEGER NOT NULL DEFAULT 0,
+    active_tasks_count INTEGER NOT NULL DEFAULT 0,
+    materials_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION adjust_usage_counters(target_user_id INTEGER, lessons_delta INTEGER, tasks_delta INTEGER, materials_delta INTEGER) RETURNS VOID AS $$
+BEGIN
+    IF lessons_delta = 0 AND tasks_delta = 0 AND materials_delta = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO user_usage_counters (user_id, lessons_count, active_tasks_count, materials_count)
+    VALUES (target_user_id, GREATEST(lessons_delta, 0), GREATEST(tasks_delta, 0), GREATEST(materials_delta, 0))
+    ON CONFLICT (user_id) DO UPDATE
+    SET lessons_count = GREATEST(user_usage_counters.lessons_count + lessons_delta, 0),
+        active_tasks_count = GREATEST(user_usage_counters.active_tasks_count + tasks_delta, 0),
+        materials_count = GREATEST(user_usage_counters.materials_count + materials_delta, 0),
+        updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_usage_counters() RETURNS TRIGGER AS $$
+DECLARE
+    old_active INTEGER := 0;
+    new_active INTEGER := 0;
+BEGIN
+    IF TG_TABLE_NAME = 'tasks' THEN
+        IF TG_OP <> 'INSERT' AND NOT COALESCE(OLD.completed, FALSE) THEN
+            old_active := 1;
+        END IF;
+        IF TG_OP <> 'DELETE' AND NOT COALESCE(NEW.completed, FALSE) THEN
+            new_active := 1;
+        END IF;
+    ELSE
+        IF TG_OP <> 'INSERT' THEN
+            old_active := 1;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            new_active := 1;
+        END IF;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id THEN
+        PERFORM adjust_usage_counters(
+            NEW.user_id,
+            CASE WHEN TG_TABLE_NAME = 'schedule' THEN new_active - old_active ELSE 0 END,
+            CASE WHEN TG_TABLE_NAME = 'tasks' THEN new_active - old_active ELSE 0 END,
+            CASE WHEN TG_TABLE_NAME = 'materials' THEN new_active - old_active ELSE 0 END
+        );
+        RETURN NULL;
+    END IF;
+
+    IF old_active = 1 THEN
+        PERFORM adjust_usage_counters(
+            OLD.user_id,
+            CASE WHEN TG_TABLE_NAME = 'schedule' THEN -1 ELSE 0 END,
+            CASE WHEN TG_TABLE_NAME = 'tasks' THEN -1 ELSE 0 END,
+            CASE WHEN TG_TABLE_NAME = 'materials' THEN -1 ELSE 0 END
+        );
+    END IF;
+
+    IF new_active = 1 THEN
+        PERFORM adjust_usage_counters(
+            NEW.user_id,
+            CASE WHEN TG_TABLE_NAME = 'schedule' THEN 1 ELSE 0 END,
+            CASE WHEN TG_TABLE_NAME = 'tasks' THEN 1 ELSE 0 END,
+            CASE WHEN TG_TABLE_NAME = 'materials' THEN 1 ELSE 0 END
+        );
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_usage_counters ON schedule;
+CREATE TRIGGER trg_schedule_usage_counters
+AFTER INSERT OR DELETE OR UPDATE OF user_id ON schedule
+FOR EACH ROW EXECUTE FUNCTION track_usage_counters();
+
+DROP TRIGGER IF EXISTS trg_tasks_usage_counters ON tasks;
+CREATE TRIGGER trg_tasks_usage_counters
+AFTER INSERT OR DELETE OR UPDATE OF user_id, completed ON tasks
+FOR EACH ROW EXECUTE FUNCTION track_usage_counters();
+
+DROP TRIGGER IF EXISTS trg_materials_usage_counters ON materials;
+CREATE TRIGGER trg_materials_usage_counters
+AFTER INSERT OR DELETE OR UPDATE OF user_id ON materials
+FOR EACH ROW EXECUTE FUNCTION track_usage_counters();
+
+-- Восстановление счётчиков из исходных таблиц: для одного пользователя или для всех (NULL)
+CREATE OR REPLACE FUNCTION rebuild_user_usage_counters(target_user_id INTEGER DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    affected INTEGER;
+BEGIN
+    INSERT INTO user_usage_counters (user_id, lessons_count, active_tasks_count, materials_count, updated_at)
+    SELECT u.id,
+           (SELECT COUNT(*) FROM schedule s WHERE s.user_id = u.id),
+           (SELECT COUNT(*) FROM tasks t WHERE t.user_id = u.id AND NOT COALESCE(t.completed, FALSE)),
+           (SELECT COUNT(*) FROM materials m WHERE m.user_id = u.id),
+           CURRENT_TIMESTAMP
+    FROM users u
+    WHERE target_user_id IS NULL OR u.id = target_user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET lessons_count = EXCLUDED.lessons_count,
+        active_tasks_count = EXCLUDED.active_tasks_count,
+        materials_count = EXCLUDED.materials_count,
+        updated_at = EXCLUDED.updated_at;
+
+    GET DIAGNOSTICS affected = ROW_COUNT;
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_user_usage_counters(NULL);
+
+COMMENT ON TABLE user_usage_counters IS 'Счётчики занятий, активных задач и материалов; поддерживаются триггерами, чинятся rebuild_user_usage_counters()';
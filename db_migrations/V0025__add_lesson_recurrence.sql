@@ -0,0 +1,24 @@
+-- Правила повторения занятий: числитель/знаменатель, границы семестра, исключённые даты
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE schedule
+ADD COLUMN IF NOT EXISTS week_parity SMALLINT,
+ADD COLUMN IF NOT EXISTS starts_on DATE,
+ADD COLUMN IF NOT EXISTS ends_on DATE,
+ADD COLUMN IF NOT EXISTS excluded_dates DATE[] NOT NULL DEFAULT '{}';
+
+ALTER TABLE schedule
+ADD CONSTRAINT chk_schedule_week_parity CHECK (week_parity IS NULL OR week_parity IN (1, 2)),
+ADD CONSTRAINT chk_schedule_date_range CHECK (starts_on IS NULL OR ends_on IS NULL OR starts_on <= ends_on);
+
+-- NULL-границы дают бесконечный диапазон, поэтому занятия без дат попадают в любое окно
+ALTER TABLE schedule
+ADD COLUMN IF NOT EXISTS active_dates DATERANGE GENERATED ALWAYS AS (daterange(starts_on, ends_on, '[]')) STORED;
+
+-- «Что идёт между датами X и Y» — один проход по GiST-индексу
+CREATE INDEX IF NOT EXISTS idx_schedule_user_active_dates ON schedule USING GIST (user_id, active_dates);
+
+COMMENT ON COLUMN schedule.week_parity IS 'NULL — каждую неделю, 1 — числитель (нечётные недели), 2 — знаменатель (чётные)';
+COMMENT ON COLUMN schedule.starts_on IS 'Первый день действия занятия; от его недели считается чётность (иначе — по ISO-неделе)';
+COMMENT ON COLUMN schedule.ends_on IS 'Последний день действия занятия';
+COMMENT ON COLUMN schedule.excluded_dates IS 'Даты, в которые занятие отменено';
@@ -0,0 +1,49 @@
+-- Пересечения занятий: диапазон времени урока, GiST-индекс и проверка при вставке/изменении
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'timerange') THEN
+        CREATE TYPE timerange AS RANGE (subtype = time);
+    END IF;
+END;
+$$;
+
+-- GREATEST защищает старые строки с перепутанным временем: для них диапазон просто пустой
+ALTER TABLE schedule
+ADD COLUMN IF NOT EXISTS lesson_time timerange GENERATED ALWAYS AS (timerange(start_time, GREATEST(end_time, start_time), '[)')) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_schedule_user_day_lesson_time ON schedule USING GIST (user_id, day_of_week, lesson_time);
+
+-- Жёсткое ограничение вместо EXCLUDE: уже сохранённые пересечения не мешают миграции,
+-- а чётность недель и границы семестра учитываются как в выдаче по датам.
+-- В BEFORE-триггере генерируемые колонки ещё не посчитаны, поэтому диапазоны строятся из NEW
+CREATE OR REPLACE FUNCTION check_lesson_overlap() RETURNS TRIGGER AS $$
+DECLARE
+    conflict_ids INTEGER[];
+BEGIN
+    -- Сериализуем проверку в пределах пользователя, иначе две параллельные вставки пропустят друг друга
+    PERFORM pg_advisory_xact_lock(hashtext('schedule_overlap'), NEW.user_id);
+
+    SELECT array_agg(s.id ORDER BY s.start_time) INTO conflict_ids
+    FROM schedule s
+    WHERE s.user_id = NEW.user_id
+      AND s.day_of_week = NEW.day_of_week
+      AND s.id <> NEW.id
+      AND s.lesson_time && timerange(NEW.start_time, GREATEST(NEW.end_time, NEW.start_time), '[)')
+      AND s.active_dates && daterange(NEW.starts_on, NEW.ends_on, '[]')
+      AND (s.week_parity IS NULL OR NEW.week_parity IS NULL OR s.week_parity = NEW.week_parity);
+
+    IF conflict_ids IS NOT NULL THEN
+        RAISE EXCEPTION 'Занятие пересекается с другими занятиями'
+            USING ERRCODE = 'exclusion_violation', DETAIL = array_to_string(conflict_ids, ',');
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_check_overlap ON schedule;
+CREATE TRIGGER trg_schedule_check_overlap
+BEFORE INSERT OR UPDATE OF user_id, day_of_week, start_time, end_time, week_parity, starts_on, ends_on ON schedule
+FOR EACH ROW EXECUTE FUNCTION check_lesson_overlap();
+
+COMMENT ON COLUMN schedule.lesson_time IS 'Время занятия как диапазон [start_time, end_time) для поиска пересечений';
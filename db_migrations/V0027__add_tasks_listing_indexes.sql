@@ -0,0 +1,13 @@
+-- Списки задач с фильтрами и keyset-пагинацией: порядок (completed, deadline NULLS LAST, id) читается из одного индекса
+UPDATE tasks SET completed = FALSE WHERE completed IS NULL;
+
+ALTER TABLE tasks
+ALTER COLUMN completed SET NOT NULL;
+
+-- COALESCE с 'infinity' ставит задачи без дедлайна в конец и позволяет сравнивать позицию курсора кортежем
+CREATE INDEX IF NOT EXISTS idx_tasks_user_completed_deadline
+ON tasks(user_id, completed, (COALESCE(deadline, 'infinity'::timestamp)), id);
+
+-- Одиночные индексы покрываются составным (user_id) или бесполезны из-за низкой селективности (completed)
+DROP INDEX IF EXISTS idx_tasks_user_id;
+DROP INDEX IF EXISTS idx_tasks_completed;
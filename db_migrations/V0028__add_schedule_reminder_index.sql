@@ -0,0 +1,2 @@
+-- Напоминания о парах выбираются одним запросом по окну времени за день недели, а не по каждому пользователю
+CREATE INDEX IF NOT EXISTS idx_schedule_day_start_time ON schedule(day_of_week, start_time) INCLUDE (user_id);
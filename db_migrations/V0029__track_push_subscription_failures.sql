@@ -0,0 +1,13 @@
+-- Обратная связь от push-сервисов: отозванные (404/410) подписки удаляются,
+-- временные ошибки push-сервиса считаются и после долгой серии отключают подписку
+ALTER TABLE push_subscriptions
+ADD COLUMN IF NOT EXISTS failure_count INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS last_failure_at TIMESTAMP,
+ADD COLUMN IF NOT EXISTS failing_since TIMESTAMP,
+ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;
+
+-- Отписка раньше пыталась обнулить endpoint; такие строки больше не нужны
+DELETE FROM push_subscriptions WHERE endpoint IS NULL;
+
+COMMENT ON COLUMN push_subscriptions.failing_since IS 'Начало текущей серии временных ошибок push-сервиса (429/5xx)';
+COMMENT ON COLUMN push_subscriptions.is_active IS 'FALSE — рассылка отключена после долгой серии ошибок; повторная подписка включает снова';
@@ -0,0 +1,15 @@
+-- Журнал отправленных напоминаний: ключ идемпотентности (пользователь, вид, объект, дата события)
+CREATE TABLE IF NOT EXISTS notification_log (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind VARCHAR(30) NOT NULL,
+    object_id INTEGER NOT NULL,
+    occurrence_date DATE NOT NULL,
+    sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Уникальный индекс и для ON CONFLICT DO NOTHING, и для анти-джойна в выборке напоминаний
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_log_key
+ON notification_log(user_id, kind, object_id, occurrence_date);
+
+COMMENT ON COLUMN notification_log.kind IS 'lesson — напоминание о паре, deadline — о дедлайне задачи';
@@ -0,0 +1,135 @@
+-- Очередь напоминаний: время срабатывания считается заранее в часовом поясе пользователя,
+-- крон лишь забирает созревшие строки по индексу fire_at
+ALTER TABLE notification_settings
+ADD COLUMN IF NOT EXISTS timezone VARCHAR(64) NOT NULL DEFAULT 'Europe/Moscow';
+
+CREATE TABLE IF NOT EXISTS reminder_queue (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind VARCHAR(30) NOT NULL,
+    object_id INTEGER NOT NULL,
+    occurrence_date DATE NOT NULL,
+    fire_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Тот же ключ, что у notification_log: одно напоминание на событие
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reminder_queue_key ON reminder_queue(user_id, kind, object_id, occurrence_date);
+CREATE INDEX IF NOT EXISTS idx_reminder_queue_fire_at ON reminder_queue(fire_at);
+CREATE INDEX IF NOT EXISTS idx_reminder_queue_object ON reminder_queue(kind, object_id);
+
+-- Идёт ли занятие в дату d: границы семестра, отменённые даты и чётность недели (как в GET occurrences)
+CREATE OR REPLACE FUNCTION lesson_occurs_on(week_parity SMALLINT, starts_on DATE, active_dates DATERANGE, excluded_dates DATE[], d DATE) RETURNS BOOLEAN AS $$
+    SELECT active_dates @> d
+       AND NOT (d = ANY(excluded_dates))
+       AND (week_parity IS NULL OR week_parity = CASE
+           WHEN starts_on IS NOT NULL
+           THEN ((d - (starts_on - (EXTRACT(ISODOW FROM starts_on)::int - 1))) / 7) % 2 + 1
+           ELSE 2 - EXTRACT(WEEK FROM d)::int % 2
+       END);
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Напоминания о парах на horizon_days вперёд (за 60 минут до начала).
+-- NULL в target_* — все занятия пользователя / все пользователи (еженедельная докрутка)
+CREATE OR REPLACE FUNCTION enqueue_lesson_reminders(target_lesson_id INTEGER, target_user_id INTEGER, horizon_days INTEGER DEFAULT 14) RETURNS INTEGER AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    INSERT INTO reminder_queue (user_id, kind, object_id, occurrence_date, fire_at)
+    SELECT s.user_id, 'lesson', s.id, d::date,
+           ((d::date + s.start_time) AT TIME ZONE ns.timezone) - INTERVAL '60 minutes'
+    FROM schedule s
+    JOIN notification_settings ns ON ns.user_id = s.user_id AND ns.lessons_reminder = TRUE
+    -- День назад от CURRENT_DATE сервера: у пользователей восточнее UTC «сегодня» уже наступило
+    JOIN generate_series(CURRENT_DATE - 1, CURRENT_DATE + horizon_days, INTERVAL '1 day') AS d
+      ON EXTRACT(ISODOW FROM d)::int = s.day_of_week
+    WHERE (target_lesson_id IS NULL OR s.id = target_lesson_id)
+      AND (target_user_id IS NULL OR s.user_id = target_user_id)
+      AND lesson_occurs_on(s.week_parity, s.starts_on, s.active_dates, s.excluded_dates, d::date)
+      AND ((d::date + s.start_time) AT TIME ZONE ns.timezone) > now()
+      AND EXISTS (SELECT 1 FROM push_subscriptions ps WHERE ps.user_id = s.user_id)
+    ON CONFLICT (user_id, kind, object_id, occurrence_date) DO UPDATE SET fire_at = EXCLUDED.fire_at;
+
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+    RETURN inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Напоминание о дедлайне за 24 часа; если до дедлайна уже меньше суток — сразу
+CREATE OR REPLACE FUNCTION enqueue_deadline_reminders(target_task_id INTEGER, target_user_id INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    INSERT INTO reminder_queue (user_id, kind, object_id, occurrence_date, fire_at)
+    SELECT t.user_id, 'deadline', t.id, t.deadline::date,
+           GREATEST((t.deadline AT TIME ZONE ns.timezone) - INTERVAL '24 hours', now())
+    FROM tasks t
+    JOIN notification_settings ns ON ns.user_id = t.user_id AND ns.deadline_reminder = TRUE
+    WHERE (target_task_id IS NULL OR t.id = target_task_id)
+      AND (target_user_id IS NULL OR t.user_id = target_user_id)
+      AND t.completed = FALSE
+      AND (t.deadline AT TIME ZONE ns.timezone) > now()
+      AND EXISTS (SELECT 1 FROM push_subscriptions ps WHERE ps.user_id = t.user_id)
+    ON CONFLICT (user_id, kind, object_id, occurrence_date) DO UPDATE SET fire_at = EXCLUDED.fire_at;
+
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+    RETURN inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_user_reminders(target_user_id INTEGER) RETURNS INTEGER AS $$
+BEGIN
+    DELETE FROM reminder_queue WHERE user_id = target_user_id;
+    RETURN enqueue_lesson_reminders(NULL, target_user_id) + enqueue_deadline_reminders(NULL, target_user_id);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sync_reminder_queue() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'notification_settings' THEN
+        PERFORM rebuild_user_reminders(NEW.user_id);
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM reminder_queue
+        WHERE kind = CASE WHEN TG_TABLE_NAME = 'schedule' THEN 'lesson' ELSE 'deadline' END
+          AND object_id = OLD.id;
+    END IF;
+
+    IF TG_OP <> 'DELETE' THEN
+        IF TG_TABLE_NAME = 'schedule' THEN
+            PERFORM enqueue_lesson_reminders(NEW.id, NEW.user_id);
+        ELSE
+            PERFORM enqueue_deadline_reminders(NEW.id, NEW.user_id);
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_reminder_queue ON schedule;
+CREATE TRIGGER trg_schedule_reminder_queue
+AFTER INSERT OR DELETE OR UPDATE OF user_id, day_of_week, start_time, week_parity, starts_on, ends_on, excluded_dates ON schedule
+FOR EACH ROW EXECUTE FUNCTION sync_reminder_queue();
+
+DROP TRIGGER IF EXISTS trg_tasks_reminder_queue ON tasks;
+CREATE TRIGGER trg_tasks_reminder_queue
+AFTER INSERT OR DELETE OR UPDATE OF user_id, deadline, completed ON tasks
+FOR EACH ROW EXECUTE FUNCTION sync_reminder_queue();
+
+DROP TRIGGER IF EXISTS trg_notification_settings_reminder_queue ON notification_settings;
+CREATE TRIGGER trg_notification_settings_reminder_queue
+AFTER INSERT OR UPDATE OF lessons_reminder, deadline_reminder, timezone ON notification_settings
+FOR EACH ROW EXECUTE FUNCTION sync_reminder_queue();
+
+-- Пары больше не выбираются по дню недели и времени начала — индекс из V0028 только замедлял запись
+DROP INDEX IF EXISTS idx_schedule_day_start_time;
+
+-- Начальное заполнение
+SELECT enqueue_lesson_reminders(NULL, NULL);
+SELECT enqueue_deadline_reminders(NULL, NULL);
+
+COMMENT ON COLUMN notification_settings.timezone IS 'Часовой пояс IANA, в котором считается время напоминаний';
+COMMENT ON TABLE reminder_queue IS 'Запланированные напоминания; занятия докручиваются на 14 дней вперёд еженедельным roll_reminder_queue';
@@ -0,0 +1,19 @@
+-- Шарды разбора очереди напоминаний: аренда для локальных воркеров и прогресс по каждому шарду
+CREATE TABLE IF NOT EXISTS reminder_shards (
+    shard_count INTEGER NOT NULL,
+    shard_index INTEGER NOT NULL,
+    worker_id VARCHAR(100),
+    leased_until TIMESTAMPTZ,
+    last_started_at TIMESTAMPTZ,
+    last_finished_at TIMESTAMPTZ,
+    last_claimed INTEGER NOT NULL DEFAULT 0,
+    last_sent INTEGER NOT NULL DEFAULT 0,
+    last_failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (shard_count, shard_index),
+    CHECK (shard_index >= 0 AND shard_index < shard_count)
+);
+
+-- Шард пользователя: хэш id, а не сам id, чтобы соседние регистрации не собирались в одном шарде
+CREATE OR REPLACE FUNCTION reminder_shard(target_user_id INTEGER, shard_count INTEGER) RETURNS INTEGER AS $$
+    SELECT (hashint4(target_user_id) & 2147483647) % shard_count;
+$$ LANGUAGE sql IMMUTABLE;
@@ -0,0 +1,32 @@
+-- Ежедневная сводка: один push в reminder_time по местному времени вместо отдельных напоминаний о дедлайнах
+ALTER TABLE notification_settings
+ADD COLUMN IF NOT EXISTS daily_digest BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Пользователи со сводкой узнают о дедлайнах из неё, отдельные напоминания им не ставим
+CREATE OR REPLACE FUNCTION enqueue_deadline_reminders(target_task_id INTEGER, target_user_id INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    INSERT INTO reminder_queue (user_id, kind, object_id, occurrence_date, fire_at)
+    SELECT t.user_id, 'deadline', t.id, t.deadline::date,
+           GREATEST((t.deadline AT TIME ZONE ns.timezone) - INTERVAL '24 hours', now())
+    FROM tasks t
+    JOIN notification_settings ns ON ns.user_id = t.user_id AND ns.deadline_reminder = TRUE AND ns.daily_digest = FALSE
+    WHERE (target_task_id IS NULL OR t.id = target_task_id)
+      AND (target_user_id IS NULL OR t.user_id = target_user_id)
+      AND t.completed = FALSE
+      AND (t.deadline AT TIME ZONE ns.timezone) > now()
+      AND EXISTS (SELECT 1 FROM push_subscriptions ps WHERE ps.user_id = t.user_id)
+    ON CONFLICT (user_id, kind, object_id, occurrence_date) DO UPDATE SET fire_at = EXCLUDED.fire_at;
+
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+    RETURN inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notification_settings_reminder_queue ON notification_settings;
+CREATE TRIGGER trg_notification_settings_reminder_queue
+AFTER INSERT OR UPDATE OF lessons_reminder, deadline_reminder, timezone, daily_digest ON notification_settings
+FOR EACH ROW EXECUTE FUNCTION sync_reminder_queue();
+
+COMMENT ON COLUMN notification_settings.daily_digest IS 'Сводка дня в reminder_time: пары сегодня, ближайшие и просроченные дедлайны';
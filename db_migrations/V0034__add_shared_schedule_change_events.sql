@@ -0,0 +1,29 @@
+-- Изменения расписания владельца копятся по расшаренным расписаниям и рассылаются подписчикам пачкой
+CREATE TABLE IF NOT EXISTS shared_schedule_changes (
+    shared_schedule_id INTEGER PRIMARY KEY REFERENCES shared_schedules(id) ON DELETE CASCADE,
+    first_change_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_change_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    change_count INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE INDEX IF NOT EXISTS idx_shared_schedule_changes_last ON shared_schedule_changes(last_change_at);
+
+-- Десять правок подряд — одна строка со счётчиком, а не десять событий
+CREATE OR REPLACE FUNCTION record_shared_schedule_change() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO shared_schedule_changes (shared_schedule_id)
+    SELECT ss.id FROM shared_schedules ss
+    WHERE ss.owner_user_id = CASE WHEN TG_OP = 'DELETE' THEN OLD.user_id ELSE NEW.user_id END
+      AND ss.is_active = TRUE
+    ON CONFLICT (shared_schedule_id) DO UPDATE
+    SET last_change_at = now(), change_count = shared_schedule_changes.change_count + 1;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_schedule_shared_changes ON schedule;
+CREATE TRIGGER trg_schedule_shared_changes
+AFTER INSERT OR DELETE OR UPDATE OF subject, type, start_time, end_time, day_of_week, room, teacher,
+                                    week_parity, starts_on, ends_on, excluded_dates ON schedule
+FOR EACH ROW EXECUTE FUNCTION record_shared_schedule_change();
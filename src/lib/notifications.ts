@@ -43,7 +43,8 @@ export const notificationService = {
       },
       body: JSON.stringify({
         action: 'subscribe',
-        subscription: subscription.toJSON()
+        subscription: subscription.toJSON(),
+        timezone: Intl.DateTimeFormat().resolvedOptions().timeZone
       })
     });
 
@@ -0,0 +1,75 @@
+const SCHEDULE_URL = 'https://functions.poehali.dev/7030dc26-77cd-4b59-91e6-1be52f31cf8d';
+const TASKS_PAGE_SIZE = 500;
+
+export interface TaskPage<T> {
+  tasks: T[];
+  nextCursor: string | null;
+}
+
+export interface TaskStats {
+  total: number;
+  completed: number;
+  active: number;
+  overdue: number;
+  high_priority: number;
+  week_total: number;
+  week_completed: number;
+  created_week: number;
+  subjects: { subject: string; total: number; completed: number }[];
+  priorities: { priority: string; total: number; completed: number }[];
+}
+
+// Одна страница задач; следующую запрашиваем по nextCursor.
+// Без status сервер отдаёт только незавершённые задачи.
+export async function fetchTasksPage<T>(
+  token: string | null,
+  params: Record<string, string> = {},
+  cursor: string | null = null
+): Promise<TaskPage<T>> {
+  const query = new URLSearchParams({ path: 'tasks', limit: String(TASKS_PAGE_SIZE), ...params });
+  if (cursor) {
+    query.set('cursor', cursor);
+  }
+
+  const response = await fetch(`${SCHEDULE_URL}?${query}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!response.ok) {
+    throw new Error(`Не удалось загрузить задачи: ${response.status}`);
+  }
+
+  const data = await response.json();
+  return { tasks: data.tasks || [], nextCursor: data.next_cursor || null };
+}
+
+// Все задачи выборки: ходим по next_cursor, пока страницы не кончатся.
+// Только для ограниченных выборок (открытые, диапазон дат) — для статистики есть fetchTaskStats.
+export async function fetchTasks<T>(token: string | null, params: Record<string, string> = {}): Promise<T[]> {
+  const tasks: T[] = [];
+  let cursor: string | null = null;
+
+  do {
+    const page: TaskPage<T> = await fetchTasksPage<T>(token, params, cursor);
+    tasks.push(...page.tasks);
+    cursor = page.nextCursor;
+  } while (cursor);
+
+  return tasks;
+}
+
+// Счётчики задач считает сервер одним агрегирующим запросом
+export async function fetchTaskStats(token: string | null): Promise<TaskStats> {
+  const query = new URLSearchParams({
+    path: 'tasks_stats',
+    tz: Intl.DateTimeFormat().resolvedOptions().timeZone
+  });
+
+  const response = await fetch(`${SCHEDULE_URL}?${query}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!response.ok) {
+    throw new Error(`Не удалось загрузить статистику задач: ${response.status}`);
+  }
+
+  return response.json();
+}
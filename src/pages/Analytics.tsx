@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { authService } from '@/lib/auth';
+import { fetchTaskStats, TaskStats } from '@/lib/tasks';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -19,16 +20,6 @@ interface Lesson {
   day_of_week: number;
 }
 
-interface Task {
-  id: number;
-  title: string;
-  subject?: string;
-  deadline?: string;
-  priority: string;
-  completed: boolean;
-  created_at: string;
-}
-
 interface Material {
   id: number;
   title: string;
@@ -40,7 +31,7 @@ const Analytics = () => {
   const navigate = useNavigate();
   const { toast } = useToast();
   const [schedule, setSchedule] = useState<Lesson[]>([]);
-  const [tasks, setTasks] = useState<Task[]>([]);
+  const [taskStats, setTaskStats] = useState<TaskStats | null>(null);
   const [materials, setMaterials] = useState<Material[]>([]);
   const [loading, setLoading] = useState(true);
 
@@ -59,13 +50,11 @@ const Analytics = () => {
     try {
       const token = authService.getToken();
       
-      const [scheduleRes, tasksRes, materialsRes] = await Promise.all([
+      const [scheduleRes, stats, materialsRes] = await Promise.all([
         fetch(`${SCHEDULE_URL}?path=schedule`, {
           headers: { 'Authorization': `Bearer ${token}` }
         }),
-        fetch(`${SCHEDULE_URL}?path=tasks`, {
-          headers: { 'Authorization': `Bearer ${token}` }
-        }),
+        fetchTaskStats(token),
         fetch(MATERIALS_URL, {
           headers: { 'Authorization': `Bearer ${token}` }
         })
@@ -76,10 +65,7 @@ const Analytics = () => {
         setSchedule(data.schedule);
       }
 
-      if (tasksRes.ok) {
-        const data = await tasksRes.json();
-        setTasks(data.tasks);
-      }
+      setTaskStats(stats);
 
       if (materialsRes.ok) {
         const data = await materialsRes.json();
@@ -112,13 +98,11 @@ const Analytics = () => {
       stats[lesson.subject].lessons++;
     });
 
-    tasks.forEach(task => {
-      if (task.subject) {
-        if (!stats[task.subject]) {
-          stats[task.subject] = { lessons: 0, tasks: 0, materials: 0 };
-        }
-        stats[task.subject].tasks++;
+    taskStats?.subjects.forEach(({ subject, total }) => {
+      if (!stats[subject]) {
+        stats[subject] = { lessons: 0, tasks: 0, materials: 0 };
       }
+      stats[subject].tasks += total;
     });
 
     materials.forEach(material => {
@@ -142,9 +126,9 @@ const Analytics = () => {
   const getTaskCompletionByPriority = () => {
     const priorities = ['high', 'medium', 'low'];
     return priorities.map(priority => {
-      const filtered = tasks.filter(t => t.priority === priority);
-      const completed = filtered.filter(t => t.completed).length;
-      const total = filtered.length;
+      const counts = taskStats?.priorities.find(p => p.priority === priority);
+      const completed = counts?.completed || 0;
+      const total = counts?.total || 0;
       const rate = total > 0 ? Math.round((completed / total) * 100) : 0;
       
       return {
@@ -179,9 +163,7 @@ const Analytics = () => {
       new Date(m.created_at) >= sevenDaysAgo
     ).length;
     
-    const recentTasks = tasks.filter(t => 
-      t.created_at && new Date(t.created_at) >= sevenDaysAgo
-    ).length;
+    const recentTasks = taskStats?.created_week || 0;
 
     return {
       materials: recentMaterials,
@@ -196,12 +178,10 @@ const Analytics = () => {
   const dayStats = getTasksByDay();
   const recentActivity = getRecentActivity();
   
-  const completedTasks = tasks.filter(t => t.completed).length;
-  const completionRate = tasks.length > 0 ? Math.round((completedTasks / tasks.length) * 100) : 0;
-  const overdueTasks = tasks.filter(t => {
-    if (!t.deadline || t.completed) return false;
-    return new Date(t.deadline) < new Date();
-  }).length;
+  const totalTasks = taskStats?.total || 0;
+  const completedTasks = taskStats?.completed || 0;
+  const completionRate = totalTasks > 0 ? Math.round((completedTasks / totalTasks) * 100) : 0;
+  const overdueTasks = taskStats?.overdue || 0;
 
   if (loading) {
     return (
@@ -257,7 +237,7 @@ const Analytics = () => {
               <Badge className="bg-green-600">{completionRate}%</Badge>
             </div>
             <h3 className="text-sm font-semibold text-gray-600">Процент выполнения</h3>
-            <p className="text-2xl font-bold text-green-800 mt-2">{completedTasks}/{tasks.length}</p>
+            <p className="text-2xl font-bold text-green-800 mt-2">{completedTasks}/{totalTasks}</p>
           </Card>
 
           <Card className="p-6 bg-gradient-to-br from-purple-50 to-fuchsia-100 border-2 border-purple-200">
@@ -280,7 +260,7 @@ const Analytics = () => {
             </div>
             <h3 className="text-sm font-semibold text-gray-600">Просроченных задач</h3>
             <p className="text-2xl font-bold text-red-800 mt-2">
-              {tasks.filter(t => !t.completed).length} активных
+              {taskStats?.active || 0} активных
             </p>
           </Card>
         </div>
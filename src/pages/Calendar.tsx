@@ -6,6 +6,7 @@ import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
+import { fetchTasks } from '@/lib/tasks';
 
 const SCHEDULE_URL = 'https://functions.poehali.dev/7030dc26-77cd-4b59-91e6-1be52f31cf8d';
 
@@ -52,11 +53,16 @@ const Calendar = () => {
         return;
       }
       await loadSchedule();
-      await loadTasks();
     };
     checkAuth();
   }, [navigate]);
 
+  useEffect(() => {
+    if (authService.isAuthenticated()) {
+      loadTasks();
+    }
+  }, [currentDate]);
+
   const loadSchedule = async () => {
     try {
       const token = authService.getToken();
@@ -72,16 +78,27 @@ const Calendar = () => {
     }
   };
 
+  const formatDateParam = (date: Date) => {
+    const month = String(date.getMonth() + 1).padStart(2, '0');
+    const day = String(date.getDate()).padStart(2, '0');
+    return `${date.getFullYear()}-${month}-${day}`;
+  };
+
+  // Только задачи с дедлайном в видимой сетке месяца (42 дня с понедельника), с запасом в день на часовой пояс
   const loadTasks = async () => {
     try {
       const token = authService.getToken();
-      const response = await fetch(`${SCHEDULE_URL}?path=tasks`, {
-        headers: { 'Authorization': `Bearer ${token}` }
-      });
-      if (response.ok) {
-        const data = await response.json();
-        setTasks(data.tasks);
-      }
+      const year = currentDate.getFullYear();
+      const month = currentDate.getMonth();
+      const firstDay = new Date(year, month, 1);
+      const startDay = firstDay.getDay() === 0 ? 6 : firstDay.getDay() - 1;
+      const from = new Date(year, month, 1 - startDay - 1);
+      const to = new Date(year, month, 1 - startDay + 42);
+      setTasks(await fetchTasks<Task>(token, {
+        status: 'all',
+        deadline_from: formatDateParam(from),
+        deadline_to: formatDateParam(to)
+      }));
     } catch (error) {
       console.error('Failed to load tasks:', error);
     }
@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { authService } from '@/lib/auth';
+import { fetchTasksPage, fetchTaskStats, TaskStats } from '@/lib/tasks';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -40,6 +41,11 @@ interface Task {
   completed: boolean;
 }
 
+type TaskFilter = 'all' | 'active' | 'completed';
+
+const TASK_FILTER_STATUS: Record<TaskFilter, string> = { all: 'all', active: 'open', completed: 'completed' };
+const TASKS_LIST_PAGE_SIZE = '50';
+
 const Index = () => {
   const navigate = useNavigate();
   const { toast } = useToast();
@@ -47,11 +53,13 @@ const Index = () => {
   const [user, setUser] = useState(authService.getUser());
   const [schedule, setSchedule] = useState<Lesson[]>([]);
   const [tasks, setTasks] = useState<Task[]>([]);
+  const [tasksCursor, setTasksCursor] = useState<string | null>(null);
+  const [taskStats, setTaskStats] = useState<TaskStats | null>(null);
   const [isAddingLesson, setIsAddingLesson] = useState(false);
   const [isAddingTask, setIsAddingTask] = useState(false);
   const [isExamReminderOpen, setIsExamReminderOpen] = useState(false);
   const [selectedDay, setSelectedDay] = useState(1);
-  const [taskFilter, setTaskFilter] = useState<'all' | 'active' | 'completed'>('all');
+  const [taskFilter, setTaskFilter] = useState<TaskFilter>('active');
   const [taskSearch, setTaskSearch] = useState('');
 
   const [lessonForm, setLessonForm] = useState({
@@ -108,21 +116,43 @@ const Index = () => {
     }
   };
 
-  const loadTasks = async () => {
+  // Первая страница выбранного вида списка; счётчики для статистики приходят отдельно, без выгрузки истории
+  const loadTasks = async (filter: TaskFilter = taskFilter) => {
     try {
       const token = authService.getToken();
-      const response = await fetch(`${SCHEDULE_URL}?path=tasks`, {
-        headers: { 'Authorization': `Bearer ${token}` }
-      });
-      if (response.ok) {
-        const data = await response.json();
-        setTasks(data.tasks);
-      }
+      const [page, stats] = await Promise.all([
+        fetchTasksPage<Task>(token, { status: TASK_FILTER_STATUS[filter], limit: TASKS_LIST_PAGE_SIZE }),
+        fetchTaskStats(token)
+      ]);
+      setTasks(page.tasks);
+      setTasksCursor(page.nextCursor);
+      setTaskStats(stats);
+    } catch (error) {
+      console.error('Failed to load tasks:', error);
+    }
+  };
+
+  const loadMoreTasks = async () => {
+    if (!tasksCursor) return;
+    try {
+      const token = authService.getToken();
+      const page = await fetchTasksPage<Task>(
+        token,
+        { status: TASK_FILTER_STATUS[taskFilter], limit: TASKS_LIST_PAGE_SIZE },
+        tasksCursor
+      );
+      setTasks(prev => [...prev, ...page.tasks]);
+      setTasksCursor(page.nextCursor);
     } catch (error) {
       console.error('Failed to load tasks:', error);
     }
   };
 
+  const handleTaskFilterChange = (filter: TaskFilter) => {
+    setTaskFilter(filter);
+    loadTasks(filter);
+  };
+
   const handleAddLesson = async () => {
     if (!lessonForm.subject || !lessonForm.start_time || !lessonForm.end_time) {
       toast({
@@ -220,7 +250,7 @@ const Index = () => {
           'Authorization': `Bearer ${token}`
         },
         body: JSON.stringify({
-          ...task,
+          id: task.id,
           completed: !task.completed
         })
       });
@@ -269,36 +299,19 @@ const Index = () => {
   };
 
   const todayLessons = schedule.filter(l => l.day_of_week === selectedDay);
-  const activeTasks = tasks.filter(t => !t.completed);
-  const completedTasks = tasks.filter(t => t.completed);
-  const completionRate = tasks.length > 0 ? Math.round((completedTasks.length / tasks.length) * 100) : 0;
-
-  const now = new Date();
-  const weekStart = new Date(now.getFullYear(), now.getMonth(), now.getDate() - now.getDay() + 1);
-  const weekTasks = tasks.filter(t => {
-    if (!t.deadline) return false;
-    const deadline = new Date(t.deadline);
-    return deadline >= weekStart;
-  });
-  const weekCompleted = weekTasks.filter(t => t.completed).length;
-  const weekCompletionRate = weekTasks.length > 0 ? Math.round((weekCompleted / weekTasks.length) * 100) : 0;
+  const totalTasks = taskStats?.total || 0;
+  const activeTasks = taskStats?.active || 0;
+  const completedTasks = taskStats?.completed || 0;
+  const completionRate = totalTasks > 0 ? Math.round((completedTasks / totalTasks) * 100) : 0;
 
-  const highPriorityTasks = activeTasks.filter(t => t.priority === 'high');
-  const overdueTasks = activeTasks.filter(t => {
-    if (!t.deadline) return false;
-    return new Date(t.deadline) < now;
-  });
+  const weekTasks = taskStats?.week_total || 0;
+  const weekCompleted = taskStats?.week_completed || 0;
+  const weekCompletionRate = weekTasks > 0 ? Math.round((weekCompleted / weekTasks) * 100) : 0;
 
-  const subjectStats = tasks.reduce((acc, task) => {
-    if (task.subject) {
-      if (!acc[task.subject]) {
-        acc[task.subject] = { total: 0, completed: 0 };
-      }
-      acc[task.subject].total++;
-      if (task.completed) acc[task.subject].completed++;
-    }
-    return acc;
-  }, {} as Record<string, { total: number; completed: number }>);
+  const highPriorityTasks = taskStats?.high_priority || 0;
+  const overdueTasks = taskStats?.overdue || 0;
+
+  const subjectStats = taskStats?.subjects || [];
 
   const uniqueSubjects = [...new Set(schedule.map(l => l.subject))];
   const totalScheduleHours = schedule.reduce((acc, l) => {
@@ -434,7 +447,7 @@ const Index = () => {
             <div className="relative z-10 flex items-center justify-between">
               <div>
                 <p className="text-sm font-medium text-gray-600 group-hover:text-white transition-colors">Активных задач</p>
-                <p className="text-4xl font-bold mt-3 bg-gradient-to-r from-purple-600 to-pink-600 bg-clip-text text-transparent group-hover:text-white transition-all">{activeTasks.length}</p>
+                <p className="text-4xl font-bold mt-3 bg-gradient-to-r from-purple-600 to-pink-600 bg-clip-text text-transparent group-hover:text-white transition-all">{activeTasks}</p>
               </div>
               <div className="w-14 h-14 bg-gradient-to-br from-purple-100 to-pink-100 group-hover:from-white/20 group-hover:to-white/10 rounded-2xl flex items-center justify-center transition-all shadow-lg">
                 <Icon name="CheckSquare" size={28} className="text-purple-600 group-hover:text-white transition-colors" />
@@ -653,21 +666,21 @@ const Index = () => {
               <div className="flex gap-2">
                 <Button
                   variant={taskFilter === 'all' ? 'default' : 'outline'}
-                  onClick={() => setTaskFilter('all')}
+                  onClick={() => handleTaskFilterChange('all')}
                   className="rounded-xl"
                 >
                   Все
                 </Button>
                 <Button
                   variant={taskFilter === 'active' ? 'default' : 'outline'}
-                  onClick={() => setTaskFilter('active')}
+                  onClick={() => handleTaskFilterChange('active')}
                   className="rounded-xl"
                 >
                   Активные
                 </Button>
                 <Button
                   variant={taskFilter === 'completed' ? 'default' : 'outline'}
-                  onClick={() => setTaskFilter('completed')}
+                  onClick={() => handleTaskFilterChange('completed')}
                   className="rounded-xl"
                 >
                   Выполненные
@@ -751,16 +764,10 @@ const Index = () => {
               ) : (
                 tasks
                   .filter(task => {
-                    const matchesSearch = taskSearch === '' ||
+                    // Статус уже отфильтрован сервером, поиск — по загруженным страницам
+                    return taskSearch === '' ||
                       task.title.toLowerCase().includes(taskSearch.toLowerCase()) ||
                       task.description?.toLowerCase().includes(taskSearch.toLowerCase());
-                    
-                    const matchesFilter = 
-                      taskFilter === 'all' ||
-                      (taskFilter === 'active' && !task.completed) ||
-                      (taskFilter === 'completed' && task.completed);
-                    
-                    return matchesSearch && matchesFilter;
                   })
                   .map((task) => (
                   <Card key={task.id} className={`p-5 bg-white hover:shadow-xl transition-all ${task.completed ? 'opacity-60' : ''}`}>
@@ -801,6 +808,11 @@ const Index = () => {
                   </Card>
                 ))
               )}
+              {tasksCursor && (
+                <Button variant="outline" onClick={loadMoreTasks} className="w-full rounded-xl">
+                  Показать ещё
+                </Button>
+              )}
             </div>
           </TabsContent>
 
@@ -816,8 +828,8 @@ const Index = () => {
                   <p className="text-sm text-gray-600 font-medium">Всего задач</p>
                   <Icon name="ListTodo" size={20} className="text-indigo-500" />
                 </div>
-                <p className="text-3xl font-bold text-indigo-600">{tasks.length}</p>
-                <p className="text-xs text-gray-500 mt-1">{activeTasks.length} активных</p>
+                <p className="text-3xl font-bold text-indigo-600">{totalTasks}</p>
+                <p className="text-xs text-gray-500 mt-1">{activeTasks} активных</p>
               </Card>
 
               <Card className="p-5 bg-white">
@@ -826,7 +838,7 @@ const Index = () => {
                   <Icon name="CheckCircle2" size={20} className="text-green-500" />
                 </div>
                 <p className="text-3xl font-bold text-green-600">{weekCompletionRate}%</p>
-                <p className="text-xs text-gray-500 mt-1">{weekCompleted} из {weekTasks.length} задач</p>
+                <p className="text-xs text-gray-500 mt-1">{weekCompleted} из {weekTasks} задач</p>
               </Card>
 
               <Card className="p-5 bg-white">
@@ -834,7 +846,7 @@ const Index = () => {
                   <p className="text-sm text-gray-600 font-medium">Просрочено</p>
                   <Icon name="AlertCircle" size={20} className="text-red-500" />
                 </div>
-                <p className="text-3xl font-bold text-red-600">{overdueTasks.length}</p>
+                <p className="text-3xl font-bold text-red-600">{overdueTasks}</p>
                 <p className="text-xs text-gray-500 mt-1">Требуют внимания</p>
               </Card>
 
@@ -843,7 +855,7 @@ const Index = () => {
                   <p className="text-sm text-gray-600 font-medium">Высокий приоритет</p>
                   <Icon name="Flag" size={20} className="text-orange-500" />
                 </div>
-                <p className="text-3xl font-bold text-orange-600">{highPriorityTasks.length}</p>
+                <p className="text-3xl font-bold text-orange-600">{highPriorityTasks}</p>
                 <p className="text-xs text-gray-500 mt-1">Важных задач</p>
               </Card>
             </div>
@@ -876,10 +888,10 @@ const Index = () => {
                   Прогресс по предметам
                 </h3>
                 <div className="space-y-3">
-                  {Object.keys(subjectStats).length === 0 ? (
+                  {subjectStats.length === 0 ? (
                     <p className="text-sm text-gray-500 text-center py-4">Нет данных по предметам</p>
                   ) : (
-                    Object.entries(subjectStats).slice(0, 5).map(([subject, stats]) => {
+                    subjectStats.slice(0, 5).map(({ subject, ...stats }) => {
                       const rate = Math.round((stats.completed / stats.total) * 100);
                       return (
                         <div key={subject}>
@@ -920,8 +932,8 @@ const Index = () => {
                     />
                   </div>
                   <div className="flex justify-between mt-2 text-xs text-gray-600">
-                    <span>Выполнено: {completedTasks.length}</span>
-                    <span>Активных: {activeTasks.length}</span>
+                    <span>Выполнено: {completedTasks}</span>
+                    <span>Активных: {activeTasks}</span>
                   </div>
                 </div>
                 {completionRate >= 80 && (
@@ -930,10 +942,10 @@ const Index = () => {
                     <p className="text-sm text-green-800 font-medium">Отличная работа! Так держать! 🎉</p>
                   </div>
                 )}
-                {overdueTasks.length > 0 && (
+                {overdueTasks > 0 && (
                   <div className="flex items-center gap-2 p-3 bg-red-100 border border-red-300 rounded-lg">
                     <Icon name="AlertTriangle" size={20} className="text-red-600" />
-                    <p className="text-sm text-red-800 font-medium">У вас {overdueTasks.length} просроченных задач. Обратите внимание!</p>
+                    <p className="text-sm text-red-800 font-medium">У вас {overdueTasks} просроченных задач. Обратите внимание!</p>
                   </div>
                 )}
               </div>
@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { authService } from '@/lib/auth';
+import { fetchTaskStats } from '@/lib/tasks';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -71,19 +72,19 @@ const Profile = () => {
     try {
       const token = authService.getToken();
       
-      const [materialsRes, tasksRes, scheduleRes] = await Promise.all([
+      // Число активных задач считает сервер, список не выгружаем
+      const [materialsRes, taskStats, scheduleRes] = await Promise.all([
         fetch(MATERIALS_URL, { headers: { 'Authorization': `Bearer ${token}` } }),
-        fetch(`${SCHEDULE_URL}?path=tasks`, { headers: { 'Authorization': `Bearer ${token}` } }),
+        fetchTaskStats(token).catch(() => null),
         fetch(`${SCHEDULE_URL}?path=schedule`, { headers: { 'Authorization': `Bearer ${token}` } })
       ]);
 
       const materials = materialsRes.ok ? await materialsRes.json() : { materials: [] };
-      const tasks = tasksRes.ok ? await tasksRes.json() : { tasks: [] };
       const schedule = scheduleRes.ok ? await scheduleRes.json() : { schedule: [] };
 
       setStats({
         materials: materials.materials?.length || 0,
-        tasks: tasks.tasks?.length || 0,
+        tasks: taskStats?.active || 0,
         schedule: schedule.schedule?.length || 0
       });
     } catch (error) {
@@ -217,7 +218,7 @@ const Profile = () => {
             <Card className="p-5 bg-gradient-to-br from-purple-50 to-pink-50 border-2 border-purple-200">
               <div className="flex items-center justify-between">
                 <div>
-                  <p className="text-sm text-gray-600 font-medium">Задач</p>
+                  <p className="text-sm text-gray-600 font-medium">Активных задач</p>
                   <p className="text-3xl font-bold text-purple-600 mt-1">{stats.tasks}</p>
                 </div>
                 <div className="w-12 h-12 bg-purple-100 rounded-xl flex items-center justify-center">
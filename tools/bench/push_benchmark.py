@@ -0,0 +1,85 @@
+"""Нагрузочный прогон движка отправки push: действие push_benchmark функции notifications на локальный стенд
+
+Функция вызывается в процессе, как её вызвала бы платформа, с X-Cron-Secret; push-сервис подменяет
+push_stub_server. Ключи VAPID и подписки генерируются на лету, БД не нужна.
+
+    pip install -r backend/notifications/requirements.txt
+    python tools/bench/push_benchmark.py --count 500 --concurrency 32
+"""
+
+import argparse
+import base64
+import json
+import os
+import secrets
+import sys
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from push_stub_server import PushStubHandler, start_server
+
+NOTIFICATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend', 'notifications')
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def make_subscription_keys() -> dict:
+    """Ключи браузерной подписки: открытый P-256 ключ (p256dh) и 16-байтный auth-секрет"""
+    client_key = ec.generate_private_key(ec.SECP256R1())
+    public_key = client_key.public_key().public_bytes(Encoding.X962, PublicFormat.UncompressedPoint)
+    return {'p256dh': b64url(public_key), 'auth': b64url(secrets.token_bytes(16))}
+
+
+def make_vapid_private_key() -> str:
+    """Закрытый ключ VAPID в виде, который принимает Vapid.from_string (32 байта, base64url)"""
+    private_value = ec.generate_private_key(ec.SECP256R1()).private_numbers().private_value
+    return b64url(private_value.to_bytes(32, 'big'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--delay-ms', type=float, default=0, help='задержка ответа стенда')
+    parser.add_argument('--target', help='URL уже запущенного стенда; без него стенд поднимается здесь')
+    args = parser.parse_args()
+
+    server = None
+    target = args.target
+    if not target:
+        server = start_server(delay_ms=args.delay_ms)
+        target = f'http://127.0.0.1:{server.server_address[1]}'
+
+    # Окружение функции задаётся до импорта: index читает его при загрузке модуля
+    cron_secret = secrets.token_urlsafe(16)
+    os.environ.update({
+        'PUSH_ENDPOINT_OVERRIDE': target,
+        'NOTIFICATIONS_CRON_SECRET': cron_secret,
+        'VAPID_PRIVATE_KEY': make_vapid_private_key()
+    })
+    sys.path.insert(0, NOTIFICATIONS_DIR)
+    import index
+
+    response = index.handler({
+        'httpMethod': 'POST',
+        'headers': {'X-Cron-Secret': cron_secret},
+        'body': json.dumps({
+            'action': 'push_benchmark',
+            'count': args.count,
+            'concurrency': args.concurrency,
+            'subscription': {'keys': make_subscription_keys()}
+        })
+    }, None)
+
+    print(f"HTTP {response['statusCode']}")
+    print(json.dumps(json.loads(response['body']), ensure_ascii=False, indent=2))
+    if server:
+        print(f'Стенд принял сообщений: {PushStubHandler.received}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
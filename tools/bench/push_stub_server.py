@@ -0,0 +1,62 @@
+"""Локальный стенд push-сервиса для нагрузочных прогонов: на любой POST отвечает 201 Created
+
+Запуск отдельно: python tools/bench/push_stub_server.py --port 8765 --delay-ms 20
+и PUSH_ENDPOINT_OVERRIDE=http://127.0.0.1:8765 у функции notifications.
+"""
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class PushStubHandler(BaseHTTPRequestHandler):
+    """Принимает зашифрованный payload, выжидает delay и отвечает как push-сервис"""
+    # Keep-alive, как у настоящих push-сервисов: иначе замеряем TCP-рукопожатия, а не движок отправки
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    received = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            PushStubHandler.received += 1
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, delay_ms: float = 0) -> ThreadingHTTPServer:
+    """Поднимает стенд в фоновом потоке; port=0 — свободный порт (смотрите server.server_address)"""
+    PushStubHandler.delay = delay_ms / 1000
+    server = ThreadingHTTPServer((host, port), PushStubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay-ms', type=float, default=0, help='задержка ответа, имитирует сеть до push-сервиса')
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, args.delay_ms)
+    print(f'Push stub on http://{args.host}:{server.server_address[1]} (delay {args.delay_ms} ms)')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f'Принято сообщений: {PushStubHandler.received}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()